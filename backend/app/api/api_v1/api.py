@@ -4,6 +4,8 @@ from app.api.api_v1.endpoints import entities, relationships, documents, query
 from app.api.api_v1.endpoints import graph
 from app.api.api_v1.endpoints import entity_types
 from app.api.api_v1.endpoints import relationship_types
+from app.api.api_v1.endpoints import jobs
+from app.api.api_v1.endpoints import search
 
 # 创建APIv1路由
 api_router = APIRouter()
@@ -16,4 +18,6 @@ api_router.include_router(documents.router, prefix="/documents", tags=["文档"]
 api_router.include_router(query.router, prefix="/query", tags=["查询"])
 api_router.include_router(graph.router, prefix="/graph", tags=["图谱"])
 api_router.include_router(entity_types.router, prefix="/entity-types", tags=["实体类型"])
-api_router.include_router(relationship_types.router, prefix="/relationship-types", tags=["关系类型"])
\ No newline at end of file
+api_router.include_router(relationship_types.router, prefix="/relationship-types", tags=["关系类型"])
+api_router.include_router(jobs.router, prefix="/jobs", tags=["任务"])
+api_router.include_router(search.router, prefix="/search", tags=["搜索"])
\ No newline at end of file
@@ -17,7 +17,13 @@ from fastapi.responses import FileResponse
 from app.models.entities.entity import Entity
 
 # 修正导入路径
-from app.services.knowledge_extractor import SpacyNERExtractor
+from app.services.extraction_jobs import extraction_queue
+from app.services.blob_store import BlobStore
+from app.services.text_cache import text_cache
+from app.services.document_processor import load_document_text
+from app.services.document_index import document_index
+from app.services.provenance_service import ProvenanceService
+from app.core.executors import run_io
 
 from pydantic import BaseModel
 from datetime import datetime
@@ -115,10 +121,17 @@ async def upload_document(
             doc_metadata=metadata_json  # 使用验证过的JSON
         )
         
-        # 添加到数据库
-        sqlite_db.add(doc_model)
-        sqlite_db.commit()
-        sqlite_db.refresh(doc_model)
+        # 添加到数据库；保存失败时归还已存入的内容引用并删除归档副本
+        try:
+            sqlite_db.add(doc_model)
+            sqlite_db.commit()
+            sqlite_db.refresh(doc_model)
+        except Exception:
+            sqlite_db.rollback()
+            await document_processor.release(result.document.content_hash)
+            if result.document.archived_path and os.path.exists(result.document.archived_path):
+                os.remove(result.document.archived_path)
+            raise
         
         print(f"Document saved to SQLite with ID: {doc_model.id}")
         
@@ -130,29 +143,16 @@ async def upload_document(
         else:
             print(f"WARNING: Could not verify document {doc_model.id} in database")
         
-        # 如果需要，提取知识
-        entities = []
-        relationships = []
+        # 如果需要，提交后台知识抽取任务
+        job = None
         extract_error = None
         
         if extract_knowledge:
             try:
-                # 创建知识抽取器 - 使用Neo4j
-                extractor = SpacyNERExtractor(neo4j_db)
-                
-                # 提取实体
-                entities = await extractor.extract_entities(result.document, result.text_content)
-                
-                # 提取关系
-                if len(entities) >= 2:
-                    relationships = await extractor.extract_relationships(result.document, entities, result.text_content)
-                    
-                    # 创建溯源记录
-                    await extractor.create_knowledge_traces(result.document, entities, relationships, result.text_content)
-                
+                job = await extraction_queue.enqueue(doc_model.id)
             except Exception as e:
                 extract_error = str(e)
-                print(f"Error during knowledge extraction: {e}")
+                print(f"Error enqueuing knowledge extraction: {e}")
 
         # 将文档转为字典以便序列化
         document_dict = doc_model.to_dict()
@@ -191,8 +191,6 @@ async def upload_document(
                 return {
                     "document": document_dict,
                     "entity": new_entity.dict(),
-                    "extracted_entities": 0,
-                    "extracted_relationships": 0,
                     "message": "Document processed successfully"
                 }
             except Exception as e:
@@ -200,14 +198,21 @@ async def upload_document(
         # 继续返回原始响应
         
         
+        message = "Document processed successfully"
+        if extract_error:
+            message += " but knowledge extraction could not be queued: " + extract_error
+        elif job and job["status"] == "succeeded":
+            # 相同内容已抽取过，直接复用结果
+            message += ", knowledge already extracted from identical content"
+        elif job:
+            message += ", knowledge extraction queued"
+        
         return {
             "document": document_dict,
-            "extracted_entities": len(entities),
-            "extracted_relationships": len(relationships),
+            "deduplicated": result.deduplicated,
+            "extraction_job": job,
             "extraction_error": extract_error,
-            "message": "Document processed successfully" + (
-                " but knowledge extraction failed: " + extract_error if extract_error else ""
-            )
+            "message": message
         }
     except HTTPException:
         # Re-raise HTTP exceptions as-is
@@ -248,14 +253,22 @@ async def process_url(
         
         return {
             "document": result.document,
-            "extracted_entities": 0,
-            "extracted_relationships": 0,
             "message": "URL processed successfully"
         }
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error processing URL: {str(e)}")
 
 
+@router.post("/reindex", response_model=Dict[str, Any])
+async def reindex_documents(
+    background_tasks: BackgroundTasks,
+    batch_size: Optional[int] = Query(None, ge=1, le=10000)
+):
+    """增量重建全文索引：只重新索引新增或内容变化的文档，并移除已删除文档的索引"""
+    background_tasks.add_task(document_index.reindex, batch_size)
+    return {"message": "文档索引增量更新已在后台开始"}
+
+
 @router.get("/", response_model=List[dict])
 async def read_documents(
     skip: int = 0,
@@ -348,17 +361,11 @@ async def preview_document(
                 "preview_available": True
             }
 
-        # 文本文件处理
+        # 文本文件处理（文本从缓存读取，只有首次预览才解析文件）
         if file_type in ["txt", "text"]:
             try:
-                async with aiofiles.open(file_path, 'rb') as f:
-                    binary_content = await f.read()
-                    
-                # 尝试将内容解码为文本
-                try:
-                    content = binary_content.decode('utf-8', errors='replace')
-                except UnicodeDecodeError:
-                    content = binary_content.decode('gbk', errors='replace')
+                extracted = await load_document_text(file_path, file_type, document.content_hash)
+                content = extracted.content
             except Exception as e:
                 content = f"Error reading file: {str(e)}"
                 preview_available = False
@@ -366,25 +373,22 @@ async def preview_document(
         # PDF文件处理
         elif file_type == "pdf":
             try:
-                # 使用同步方式处理PDF（因为PyPDF2不支持异步）
-                import PyPDF2
-                with open(file_path, 'rb') as f:
-                    pdf_reader = PyPDF2.PdfReader(f)
-                    text_content = []
-                    
-                    # 提取前5页或所有页面（如果少于5页）
-                    page_limit = min(5, len(pdf_reader.pages))
-                    for i in range(page_limit):
-                        page = pdf_reader.pages[i]
-                        text_content.append(f"==== 第 {i+1} 页 ====\n{page.extract_text()}")
-                    
-                    # 如果内容太长，进行截断
-                    content = "\n\n".join(text_content)
-                    if len(content) > 50000:
-                        content = content[:50000] + "...\n[内容过长，已截断]"
-                    
-                    if not content.strip():
-                        content = "[PDF 文件] 无法提取文本内容，可能是扫描件或图片PDF。"
+                extracted = await load_document_text(file_path, file_type, document.content_hash)
+                text_content = []
+                
+                # 提取前5页或所有页面（如果少于5页）
+                for page in extracted.pages[:5]:
+                    start = page["char_offset"]
+                    page_text = extracted.content[start:start + page["char_length"]]
+                    text_content.append(f"==== 第 {page['page']} 页 ====\n{page_text}")
+                
+                # 如果内容太长，进行截断
+                content = "\n\n".join(text_content)
+                if len(content) > 50000:
+                    content = content[:50000] + "...\n[内容过长，已截断]"
+                
+                if not content.strip():
+                    content = "[PDF 文件] 无法提取文本内容，可能是扫描件或图片PDF。"
             except Exception as e:
                 content = f"[PDF 文件] 处理出错: {str(e)}"
                 preview_available = False
@@ -393,12 +397,13 @@ async def preview_document(
         elif file_type in ["docx", "doc"]:
             if file_type == "docx":
                 try:
-                    # 使用python-docx处理docx文件
-                    import docx
-                    doc = docx.Document(file_path)
+                    extracted = await load_document_text(file_path, file_type, document.content_hash)
                     
-                    # 提取段落文本
-                    paragraphs = [p.text for p in doc.paragraphs if p.text.strip()]
+                    # 按段落偏移取出段落文本
+                    paragraphs = [
+                        extracted.content[p["char_offset"]:p["char_offset"] + p["char_length"]]
+                        for p in extracted.paragraphs
+                    ]
                     
                     # 如果段落太多，只取前100个
                     if len(paragraphs) > 100:
@@ -431,7 +436,7 @@ async def preview_document(
         return {
             "title": document.title,
             "type": document.type,
-            "content": "不支持预览的文件类型",
+            "content": content if preview_available else "不支持预览的文件类型",
             "is_image": False,
             "preview_available": preview_available
         } 
@@ -497,8 +502,10 @@ async def download_document(
         if not file_path or not os.path.exists(file_path):
             raise HTTPException(status_code=404, detail="Document file not found")
         
-        # 获取文件名
-        filename = os.path.basename(file_path)
+        # 存储路径是内容哈希，下载文件名取自文档标题，标题没有扩展名时按文档类型补上
+        filename = document.title or document.id
+        if document.type and not os.path.splitext(filename)[1]:
+            filename = f"{filename}.{document.type}"
         
         # 使用 FileResponse 处理文件下载
         return FileResponse(
@@ -526,7 +533,13 @@ async def delete_document(
         
         # 尝试删除物理文件
         try:
-            if document.file_path and os.path.exists(document.file_path):
+            blob_store = BlobStore()
+            if blob_store.owns(document.file_path):
+                # 内容寻址存储中的文件可能被其他文档共享，只减少引用计数
+                if await run_io(blob_store.release, document.content_hash):
+                    # 内容已无引用，一并清理其文本缓存
+                    await run_io(text_cache.invalidate, document.content_hash)
+            elif document.file_path and os.path.exists(document.file_path):
                 os.remove(document.file_path)
             
             if document.archived_path and os.path.exists(document.archived_path):
@@ -535,6 +548,16 @@ async def delete_document(
             # 记录错误但继续，因为数据库记录已删除
             print(f"Warning: Failed to delete physical file: {str(file_error)}")
         
+        # 从全文索引中移除，并删除来自该文档的溯源记录
+        try:
+            await document_index.delete_document(document_id)
+        except Exception as index_error:
+            print(f"Warning: Failed to remove document from index: {str(index_error)}")
+        try:
+            await ProvenanceService().delete_document_traces(document_id)
+        except Exception as trace_error:
+            print(f"Warning: Failed to delete knowledge traces: {str(trace_error)}")
+        
         # 从数据库删除记录
         sqlite_db.delete(document)
         sqlite_db.commit()
@@ -626,10 +649,10 @@ async def download_document(
 @router.post("/{document_id}/extract", response_model=Dict[str, Any])
 async def extract_knowledge(
     document_id: str,
-    sqlite_db: Session = Depends(get_sqlite_db),
-    neo4j_db: Neo4jDatabase = Depends(get_db)
+    force: bool = Query(False, description="即使相同内容已抽取过也重新抽取"),
+    sqlite_db: Session = Depends(get_sqlite_db)
 ):
-    """从文档提取知识"""
+    """提交文档知识抽取任务，抽取在后台执行，可通过 /jobs/{job_id} 查询进度"""
     try:
         # 获取文档
         document = sqlite_db.query(Document).filter(Document.id == document_id).first()
@@ -642,86 +665,20 @@ async def extract_knowledge(
         if not file_path or not os.path.exists(file_path):
             raise HTTPException(status_code=404, detail="Document file not found")
         
-        # 读取文档内容
-        content = ""
-        try:
-            # 读取文件内容（根据文件类型处理）
-            file_type = document.type.lower()
-            
-            # 文本文件
-            if file_type in ["txt", "text"]:
-                async with aiofiles.open(file_path, 'rb') as f:
-                    binary_content = await f.read()
-                
-                try:
-                    content = binary_content.decode('utf-8', errors='replace')
-                except UnicodeDecodeError:
-                    content = binary_content.decode('gbk', errors='replace')
-            
-            # PDF文件
-            elif file_type == "pdf":
-                import PyPDF2
-                with open(file_path, 'rb') as f:
-                    pdf_reader = PyPDF2.PdfReader(f)
-                    for page in pdf_reader.pages:
-                        content += page.extract_text() + "\n\n"
-            
-            # Word文件
-            elif file_type == "docx":
-                import docx
-                doc = docx.Document(file_path)
-                content = "\n\n".join([p.text for p in doc.paragraphs if p.text.strip()])
-            
-            # 其他文件类型
-            else:
-                # 尝试作为文本读取
-                try:
-                    async with aiofiles.open(file_path, 'rb') as f:
-                        binary_content = await f.read()
-                    content = binary_content.decode('utf-8', errors='replace')
-                except:
-                    raise HTTPException(
-                        status_code=400, 
-                        detail=f"Unsupported file type for knowledge extraction: {file_type}"
-                    )
-        except Exception as e:
-            raise HTTPException(
-                status_code=500, 
-                detail=f"Error reading document content: {str(e)}"
-            )
-        
-        # 创建知识抽取器
-        extractor = SpacyNERExtractor(neo4j_db)
-        
-        # 创建文档对象
-        source_document = SourceDocument(
-            id=UUID(document.id),
-            title=document.title,
-            type=document.type,
-            content_hash=document.content_hash,
-            file_path=document.file_path,
-            url=document.url,
-            archived_path=document.archived_path,
-            metadata=json.loads(document.doc_metadata) if document.doc_metadata else {}
-        )
+        job = await extraction_queue.enqueue(document_id, force=force)
         
-        # 提取实体
-        entities = await extractor.extract_entities(source_document, content)
-        
-        # 提取关系
-        relationships = []
-        if len(entities) >= 2:
-            relationships = await extractor.extract_relationships(source_document, entities, content)
-        
-        # 创建溯源记录
-        if entities or relationships:
-            await extractor.create_knowledge_traces(source_document, entities, relationships, content)
+        if job["status"] == "succeeded":
+            result = job.get("result") or {}
+            message = (f"该内容已抽取过：{result.get('extracted_entities', 0)} 个实体，"
+                       f"{result.get('extracted_relationships', 0)} 个关系。")
+        else:
+            message = "知识抽取任务已提交，正在后台处理。"
         
         return {
             "document_id": document_id,
-            "extracted_entities": len(entities),
-            "extracted_relationships": len(relationships),
-            "message": f"成功从文档中提取出 {len(entities)} 个实体和 {len(relationships)} 个关系。"
+            "job_id": job["id"],
+            "job": job,
+            "message": message
         }
     except HTTPException:
         raise
@@ -1,10 +1,13 @@
 # 文件: app/api/api_v1/endpoints/entities.py
 from typing import Any, Dict, List, Optional
 from uuid import UUID
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, BackgroundTasks
 from app.models.entities.entity import Entity
 from app.db.neo4j_db import Neo4jDatabase
 from app.api.deps import get_db
+from app.services.entity_name_index import entity_name_index
+from app.services.provenance_service import ProvenanceService
+from app.models.documents.knowledge_trace import KnowledgeTrace
 
 router = APIRouter()
 
@@ -14,44 +17,35 @@ router = APIRouter()
 @router.get("/search", response_model=List[Dict[str, Any]])
 async def search_entities(
     query: str = Query(..., min_length=1),
-    limit: int = Query(10, ge=1, le=50),
-    db: Neo4jDatabase = Depends(get_db)
+    limit: int = Query(10, ge=1, le=50)
 ):
-    """根据名称搜索实体"""
+    """根据名称搜索实体（前缀、拼音、子串与模糊匹配，按匹配程度排序）"""
     try:
-        # 修改Cypher查询以提高兼容性和性能
-        cypher_query = """
-        MATCH (n:Entity)
-        WHERE toLower(n.name) CONTAINS toLower($search_text)
-        RETURN n.id as id, n.name as name, 
-               CASE WHEN n.type IS NOT NULL THEN n.type ELSE (CASE 
-                   WHEN size([l IN labels(n) WHERE l <> 'Entity']) > 0 
-                   THEN [l IN labels(n) WHERE l <> 'Entity'][0] 
-                   ELSE 'Entity' END) 
-               END as type
-        LIMIT $limit
-        """
-        
-        # 执行查询 - 注意这里参数名改为search_text
-        async with db.driver.session(database=db.database) as session:
-            result = await session.run(cypher_query, search_text=query, limit=limit)
-            data = await result.data()
-            
-            # 确保所有结果的id字段是字符串而不是对象
-            for item in data:
-                if isinstance(item.get('id'), dict) and 'low' in item['id'] and 'high' in item['id']:
-                    item['id'] = str(UUID(int=(item['id']['high'] << 32) | item['id']['low']))
-                elif item.get('id') is not None:
-                    item['id'] = str(item['id'])
-            
-            print(f"Search results for '{query}': {len(data)} entities found")
-            return data
+        data = await entity_name_index.search(query, limit=limit)
+        print(f"Search results for '{query}': {len(data)} entities found")
+        return data
     except Exception as e:
         import traceback
         traceback.print_exc()
         print(f"Error searching entities: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error searching entities: {str(e)}")
 
+
+@router.post("/name-index/backfill", response_model=Dict[str, Any])
+async def backfill_entity_name_index(background_tasks: BackgroundTasks):
+    """重算全部实体的名称检索属性（小写、拼音），用于导入数据或安装拼音库之后"""
+    background_tasks.add_task(entity_name_index.backfill)
+    return {"message": "实体名称索引更新已在后台开始"}
+
+
+@router.post("/traces", response_model=Dict[str, List[KnowledgeTrace]])
+async def trace_entities_knowledge(
+    entity_ids: List[UUID],
+    limit_per_entity: Optional[int] = Query(None, ge=1, le=1000)
+):
+    """批量追溯多个实体的知识来源，返回 {实体ID: 溯源记录列表}"""
+    return await ProvenanceService().find_traces_for_entities(entity_ids, limit_per_entity=limit_per_entity)
+
 @router.get("/", response_model=List[Entity])
 async def read_entities(
     skip: int = 0,
@@ -153,6 +147,24 @@ async def get_entity_context(
     }
 
 
+@router.get("/{entity_id}/hierarchy", response_model=Dict[str, Any])
+async def get_entity_hierarchy(
+    entity_id: UUID,
+    rel_type: str = Query("IS_A", description="层次关系类型，如 IS_A、PART_OF"),
+    db: Neo4jDatabase = Depends(get_db)
+):
+    """获取实体的全部上位、下位实体及继承的属性"""
+    from app.services.knowledge_query import KnowledgeQueryService
+    from app.services.hierarchy_index import HierarchyIndexNotReady
+    
+    try:
+        return await KnowledgeQueryService(db).get_entity_hierarchy(entity_id, rel_type)
+    except HierarchyIndexNotReady as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @router.get("/{entity_id}/trace", response_model=List[dict])
 async def trace_entity_knowledge(
     entity_id: UUID,
@@ -165,122 +177,26 @@ async def trace_entity_knowledge(
         if entity is None:
             raise HTTPException(status_code=404, detail="Entity not found")
         
-        # 查询与实体关联的知识溯源记录
-        # 这里使用了简化的查询，实际可能需要根据您的数据模型调整
-        # 查询与实体关联的溯源记录和文档
-        cypher_query = """
-        MATCH (e:Entity {id: $entity_id})
-        OPTIONAL MATCH (e)-[:TRACED_TO]->(t:KnowledgeTrace)-[:FROM_DOCUMENT]->(d:Document)
-        RETURN t as trace, d as document
-        UNION
-        MATCH (e:Entity {id: $entity_id})
-        WHERE e.source_id IS NOT NULL
-        MATCH (d:Document {id: e.source_id})
-        RETURN null as trace, d as document
-        """
-        
-        # 如果上面的查询不适用于您的数据模型，您可以使用以下备选查询
-        # 通过 source_id 查找关联文档
-        fallback_query = """
-        MATCH (e:Entity {id: $entity_id})
-        WHERE e.source_id IS NOT NULL
-        RETURN e.source_id as document_id
-        """
-        
-        traces = []
-        
-        # 尝试执行主查询
-        try:
-            async with db.driver.session(database=db.database) as session:
-                result = await session.run(cypher_query, entity_id=str(entity_id))
-                records = await result.data()
-                
-                if records and len(records) > 0:
-                    # 处理查询结果
-                    for record in records:
-                        trace_data = record.get("trace")
-                        document_data = record.get("document")
-                        
-                        # 如果找到关联文档
-                        if document_data:
-                            trace_info = {
-                                "entity_id": str(entity_id),
-                                "document_id": document_data.get("id", ""),
-                                "document_title": document_data.get("title", "Unknown Document"),
-                                "document_type": document_data.get("type", "unknown"),
-                                "location_data": trace_data.get("location_data", {}) if trace_data else {},
-                                "excerpt": trace_data.get("excerpt", "") if trace_data else ""
-                            }
-                            traces.append(trace_info)
-                
-                # 如果主查询没有结果，尝试备选查询
-                if not traces:
-                    result = await session.run(fallback_query, entity_id=str(entity_id))
-                    records = await result.data()
-                    
-                    for record in records:
-                        document_id = record.get("document_id")
-                        if document_id:
-                            # 根据获取的文档ID尝试从数据库获取文档详情
-                            # 这里使用SQLite数据库查询，因为文档通常存储在SQLite中
-                            from sqlalchemy.orm import Session
-                            from app.db.sqlite_db import get_sqlite_db
-                            from app.db.models import Document
-                            
-                            # 创建一个依赖获取SQLite数据库连接
-                            sqlite_db = next(get_sqlite_db())
-                            
-                            # 查询文档
-                            document = sqlite_db.query(Document).filter(Document.id == document_id).first()
-                            
-                            if document:
-                                trace_info = {
-                                    "entity_id": str(entity_id),
-                                    "document_id": document_id,
-                                    "document_title": document.title,
-                                    "document_type": document.type,
-                                    "location_data": {},
-                                    "excerpt": ""
-                                }
-                                traces.append(trace_info)
-                            else:
-                                # 如果在SQLite中未找到文档，则使用基本信息
-                                trace_info = {
-                                    "entity_id": str(entity_id),
-                                    "document_id": document_id,
-                                    "document_title": "Unknown Document",
-                                    "document_type": "unknown",
-                                    "location_data": {},
-                                    "excerpt": ""
-                                }
-                                traces.append(trace_info)
-        
-        except Exception as query_error:
-            print(f"Error executing trace query: {query_error}")
-            # 如果查询出错，尝试使用实体的source_id
-            if entity.source_id:
-                trace_info = {
-                    "entity_id": str(entity_id),
-                    "document_id": str(entity.source_id),
-                    "document_title": "Source Document",
-                    "document_type": entity.source_type or "unknown",
-                    "location_data": entity.source_location or {},
-                    "excerpt": ""
-                }
-                traces.append(trace_info)
+        # 一次索引查询取出实体的溯源记录及来源文档信息
+        traces = await ProvenanceService().find_entity_trace_views(entity_id)
         
-        # 如果仍然没有任何溯源记录，创建一个模拟记录用于测试
-        if not traces and entity:
-            # 简单的模拟溯源记录，仅用于测试
-            trace_info = {
+        # 没有溯源记录时，退回实体记录的来源文档
+        if not traces and entity.source_id:
+            from app.db.sqlite_db import SessionLocal
+            from app.db.models import Document
+            sqlite_db = SessionLocal()
+            try:
+                document = sqlite_db.query(Document).filter(Document.id == str(entity.source_id)).first()
+            finally:
+                sqlite_db.close()
+            traces.append({
                 "entity_id": str(entity_id),
-                "document_id": str(entity.source_id) if entity.source_id else "mock-document-id",
-                "document_title": "关联文档",
-                "document_type": entity.source_type or "unknown",
+                "document_id": str(entity.source_id),
+                "document_title": document.title if document else "Unknown Document",
+                "document_type": document.type if document else (entity.source_type or "unknown"),
                 "location_data": entity.source_location or {},
-                "excerpt": "This is a mock trace record for testing purposes."
-            }
-            traces.append(trace_info)
+                "excerpt": ""
+            })
         
         return traces
     except Exception as e:
@@ -0,0 +1,47 @@
+# 文件: app/api/api_v1/endpoints/jobs.py
+from typing import List, Optional, Dict, Any
+from fastapi import APIRouter, HTTPException, Query
+from app.services.extraction_jobs import extraction_queue
+
+router = APIRouter()
+
+
+@router.post("/", response_model=Dict[str, Any])
+async def create_extraction_job(
+    document_id: str,
+    force: bool = Query(False, description="即使相同内容已抽取过也重新抽取")
+):
+    """提交文档知识抽取任务"""
+    try:
+        return await extraction_queue.enqueue(document_id, force=force)
+    except LookupError:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+
+@router.get("/", response_model=List[Dict[str, Any]])
+async def read_extraction_jobs(
+    document_id: Optional[str] = None,
+    status: Optional[str] = Query(None, description="queued, running, succeeded, failed, cancelled"),
+    skip: int = 0,
+    limit: int = 100
+):
+    """获取抽取任务列表"""
+    return await extraction_queue.list_jobs(document_id=document_id, status=status, skip=skip, limit=limit)
+
+
+@router.get("/{job_id}", response_model=Dict[str, Any])
+async def read_extraction_job(job_id: str):
+    """获取抽取任务状态与进度"""
+    job = await extraction_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.post("/{job_id}/cancel", response_model=Dict[str, Any])
+async def cancel_extraction_job(job_id: str):
+    """取消抽取任务"""
+    job = await extraction_queue.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
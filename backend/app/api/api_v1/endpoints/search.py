@@ -0,0 +1,55 @@
+# 文件: app/api/api_v1/endpoints/search.py
+from typing import Optional, Dict, Any
+import time
+from fastapi import APIRouter, HTTPException, Query, BackgroundTasks
+from app.core.executors import run_io
+from app.services.hybrid_search import hybrid_search, SEARCH_KINDS
+from app.services.vector_index import vector_index
+
+router = APIRouter()
+
+
+@router.get("/hybrid", response_model=Dict[str, Any])
+async def search_hybrid(
+    query: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=50),
+    kinds: Optional[str] = Query(None, description="逗号分隔的对象类型：document, entity"),
+    alpha: Optional[float] = Query(None, ge=0, le=1, description="向量得分权重，0为纯全文检索，1为纯向量检索")
+):
+    """混合检索文档与实体：融合全文检索的BM25得分与语义向量相似度"""
+    kind_list = [kind.strip() for kind in kinds.split(",") if kind.strip()] if kinds else None
+    if kind_list and any(kind not in SEARCH_KINDS for kind in kind_list):
+        raise HTTPException(status_code=400, detail=f"kinds must be among: {', '.join(SEARCH_KINDS)}")
+
+    started = time.perf_counter()
+    try:
+        results = await hybrid_search.search(query, limit=limit, kinds=kind_list, alpha=alpha)
+    except Exception as e:
+        print(f"Error in hybrid search: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error in hybrid search: {str(e)}")
+    return {
+        "query": query,
+        "results": results,
+        "took_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+@router.post("/hybrid/reindex", response_model=Dict[str, Any])
+async def reindex_hybrid(
+    background_tasks: BackgroundTasks,
+    train: bool = Query(False, description="更新后重新训练向量索引的聚类中心")
+):
+    """增量更新文档与实体的语义向量（后台执行）"""
+    async def run():
+        await hybrid_search.reindex()
+        if train:
+            await run_io(vector_index.train)
+
+    background_tasks.add_task(run)
+    return {"message": "向量索引增量更新已在后台开始"}
+
+
+@router.get("/hybrid/stats", response_model=Dict[str, Any])
+async def hybrid_index_stats():
+    """向量索引规模与训练状态"""
+    return await run_io(vector_index.stats)
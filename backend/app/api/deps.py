@@ -1,17 +1,16 @@
 # 文件: app/api/deps.py
 from typing import Generator
 from app.db.neo4j_db import Neo4jDatabase
+from app.db.neo4j_driver import get_driver
 from app.core.config import settings
 
 
 async def get_db() -> Generator:  # type: ignore
-    """获取数据库连接"""
-    db = Neo4jDatabase(
-        uri=settings.NEO4J_URI,
-        user=settings.NEO4J_USER,
-        password=settings.NEO4J_PASSWORD,
-        database=settings.NEO4J_DATABASE
-    )
+    """获取数据库连接
+    
+    复用进程级共享驱动，每个请求只拿到一个轻量包装，会话按需从连接池借出。
+    """
+    db = Neo4jDatabase.from_driver(get_driver(), database=settings.NEO4J_DATABASE)
     try:
         yield db
     finally:
@@ -15,22 +15,127 @@ class Settings(BaseSettings):
     NEO4J_USER: str = os.getenv("NEO4J_USER", "neo4j")
     NEO4J_PASSWORD: str = os.getenv("NEO4J_PASSWORD", "password")
     NEO4J_DATABASE: str = os.getenv("NEO4J_DATABASE", "neo4j")
+    
+    # Neo4j连接池配置（进程内共享一个驱动）
+    NEO4J_MAX_CONNECTION_POOL_SIZE: int = int(os.getenv("NEO4J_MAX_CONNECTION_POOL_SIZE", "50"))
+    NEO4J_CONNECTION_ACQUISITION_TIMEOUT: float = float(os.getenv("NEO4J_CONNECTION_ACQUISITION_TIMEOUT", "30"))
+    NEO4J_MAX_CONNECTION_LIFETIME: int = int(os.getenv("NEO4J_MAX_CONNECTION_LIFETIME", "3600"))
+    # 空闲连接超过该秒数后，借出前先做一次存活检测；设为空值时关闭检测
+    NEO4J_LIVENESS_CHECK_TIMEOUT: Optional[float] = (
+        float(os.getenv("NEO4J_LIVENESS_CHECK_TIMEOUT", "60"))
+        if os.getenv("NEO4J_LIVENESS_CHECK_TIMEOUT", "60").strip() else None
+    )
+    # 批量写入时每个事务包含的行数
+    NEO4J_WRITE_BATCH_SIZE: int = int(os.getenv("NEO4J_WRITE_BATCH_SIZE", "500"))
       
     # 文件存储路径
     DOCUMENTS_DIR: str = os.getenv("DOCUMENTS_DIR", "./data/documents")
     ARCHIVES_DIR: str = os.getenv("ARCHIVES_DIR", "./data/archives")
+    # 内容寻址存储目录：文件按sha256分片存放，相同内容只保存一份
+    BLOBS_DIR: str = os.getenv("BLOBS_DIR", "./data/blobs")
+    # 抽取文本缓存目录与磁盘预算（字节），超出时按最近访问淘汰
+    TEXT_CACHE_DIR: str = os.getenv("TEXT_CACHE_DIR", "./data/text_cache")
+    TEXT_CACHE_MAX_BYTES: int = int(os.getenv("TEXT_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
     EXPORTS_DIR: str = os.getenv("EXPORTS_DIR", "./data/exports")
     
+    # 上传配置：按块流式写入磁盘，超过最大字节数时拒绝
+    UPLOAD_MAX_SIZE: int = int(os.getenv("UPLOAD_MAX_SIZE", str(512 * 1024 * 1024)))
+    UPLOAD_CHUNK_SIZE: int = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+    
     # CORS配置
     CORS_ORIGINS: list = ["*"]
     
     # NLP配置
     SPACY_MODEL: str = os.getenv("SPACY_MODEL", "zh_core_web_sm")
+    # 按内容哈希缓存的spaCy解析结果数量
+    NLP_DOC_CACHE_SIZE: int = int(os.getenv("NLP_DOC_CACHE_SIZE", "32"))
+    # 单个文档参与抽取的最大字符数
+    NLP_MAX_TEXT_LENGTH: int = int(os.getenv("NLP_MAX_TEXT_LENGTH", "1000000"))
+    # 长文档按页/段落切块，每块的最大字符数
+    NLP_CHUNK_SIZE: int = int(os.getenv("NLP_CHUNK_SIZE", "20000"))
+    # nlp.pipe 的批大小与工作进程数（>1时启用多进程解析）
+    NLP_PIPE_BATCH_SIZE: int = int(os.getenv("NLP_PIPE_BATCH_SIZE", "8"))
+    NLP_PIPE_PROCESSES: int = int(os.getenv("NLP_PIPE_PROCESSES", "1"))
+    
+    # 阻塞任务执行器配置：io 为线程池，cpu 为进程池（EXECUTOR_CPU_MODE=thread 时改用线程池）
+    EXECUTOR_IO_WORKERS: int = int(os.getenv("EXECUTOR_IO_WORKERS", "8"))
+    EXECUTOR_CPU_WORKERS: int = int(os.getenv("EXECUTOR_CPU_WORKERS", str(os.cpu_count() or 2)))
+    EXECUTOR_CPU_MODE: str = os.getenv("EXECUTOR_CPU_MODE", "process")
+    EXECUTOR_PROCESS_START_METHOD: str = os.getenv("EXECUTOR_PROCESS_START_METHOD", "spawn")
+    # 任务排队等待超过该秒数时记录警告
+    EXECUTOR_SLOW_WAIT_SECONDS: float = float(os.getenv("EXECUTOR_SLOW_WAIT_SECONDS", "5"))
+    
+    # 文档全文索引（SQLite FTS5）路径与连接参数
+    DOCUMENT_INDEX_PATH: str = os.getenv("DOCUMENT_INDEX_PATH", "./data/index/documents_index.db")
+    DOCUMENT_INDEX_CACHE_SIZE_KB: int = int(os.getenv("DOCUMENT_INDEX_CACHE_SIZE_KB", str(64 * 1024)))
+    DOCUMENT_INDEX_MMAP_SIZE: int = int(os.getenv("DOCUMENT_INDEX_MMAP_SIZE", str(256 * 1024 * 1024)))
+    # 全文索引分词模式：trigram（默认）、jieba 或 unicode61；变更后启动时在后台重建索引
+    DOCUMENT_INDEX_TOKENIZER: str = os.getenv("DOCUMENT_INDEX_TOKENIZER", "trigram")
+    DOCUMENT_INDEX_REBUILD_BATCH_SIZE: int = int(os.getenv("DOCUMENT_INDEX_REBUILD_BATCH_SIZE", "500"))
+    # 全文索引正文的zlib压缩级别（1-9）
+    DOCUMENT_INDEX_COMPRESSION_LEVEL: int = int(os.getenv("DOCUMENT_INDEX_COMPRESSION_LEVEL", "6"))
+    # 检索结果片段包含的词数（trigram模式下为三元组数）
+    DOCUMENT_INDEX_SNIPPET_TOKENS: int = int(os.getenv("DOCUMENT_INDEX_SNIPPET_TOKENS", "32"))
+    
+    # 向量索引（NumPy内存映射上的IVF）配置
+    VECTOR_INDEX_DIR: str = os.getenv("VECTOR_INDEX_DIR", "./data/vectors")
+    # 倒排列表数量，0表示训练时按 sqrt(向量数) 自动确定
+    VECTOR_INDEX_NLIST: int = int(os.getenv("VECTOR_INDEX_NLIST", "0"))
+    # 查询时探查的倒排列表数量，越大召回越高、越慢
+    VECTOR_INDEX_NPROBE: int = int(os.getenv("VECTOR_INDEX_NPROBE", "32"))
+    # 向量数达到该值后才训练聚类中心，之前使用暴力检索
+    VECTOR_INDEX_TRAIN_MIN: int = int(os.getenv("VECTOR_INDEX_TRAIN_MIN", "20000"))
+    VECTOR_INDEX_TRAIN_ITERATIONS: int = int(os.getenv("VECTOR_INDEX_TRAIN_ITERATIONS", "10"))
+    
+    # 语义嵌入（使用实体链接组件的roberta模型）的维度、批量大小及文档分块字符数
+    EMBEDDING_DIM: int = int(os.getenv("EMBEDDING_DIM", "768"))
+    EMBEDDING_BATCH_SIZE: int = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+    EMBEDDING_CHUNK_CHARS: int = int(os.getenv("EMBEDDING_CHUNK_CHARS", "400"))
+    
+    # 混合检索：向量得分权重（0为纯全文检索，1为纯向量检索）及每路召回的候选数
+    HYBRID_SEARCH_ALPHA: float = float(os.getenv("HYBRID_SEARCH_ALPHA", "0.5"))
+    HYBRID_SEARCH_CANDIDATES: int = int(os.getenv("HYBRID_SEARCH_CANDIDATES", "100"))
+    
+    # PDF页数不少于该值时按页段并行解析，每个任务解析的页数
+    PDF_PARALLEL_MIN_PAGES: int = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "32"))
+    PDF_PAGES_PER_TASK: int = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+    
+    # 知识抽取后台任务配置
+    EXTRACTION_WORKERS: int = int(os.getenv("EXTRACTION_WORKERS", "2"))
+    EXTRACTION_MAX_ATTEMPTS: int = int(os.getenv("EXTRACTION_MAX_ATTEMPTS", "3"))
+    EXTRACTION_RETRY_BACKOFF: float = float(os.getenv("EXTRACTION_RETRY_BACKOFF", "5"))
+    EXTRACTION_POLL_INTERVAL: float = float(os.getenv("EXTRACTION_POLL_INTERVAL", "2"))
+    
+    # 规则推理：不动点迭代的最大轮数，以及每个写事务最多处理的匹配行数
+    INFERENCE_MAX_ITERATIONS: int = int(os.getenv("INFERENCE_MAX_ITERATIONS", "50"))
+    INFERENCE_WRITE_BATCH_SIZE: int = int(os.getenv("INFERENCE_WRITE_BATCH_SIZE", "5000"))
+    # 分批求值时每个模式最多执行的批数，防止规则不收敛时无限循环
+    INFERENCE_MAX_BATCHES: int = int(os.getenv("INFERENCE_MAX_BATCHES", "1000"))
+    # 同一层内互不依赖的规则并发执行时的最大并发数（每条规则使用独立会话）
+    INFERENCE_MAX_CONCURRENCY: int = int(os.getenv("INFERENCE_MAX_CONCURRENCY", "4"))
+    # 规则文件（JSON，为空时使用默认规则）；开启后关系写入时在后台增量推理
+    INFERENCE_RULES_FILE: str = os.getenv("INFERENCE_RULES_FILE", "")
+    INFERENCE_INCREMENTAL: bool = os.getenv("INFERENCE_INCREMENTAL", "false").lower() == "true"
+    # 为false时默认规则不再物化 IS_A/PART_OF 传递闭包与属性继承边，改由内存中的层次索引回答
+    INFERENCE_MATERIALIZE_HIERARCHY: bool = os.getenv("INFERENCE_MATERIALIZE_HIERARCHY", "true").lower() == "true"
+    
+    # 层次关系闭包索引：参与索引的关系类型（逗号分隔）及属性继承使用的关系类型
+    HIERARCHY_RELATIONSHIP_TYPES: str = os.getenv("HIERARCHY_RELATIONSHIP_TYPES", "IS_A,PART_OF")
+    HIERARCHY_PROPERTY_TYPE: str = os.getenv("HIERARCHY_PROPERTY_TYPE", "HAS_PROPERTY")
+    # 关系写入后在后台重建闭包标号，两次重建的最小间隔（秒）；重建完成前查询在内存邻接表上遍历
+    HIERARCHY_REBUILD_INTERVAL: float = float(os.getenv("HIERARCHY_REBUILD_INTERVAL", "5"))
     
     # 其他配置
     DEFAULT_PAGE_SIZE: int = 20
     MAX_PAGE_SIZE: int = 100
     
+    @validator("NEO4J_LIVENESS_CHECK_TIMEOUT", pre=True)
+    def empty_as_none(cls, v):
+        """环境变量为空字符串时视为未设置（None）"""
+        if isinstance(v, str) and not v.strip():
+            return None
+        return v
+    
     @validator("DOCUMENTS_DIR", "ARCHIVES_DIR", "EXPORTS_DIR")
     def create_directories(cls, v):
         """确保目录存在"""
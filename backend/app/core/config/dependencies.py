@@ -4,6 +4,7 @@ from typing import Generator
 from fastapi import Depends
 
 from app.db.neo4j_db import Neo4jDatabase
+from app.db.neo4j_driver import get_driver
 from app.services.document_processor import DocumentProcessor
 from app.services.knowledge_extractor import KnowledgeExtractor
 from app.services.query_service import QueryService
@@ -13,13 +14,8 @@ from app.core.config import settings
 
 
 async def get_db() -> Generator:
-    """获取数据库连接"""
-    db = Neo4jDatabase(
-        uri=settings.NEO4J_URI,
-        user=settings.NEO4J_USER,
-        password=settings.NEO4J_PASSWORD,
-        database=settings.NEO4J_DATABASE
-    )
+    """获取数据库连接（复用进程级共享驱动）"""
+    db = Neo4jDatabase.from_driver(get_driver(), database=settings.NEO4J_DATABASE)
     try:
         yield db
     finally:
@@ -44,9 +40,9 @@ async def get_query_service(db: Neo4jDatabase = Depends(get_db)) -> QueryService
     return QueryService(db)
 
 
-async def get_provenance_service(db: Neo4jDatabase = Depends(get_db)) -> ProvenanceService:
+async def get_provenance_service() -> ProvenanceService:
     """获取溯源服务实例"""
-    return ProvenanceService(db)
+    return ProvenanceService()
 
 
 async def get_nlp_service() -> NLPService:
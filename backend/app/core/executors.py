@@ -0,0 +1,168 @@
+# app/core/executors.py
+
+from typing import Any, Callable, Dict, Optional, Tuple
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+import asyncio
+import functools
+import multiprocessing
+import threading
+import time
+
+from app.core.config import settings
+from app.core.logger import logger
+
+# 执行器类型：io 为线程池（文件读写、释放GIL的库），cpu 为进程池（PDF解析、NER等CPU密集任务）
+IO = "io"
+CPU = "cpu"
+
+
+def _timed_call(fn: Callable, args: Tuple, kwargs: Dict[str, Any]) -> Tuple[float, float, Any]:
+    """在工作线程/进程中执行任务并记录开始、结束时间（需可被pickle，故为模块级函数）"""
+    started = time.time()
+    result = fn(*args, **kwargs)
+    return started, time.time(), result
+
+
+class ExecutorStats:
+    """执行器运行指标：在途任务、排队深度、等待时间与执行时间"""
+
+    def __init__(self, max_workers: int):
+        self._lock = threading.Lock()
+        self.max_workers = max_workers
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.total_run_time = 0.0
+
+    @property
+    def in_flight(self) -> int:
+        return self.submitted - self.completed - self.failed
+
+    def on_submit(self) -> None:
+        with self._lock:
+            self.submitted += 1
+
+    def on_finish(self, wait_time: float, run_time: float, failed: bool = False) -> None:
+        with self._lock:
+            self.total_wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+            self.total_run_time += run_time
+            if failed:
+                self.failed += 1
+            else:
+                self.completed += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            finished = self.completed + self.failed
+            in_flight = self.in_flight
+            return {
+                "max_workers": self.max_workers,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "in_flight": in_flight,
+                # 超出工作者数量的在途任务即在队列中等待
+                "queue_depth": max(0, in_flight - self.max_workers),
+                "avg_wait_ms": round(self.total_wait_time / finished * 1000, 2) if finished else 0.0,
+                "max_wait_ms": round(self.max_wait_time * 1000, 2),
+                "avg_run_ms": round(self.total_run_time / finished * 1000, 2) if finished else 0.0,
+            }
+
+
+class MonitoredExecutor:
+    """带指标统计的执行器包装，供异步服务分派阻塞任务"""
+
+    def __init__(self, name: str, executor: Executor, max_workers: int):
+        self.name = name
+        self.executor = executor
+        self.stats = ExecutorStats(max_workers)
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """在执行器中运行阻塞函数并等待结果"""
+        loop = asyncio.get_running_loop()
+        submitted = time.time()
+        self.stats.on_submit()
+        try:
+            started, finished, result = await loop.run_in_executor(
+                self.executor, functools.partial(_timed_call, fn, args, kwargs)
+            )
+        except BaseException:
+            # 任务失败时拿不到工作端的计时，整段耗时计为执行时间
+            self.stats.on_finish(0.0, time.time() - submitted, failed=True)
+            raise
+
+        wait_time = max(0.0, started - submitted)
+        self.stats.on_finish(wait_time, finished - started)
+        if wait_time > settings.EXECUTOR_SLOW_WAIT_SECONDS:
+            logger.warning(f"Task {getattr(fn, '__name__', fn)} waited {wait_time:.2f}s in {self.name} executor")
+        return result
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+_executors: Dict[str, MonitoredExecutor] = {}
+_executors_lock = threading.Lock()
+
+
+def _create_executor(kind: str) -> MonitoredExecutor:
+    """按配置创建执行器"""
+    if kind == IO:
+        workers = settings.EXECUTOR_IO_WORKERS
+        return MonitoredExecutor(IO, ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="io-worker"
+        ), workers)
+
+    workers = settings.EXECUTOR_CPU_WORKERS
+    if cpu_uses_processes():
+        context = multiprocessing.get_context(settings.EXECUTOR_PROCESS_START_METHOD)
+        return MonitoredExecutor(CPU, ProcessPoolExecutor(
+            max_workers=workers, mp_context=context
+        ), workers)
+    return MonitoredExecutor(CPU, ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="cpu-worker"
+    ), workers)
+
+
+def get_executor(kind: str) -> MonitoredExecutor:
+    """获取（必要时创建）指定类型的共享执行器"""
+    executor = _executors.get(kind)
+    if executor is None:
+        with _executors_lock:
+            executor = _executors.get(kind)
+            if executor is None:
+                executor = _create_executor(kind)
+                _executors[kind] = executor
+                logger.info(f"Created {kind} executor ({type(executor.executor).__name__})")
+    return executor
+
+
+def cpu_uses_processes() -> bool:
+    """CPU执行器是否为进程池（任务函数与参数需可被pickle）"""
+    return settings.EXECUTOR_CPU_MODE == "process"
+
+
+async def run_io(fn: Callable, *args, **kwargs) -> Any:
+    """在IO线程池中运行阻塞函数"""
+    return await get_executor(IO).run(fn, *args, **kwargs)
+
+
+async def run_cpu(fn: Callable, *args, **kwargs) -> Any:
+    """在CPU执行器中运行CPU密集函数"""
+    return await get_executor(CPU).run(fn, *args, **kwargs)
+
+
+def executor_stats() -> Dict[str, Any]:
+    """各执行器的运行指标"""
+    return {name: executor.stats.to_dict() for name, executor in _executors.items()}
+
+
+def shutdown_executors() -> None:
+    """关闭所有执行器（应用关闭时调用）"""
+    with _executors_lock:
+        for executor in _executors.values():
+            executor.shutdown()
+        _executors.clear()
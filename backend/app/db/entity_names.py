@@ -0,0 +1,67 @@
+# 文件: app/db/entity_names.py
+from typing import Dict, List, Optional
+import re
+
+# 可选的拼音库，用于按拼音检索中文实体名
+try:
+    from pypinyin import lazy_pinyin
+    HAS_PYPINYIN = True
+except ImportError:
+    HAS_PYPINYIN = False
+    print("Warning: pypinyin not installed, entity names will not be searchable by pinyin")
+
+_CJK = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]")
+_PINYIN_SEPARATORS = re.compile(r"[\s'·\-_]+")
+_LUCENE_SPECIAL = re.compile(r'([+\-&|!(){}\[\]^"~*?:\\/])')
+
+# 实体名称的全文索引（cjk分析器：中文按二元组切分，拉丁字母按词切分）
+ENTITY_NAME_FULLTEXT_INDEX = "entity_name_fulltext"
+
+# 实体名称检索所需的索引：范围索引支持前缀匹配，文本索引支持子串匹配，全文索引支持模糊匹配
+ENTITY_NAME_INDEX_STATEMENTS = [
+    "CREATE INDEX entity_name_lower_index IF NOT EXISTS FOR (n:Entity) ON (n.name_lower)",
+    "CREATE INDEX entity_name_pinyin_index IF NOT EXISTS FOR (n:Entity) ON (n.name_pinyin)",
+    "CREATE INDEX entity_name_initials_index IF NOT EXISTS FOR (n:Entity) ON (n.name_initials)",
+    "CREATE TEXT INDEX entity_name_lower_text_index IF NOT EXISTS FOR (n:Entity) ON (n.name_lower)",
+    f"CREATE FULLTEXT INDEX {ENTITY_NAME_FULLTEXT_INDEX} IF NOT EXISTS "
+    "FOR (n:Entity) ON EACH [n.name, n.name_pinyin] "
+    "OPTIONS {indexConfig: {`fulltext.analyzer`: 'cjk'}}",
+]
+
+
+def normalize_name(text: Optional[str]) -> str:
+    """名称检索统一使用去掉首尾空白的小写形式"""
+    return (text or "").strip().lower()
+
+
+def normalize_pinyin(text: Optional[str]) -> str:
+    """拼音检索忽略空格、隔音符等分隔符"""
+    return _PINYIN_SEPARATORS.sub("", normalize_name(text))
+
+
+def has_cjk(text: Optional[str]) -> bool:
+    return bool(text) and bool(_CJK.search(text))
+
+
+def name_keys(name: Optional[str]) -> Dict[str, Optional[str]]:
+    """计算写入实体时一并保存的名称检索属性：小写名称，以及含汉字时的全拼和首字母"""
+    keys = {"name_lower": normalize_name(name) or None, "name_pinyin": None, "name_initials": None}
+    if HAS_PYPINYIN and has_cjk(name):
+        syllables = [s for s in (normalize_pinyin(p) for p in lazy_pinyin(name)) if s]
+        keys["name_pinyin"] = "".join(syllables) or None
+        keys["name_initials"] = "".join(s[0] for s in syllables) or None
+    return keys
+
+
+def fulltext_query(text: Optional[str]) -> str:
+    """把用户输入转换为Lucene查询：拉丁字母词做前缀和模糊匹配，中文交给分析器切分"""
+    clauses: List[str] = []
+    for term in normalize_name(text).split():
+        escaped = _LUCENE_SPECIAL.sub(r"\\\1", term)
+        if has_cjk(term):
+            clauses.append(f"({escaped})")
+        elif len(term) >= 3:
+            clauses.append(f"({escaped}* OR {escaped}~1)")
+        else:
+            clauses.append(f"{escaped}*")
+    return " AND ".join(clauses)
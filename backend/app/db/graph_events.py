@@ -0,0 +1,48 @@
+# 文件: app/db/graph_events.py
+from typing import Awaitable, Callable, Iterable, List, NamedTuple, Optional
+
+from app.core.logger import logger
+
+# 关系变更类型
+RELATIONSHIP_CREATED = "created"
+RELATIONSHIP_UPDATED = "updated"
+RELATIONSHIP_DELETED = "deleted"
+
+
+class RelationshipChange(NamedTuple):
+    """一条关系的写入事件，端点为实体id"""
+    kind: str
+    rel_id: Optional[str]
+    rel_type: Optional[str]
+    source_id: Optional[str]
+    target_id: Optional[str]
+
+
+RelationshipListener = Callable[[List[RelationshipChange]], Awaitable[None]]
+
+# 进程内注册的关系变更监听器
+_listeners: List[RelationshipListener] = []
+
+
+def add_relationship_listener(listener: RelationshipListener) -> None:
+    """注册关系变更监听器（重复注册无效）"""
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+
+def remove_relationship_listener(listener: RelationshipListener) -> None:
+    """注销关系变更监听器"""
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+async def emit_relationship_changes(changes: Iterable[RelationshipChange]) -> None:
+    """通知全部监听器；监听器应只登记变更并尽快返回，出错不影响写入本身"""
+    changes = [change for change in changes if change.rel_type]
+    if not changes or not _listeners:
+        return
+    for listener in list(_listeners):
+        try:
+            await listener(changes)
+        except Exception as e:
+            logger.error(f"Relationship change listener failed: {e}")
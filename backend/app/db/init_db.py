@@ -1,3 +1,4 @@
+from sqlalchemy import inspect, text
 from sqlalchemy.orm import Session
 from .sqlite_db import engine, Base, SessionLocal
 from .models import EntityType, RelationshipType
@@ -5,6 +6,7 @@ from .models import EntityType, RelationshipType
 def init_db():
     """初始化数据库表"""
     Base.metadata.create_all(bind=engine)
+    _add_missing_columns()
     
     # 初始化实体和关系类型
     db = SessionLocal()
@@ -71,4 +73,16 @@ def init_db():
         print(f"初始化类型数据失败: {e}")
         db.rollback()
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+def _add_missing_columns():
+    """为旧版本建立的表补充后来新增的可空列（create_all 不会修改已存在的表）"""
+    columns = {column["name"] for column in inspect(engine).get_columns("knowledge_traces")}
+    if "extraction_job_id" in columns:
+        return
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE knowledge_traces ADD COLUMN extraction_job_id VARCHAR"))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_knowledge_traces_extraction_job ON knowledge_traces (extraction_job_id)"
+        ))
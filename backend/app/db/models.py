@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean, Float, Index
 from sqlalchemy.sql import func
 import datetime
 import json
@@ -81,4 +81,87 @@ class Document(Base):
                 "title": self.title or "Unknown",
                 "type": self.type or "unknown",
                 "error": "Error converting document data"
-            }
\ No newline at end of file
+            }
+
+
+class Blob(Base):
+    """内容寻址存储中的文件对象，按content_hash去重并记录引用计数"""
+    __tablename__ = "blobs"
+    
+    content_hash = Column(String, primary_key=True)  # sha256:<hex>
+    path = Column(String)
+    size = Column(Integer, default=0)
+    ref_count = Column(Integer, default=0)  # 引用该内容的文档数，为0时删除文件
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+
+class ExtractionJob(Base):
+    """知识抽取后台任务"""
+    __tablename__ = "extraction_jobs"
+    
+    id = Column(String, primary_key=True, index=True)
+    document_id = Column(String, index=True)
+    content_hash = Column(String, index=True)  # 同一内容只抽取一次
+    status = Column(String, index=True, default="queued")  # queued, running, succeeded, failed, cancelled
+    stage = Column(String, nullable=True)  # 当前阶段，如 reading, entities, relationships, traces
+    progress = Column(Float, default=0.0)  # 0-1
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    error = Column(Text, nullable=True)
+    result = Column(Text, nullable=True)  # JSON格式的抽取统计
+    run_after = Column(DateTime, nullable=True)  # 重试退避：此时间之后才可再次执行
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+    
+    def to_dict(self):
+        """转换为字典，方便API返回"""
+        result = None
+        if self.result:
+            try:
+                result = json.loads(self.result)
+            except Exception:
+                result = {"raw": self.result}
+        
+        return {
+            "id": self.id,
+            "document_id": self.document_id,
+            "content_hash": self.content_hash,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": self.progress,
+            "attempts": self.attempts,
+            "max_attempts": self.max_attempts,
+            "error": self.error,
+            "result": result,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None
+        }
+
+
+class KnowledgeTraceRecord(Base):
+    """知识溯源记录：实体或关系在源文档中的位置，JSON字段以文本保存"""
+    __tablename__ = "knowledge_traces"
+    # 按实体/关系/文档查找并按时间排序都只走一次索引范围扫描
+    __table_args__ = (
+        Index("ix_knowledge_traces_entity_created", "entity_id", "created_at"),
+        Index("ix_knowledge_traces_relationship_created", "relationship_id", "created_at"),
+        Index("ix_knowledge_traces_document_created", "document_id", "created_at"),
+        Index("ix_knowledge_traces_extraction_job", "extraction_job_id"),
+    )
+    
+    id = Column(String, primary_key=True)
+    entity_id = Column(String, nullable=True)
+    relationship_id = Column(String, nullable=True)
+    document_id = Column(String, nullable=False)
+    location_data = Column(Text)
+    context_range = Column(Text)
+    excerpt = Column(Text, nullable=True)
+    anchor_type = Column(String, default="char_offset")
+    anchor_data = Column(Text)
+    extraction_job_id = Column(String, nullable=True)  # 写入该记录的抽取任务，重试或取消时按此清理
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
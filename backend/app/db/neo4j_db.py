@@ -3,31 +3,58 @@ from datetime import datetime  # 直接导入类
 from typing import Dict, Any, Optional, List, Generic, TypeVar, Type
 from uuid import UUID
 import json
-from neo4j import AsyncGraphDatabase
+from neo4j import AsyncGraphDatabase, AsyncDriver
 from app.db.interfaces.database_interface import DatabaseInterface
 from app.models.entities.entity import Entity
 from app.models.relationships.relationship import Relationship
+from app.db.entity_names import name_keys, ENTITY_NAME_INDEX_STATEMENTS
+from app.db.graph_events import (
+    RelationshipChange, emit_relationship_changes,
+    RELATIONSHIP_CREATED, RELATIONSHIP_UPDATED, RELATIONSHIP_DELETED
+)
+from app.core.config import settings
 
 T = TypeVar('T', Entity, Relationship)
 
+# 需要 id 唯一约束的节点标签
+SCHEMA_NODE_LABELS = ["Entity", "Document", "KnowledgeTrace"]
+
+# 本进程内已确认建立 id 索引的关系类型
+_indexed_relationship_types = set()
+
 class Neo4jDatabase(DatabaseInterface[T]):
     """Neo4j图数据库实现"""
     
-    def __init__(self, uri: str, user: str, password: str, database: str = "neo4j"):
-        """初始化Neo4j数据库连接"""
+    def __init__(self, uri: str, user: str, password: str, database: str = "neo4j",
+                 driver: Optional[AsyncDriver] = None):
+        """初始化Neo4j数据库连接
+        
+        传入driver时复用该（共享）驱动，close()不会关闭它；否则自行创建独占驱动。
+        """
         self.uri = uri
         self.user = user
         self.password = password
         self.database = database
-        self.driver = AsyncGraphDatabase.driver(
-            uri, 
-            auth=(user, password),
-            max_connection_lifetime=3600
-        )
-        print(f"Initialized Neo4j connection to {uri} with user {user} and database {database}")
+        self._owns_driver = driver is None
+        if driver is not None:
+            self.driver = driver
+        else:
+            self.driver = AsyncGraphDatabase.driver(
+                uri, 
+                auth=(user, password),
+                max_connection_lifetime=3600
+            )
+            print(f"Initialized Neo4j connection to {uri} with user {user} and database {database}")
+    
+    @classmethod
+    def from_driver(cls, driver: AsyncDriver, database: str = "neo4j") -> "Neo4jDatabase":
+        """基于共享驱动创建轻量的数据库访问对象（不建立新连接）"""
+        return cls(uri="", user="", password="", database=database, driver=driver)
     
     async def close(self):
-        await self.driver.close()
+        """关闭独占驱动；共享驱动由应用生命周期统一关闭"""
+        if self._owns_driver:
+            await self.driver.close()
     
     async def create(self, obj: T) -> T:
         """创建实体或关系"""
@@ -38,8 +65,8 @@ class Neo4jDatabase(DatabaseInterface[T]):
         else:
             raise TypeError(f"不支持的类型: {type(obj)}")
     
-    async def _create_entity(self, entity: Entity) -> Entity:
-        """创建实体节点"""
+    def _entity_props(self, entity: Entity) -> Dict[str, Any]:
+        """将实体转换为可写入Neo4j的属性字典"""
         # 将Pydantic模型转为字典，避免非Neo4j支持的类型
         entity_dict = entity.dict()
         #props = {k: v for k, v in entity_dict.items() if v is not None and k != 'type'}
@@ -52,6 +79,9 @@ class Neo4jDatabase(DatabaseInterface[T]):
         props['created_at'] = current_time
         props['updated_at'] = current_time
         
+        # 名称检索属性（小写、拼音），供实体名称索引使用
+        props.update({k: v for k, v in name_keys(entity.name).items() if v is not None})
+        
         # 将复杂类型转换为JSON字符串
         for k, v in props.items():
             if isinstance(v, (dict, list)):
@@ -60,6 +90,12 @@ class Neo4jDatabase(DatabaseInterface[T]):
             elif isinstance(v, UUID):
                 props[k] = str(v)
         
+        return props
+    
+    async def _create_entity(self, entity: Entity) -> Entity:
+        """创建实体节点"""
+        props = self._entity_props(entity)
+        
         # 修正Cypher查询 - 使用正确的参数语法
         query = """
         CREATE (e:Entity)
@@ -82,8 +118,8 @@ class Neo4jDatabase(DatabaseInterface[T]):
             raise e
     
     # 文件: backend/app/db/neo4j_db.py
-    async def _create_relationship(self, relationship: Relationship) -> Relationship:
-        """创建关系边"""
+    def _relationship_props(self, relationship: Relationship) -> Dict[str, Any]:
+        """将关系转换为可写入Neo4j的属性字典（不含类型和端点）"""
         # 将Pydantic模型转为字典
         rel_dict = relationship.dict()
         
@@ -117,23 +153,32 @@ class Neo4jDatabase(DatabaseInterface[T]):
         if "updated_at" not in props:
             props["updated_at"] = now_str
         
+        return props
+    
+    async def _create_relationship(self, relationship: Relationship) -> Relationship:
+        """创建关系边"""
+        if not relationship.source_id or not relationship.target_id:
+            raise ValueError("Relationship must have both source_id and target_id")
+        
+        props = self._relationship_props(relationship)
+        
         # 修正Cypher查询 - 使用正确的参数语法
         query = """
-        MATCH (source)
-        WHERE toString(source.id) = $source_id
-        MATCH (target)
-        WHERE toString(target.id) = $target_id
+        MATCH (source:Entity {id: $source_id})
+        MATCH (target:Entity {id: $target_id})
         CREATE (source)-[r:%s]->(target)
         SET r = $props
         RETURN r
         """ % relationship.type
         
         params = {
-            "source_id": str(source_id),
-            "target_id": str(target_id),
+            "source_id": str(relationship.source_id),
+            "target_id": str(relationship.target_id),
             "props": props
         }
         
+        await self._ensure_relationship_index(relationship.type)
+        
         try:
             async with self.driver.session(database=self.database) as session:
                 result = await session.run(query, **params)
@@ -142,10 +187,103 @@ class Neo4jDatabase(DatabaseInterface[T]):
                     print(f"Successfully created relationship of type {relationship.type}")
                 else:
                     print(f"Warning: No record returned when creating relationship of type {relationship.type}")
-                return relationship
+            if record:
+                await emit_relationship_changes([RelationshipChange(
+                    RELATIONSHIP_CREATED, params["props"].get("id"), relationship.type,
+                    params["source_id"], params["target_id"]
+                )])
+            return relationship
         except Exception as e:
             print(f"Error in _create_relationship: {e}")
             raise e
+    
+    async def create_many_entities(self, entities: List[Entity], batch_size: Optional[int] = None) -> int:
+        """批量创建实体节点
+        
+        按实体类型分组（标签无法参数化），每组按batch_size分块，
+        每块通过 UNWIND 在一个写事务中完成。
+        
+        Returns:
+            创建的节点数量
+        """
+        batch_size = batch_size or settings.NEO4J_WRITE_BATCH_SIZE
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        for entity in entities:
+            groups.setdefault(entity.type, []).append(self._entity_props(entity))
+        
+        created = 0
+        async with self.driver.session(database=self.database) as session:
+            for entity_type, rows in groups.items():
+                query = """
+                UNWIND $rows AS props
+                CREATE (e:Entity)
+                SET e = props
+                SET e:`%s`
+                RETURN count(e) AS created
+                """ % entity_type
+                for i in range(0, len(rows), batch_size):
+                    created += await session.execute_write(
+                        self._run_count_query, query, rows[i:i + batch_size]
+                    )
+        
+        print(f"Bulk created {created} entities in {len(groups)} type group(s)")
+        return created
+    
+    async def create_many_relationships(self, relationships: List[Relationship],
+                                        batch_size: Optional[int] = None) -> int:
+        """批量创建关系边
+        
+        按关系类型分组，每组按batch_size分块，每块通过 UNWIND 在一个写事务中完成。
+        端点实体不存在的行会被跳过。
+        
+        Returns:
+            创建的关系数量
+        """
+        batch_size = batch_size or settings.NEO4J_WRITE_BATCH_SIZE
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        for relationship in relationships:
+            if not relationship.source_id or not relationship.target_id:
+                raise ValueError("Relationship must have both source_id and target_id")
+            groups.setdefault(relationship.type, []).append({
+                "source_id": str(relationship.source_id),
+                "target_id": str(relationship.target_id),
+                "props": self._relationship_props(relationship),
+            })
+        
+        for rel_type in groups:
+            await self._ensure_relationship_index(rel_type)
+        
+        created = 0
+        async with self.driver.session(database=self.database) as session:
+            for rel_type, rows in groups.items():
+                query = """
+                UNWIND $rows AS row
+                MATCH (source:Entity {id: row.source_id})
+                MATCH (target:Entity {id: row.target_id})
+                CREATE (source)-[r:`%s`]->(target)
+                SET r = row.props
+                RETURN count(r) AS created
+                """ % rel_type
+                for i in range(0, len(rows), batch_size):
+                    created += await session.execute_write(
+                        self._run_count_query, query, rows[i:i + batch_size]
+                    )
+        
+        print(f"Bulk created {created} relationships in {len(groups)} type group(s)")
+        if created:
+            await emit_relationship_changes(
+                RelationshipChange(RELATIONSHIP_CREATED, row["props"].get("id"), rel_type,
+                                   row["source_id"], row["target_id"])
+                for rel_type, rows in groups.items() for row in rows
+            )
+        return created
+    
+    @staticmethod
+    async def _run_count_query(tx, query: str, rows: List[Dict[str, Any]]) -> int:
+        """在事务内执行批量写入，返回 created 计数"""
+        result = await tx.run(query, rows=rows)
+        record = await result.single()
+        return record["created"] if record else 0
         
     async def read_relationship(self, id: UUID) -> Optional[Relationship]:
         """读取关系"""
@@ -154,8 +292,8 @@ class Neo4jDatabase(DatabaseInterface[T]):
             print(f"Reading relationship with ID: {rel_id}")
             
             query = """
-            MATCH ()-[r]-()
-            WHERE r.id.id = $id
+            MATCH ()-[r]->()
+            WHERE r.id = $id
             RETURN r, startNode(r) as source, endNode(r) as target
             """
             
@@ -196,10 +334,9 @@ class Neo4jDatabase(DatabaseInterface[T]):
             entity_id = str(id)
             print(f"Reading entity with ID: {entity_id}")
             
-            # 使用更灵活的查询语句，通过ID字符串表示匹配
+            # 通过Entity标签锚定，走 :Entity(id) 唯一约束索引
             query = """
-            MATCH (e)
-            WHERE toString(e.id) = $id
+            MATCH (e:Entity {id: $id})
             RETURN e, labels(e) as labels
             """
             
@@ -347,28 +484,44 @@ class Neo4jDatabase(DatabaseInterface[T]):
             if not set_statements:
                 return obj
             
-            # 构建Cypher查询
+            # 构建Cypher查询：已知关系类型时按类型匹配以命中关系id索引
+            set_clause = ", ".join(set_statements)
+            typed_query = f"""
+            MATCH (source)-[r:`{obj.type}`]->(target)
+            WHERE r.id = $id
+            SET {set_clause}
+            RETURN r, type(r) AS rel_type, source.id AS source_id, target.id AS target_id
+            """
             query = f"""
-            MATCH ()-[r]-()
+            MATCH (source)-[r]->(target)
             WHERE r.id = $id
-            SET {", ".join(set_statements)}
-            RETURN r
+            SET {set_clause}
+            RETURN r, type(r) AS rel_type, source.id AS source_id, target.id AS target_id
             """
             
             try:
                 async with self.driver.session(database=self.database) as session:
-                    result = await session.run(query, **params)
-                    record = await result.single()
+                    record = None
+                    if obj.type:
+                        result = await session.run(typed_query, **params)
+                        record = await result.single()
+                    if not record:
+                        result = await session.run(query, **params)
+                        record = await result.single()
                     
-                    if record:
-                        print(f"Successfully updated relationship properties")
-                        return obj
-                    else:
-                        print(f"Warning: No record returned when updating relationship")
-                        return None
+                if record:
+                    print(f"Successfully updated relationship properties")
+                else:
+                    print(f"Warning: No record returned when updating relationship")
+                    return None
             except Exception as e:
                 print(f"Error updating relationship: {e}")
                 return None
+            
+            await emit_relationship_changes([RelationshipChange(
+                RELATIONSHIP_UPDATED, rel_id, record["rel_type"], record["source_id"], record["target_id"]
+            )])
+            return obj
         """更新实体或关系"""
         try:
             # 确保ID是字符串
@@ -408,8 +561,7 @@ class Neo4jDatabase(DatabaseInterface[T]):
             
             # 构建Cypher查询
             query = f"""
-            MATCH (e)
-            WHERE toString(e.id) = $id
+            MATCH (e:Entity {{id: $id}})
             SET {", ".join(set_statements)}
             RETURN e
             """
@@ -431,8 +583,7 @@ class Neo4jDatabase(DatabaseInterface[T]):
                     try:
                         # 首先获取当前节点的所有标签
                         labels_query = """
-                        MATCH (e)
-                        WHERE toString(e.id) = $id
+                        MATCH (e:Entity {id: $id})
                         RETURN labels(e) AS labels
                         """
                         
@@ -446,8 +597,7 @@ class Neo4jDatabase(DatabaseInterface[T]):
                             for label in current_labels:
                                 if label != "Entity" and label != type_value:
                                     remove_query = f"""
-                                    MATCH (e)
-                                    WHERE toString(e.id) = $id
+                                    MATCH (e:Entity {{id: $id}})
                                     REMOVE e:{label}
                                     """
                                     await session.run(remove_query, id=entity_id)
@@ -455,8 +605,7 @@ class Neo4jDatabase(DatabaseInterface[T]):
                         
                         # 添加新类型标签
                         add_label_query = f"""
-                        MATCH (e)
-                        WHERE toString(e.id) = $id
+                        MATCH (e:Entity {{id: $id}})
                         SET e:{type_value}
                         RETURN e
                         """
@@ -483,28 +632,66 @@ class Neo4jDatabase(DatabaseInterface[T]):
             print(f"Attempting to delete entity with ID: {entity_id}")
             
             # Use a more direct approach with explicit debugging
+            # 同时取出随节点一起删除的关系，供推理等监听方处理
             query = """
-            MATCH (e)
-            WHERE e.id = $id
-            WITH e, e.id as deleted_id
+            MATCH (e:Entity {id: $id})
+            OPTIONAL MATCH (e)-[r]-()
+            WITH e, e.id as deleted_id,
+                 collect(CASE WHEN r IS NULL THEN NULL ELSE {
+                     id: r.id, type: type(r), source_id: startNode(r).id, target_id: endNode(r).id
+                 } END) AS relationships
             DETACH DELETE e
-            RETURN deleted_id
+            RETURN deleted_id, relationships
             """
             
             async with self.driver.session(database=self.database) as session:
                 result = await session.run(query, id=entity_id)
                 records = await result.data()
                 
-                success = len(records) > 0
-                print(f"Delete operation result: {success}, Records: {records}")
-                
-                return success
+            success = len(records) > 0
+            print(f"Delete operation result: {success}, Records: {[r['deleted_id'] for r in records]}")
+            
+            if success:
+                await emit_relationship_changes(
+                    RelationshipChange(RELATIONSHIP_DELETED, rel["id"], rel["type"], rel["source_id"], rel["target_id"])
+                    for record in records for rel in record["relationships"]
+                )
+            return success
         except Exception as e:
             print(f"Error in delete method: {e}")
             import traceback
             traceback.print_exc()
             return False
-    
+
+    async def delete_by_extraction_job(self, job_id: str, batch_size: int = settings.NEO4J_WRITE_BATCH_SIZE) -> int:
+        """分批删除某个抽取任务写入的实体及其关系，返回删除的实体数"""
+        query = """
+        MATCH (e:Entity {extraction_job_id: $job_id})
+        WITH e LIMIT $batch_size
+        OPTIONAL MATCH (e)-[r]-()
+        WITH e, collect(CASE WHEN r IS NULL THEN NULL ELSE {
+                 id: r.id, type: type(r), source_id: startNode(r).id, target_id: endNode(r).id
+             } END) AS relationships
+        DETACH DELETE e
+        RETURN count(e) AS deleted, collect(relationships) AS relationships
+        """
+        total = 0
+        async with self.driver.session(database=self.database) as session:
+            while True:
+                result = await session.run(query, job_id=job_id, batch_size=batch_size)
+                record = await result.single()
+                deleted = record["deleted"] if record else 0
+                if not deleted:
+                    break
+                total += deleted
+                await emit_relationship_changes(
+                    RelationshipChange(RELATIONSHIP_DELETED, rel["id"], rel["type"], rel["source_id"], rel["target_id"])
+                    for group in record["relationships"] for rel in group
+                )
+                if deleted < batch_size:
+                    break
+        return total
+
     async def list(self, skip: int = 0, limit: int = 100) -> List[T]:
         """列出实体或关系"""
         # 这里需要实现具体的列表逻辑
@@ -526,6 +713,66 @@ class Neo4jDatabase(DatabaseInterface[T]):
             print(f"Neo4j connection test failed: {e}")
             return False
         
+    async def ensure_schema(self, relationship_types: Optional[List[str]] = None) -> None:
+        """创建id查询及实体名称检索所需的约束和索引（幂等，应用启动时调用）
+        
+        Args:
+            relationship_types: 需要建立 id 属性索引的关系类型
+        """
+        for label in SCHEMA_NODE_LABELS:
+            constraint_query = (
+                f"CREATE CONSTRAINT {label.lower()}_id_unique IF NOT EXISTS "
+                f"FOR (n:`{label}`) REQUIRE n.id IS UNIQUE"
+            )
+            try:
+                async with self.driver.session(database=self.database) as session:
+                    await session.run(constraint_query)
+            except Exception as e:
+                # 已有重复id时无法建唯一约束，退化为普通索引
+                print(f"Could not create unique constraint on :{label}(id), falling back to index: {e}")
+                try:
+                    async with self.driver.session(database=self.database) as session:
+                        await session.run(
+                            f"CREATE INDEX {label.lower()}_id_index IF NOT EXISTS "
+                            f"FOR (n:`{label}`) ON (n.id)"
+                        )
+                except Exception as index_error:
+                    print(f"Error creating index on :{label}(id): {index_error}")
+        
+        # 实体名称检索（前缀、拼音、子串、模糊）所需的索引
+        for statement in ENTITY_NAME_INDEX_STATEMENTS:
+            try:
+                async with self.driver.session(database=self.database) as session:
+                    await session.run(statement)
+            except Exception as e:
+                print(f"Error creating entity name index: {e}")
+        
+        # 抽取任务重试或取消时按任务ID清理其写入的实体
+        try:
+            async with self.driver.session(database=self.database) as session:
+                await session.run(
+                    "CREATE INDEX entity_extraction_job_index IF NOT EXISTS FOR (n:Entity) ON (n.extraction_job_id)"
+                )
+        except Exception as e:
+            print(f"Error creating extraction job index: {e}")
+        
+        for rel_type in relationship_types or []:
+            await self._ensure_relationship_index(rel_type)
+    
+    async def _ensure_relationship_index(self, rel_type: str) -> None:
+        """为指定关系类型创建 id 属性索引，每个进程每种类型只执行一次"""
+        if not rel_type or rel_type in _indexed_relationship_types:
+            return
+        
+        index_name = "rel_%s_id_index" % "".join(c if c.isalnum() else "_" for c in rel_type.lower())
+        query = f"CREATE INDEX {index_name} IF NOT EXISTS FOR ()-[r:`{rel_type}`]-() ON (r.id)"
+        try:
+            async with self.driver.session(database=self.database) as session:
+                await session.run(query)
+            _indexed_relationship_types.add(rel_type)
+        except Exception as e:
+            print(f"Error creating relationship index for {rel_type}: {e}")
+    
     async def _update_entity(self, entity: Entity) -> Entity:
         """更新实体节点"""
         # 将Pydantic模型转为字典
@@ -549,6 +796,9 @@ class Neo4jDatabase(DatabaseInterface[T]):
                 query = """
                 MATCH (e:Entity {id: $id})
                 SET e.name = $name,
+                    e.name_lower = $name_lower,
+                    e.name_pinyin = $name_pinyin,
+                    e.name_initials = $name_initials,
                     e.description = $description,
                     e.properties = $properties
                 RETURN e
@@ -558,7 +808,8 @@ class Neo4jDatabase(DatabaseInterface[T]):
                     "id": entity_id,
                     "name": entity.name,
                     "description": entity.description,
-                    "properties": json.dumps(entity.properties)
+                    "properties": json.dumps(entity.properties),
+                    **name_keys(entity.name)
                 }
                 
                 result = await session.run(query, **params)
@@ -619,26 +870,27 @@ class Neo4jDatabase(DatabaseInterface[T]):
             
             # 针对关系的特定查询
             query = """
-            MATCH ()-[r]-()
+            MATCH (source)-[r]->(target)
             WHERE r.id = $id
+            WITH r, type(r) AS rel_type, source.id AS source_id, target.id AS target_id
             DELETE r
-            RETURN count(r) as deleted_count
+            RETURN rel_type, source_id, target_id
             """
             
             async with self.driver.session(database=self.database) as session:
                 result = await session.run(query, id=rel_id)
                 data = await result.data()
                 
-                # 检查是否有关系被删除
-                if data and len(data) > 0:
-                    deleted_count = data[0].get('deleted_count', 0)
-                    success = deleted_count > 0
-                else:
-                    success = False
-                
-                print(f"关系删除操作结果: {success}, 记录: {data}")
-                
-                return success
+            # 检查是否有关系被删除
+            success = len(data) > 0
+            print(f"关系删除操作结果: {success}, 记录: {data}")
+            
+            if success:
+                await emit_relationship_changes(
+                    RelationshipChange(RELATIONSHIP_DELETED, rel_id, item["rel_type"], item["source_id"], item["target_id"])
+                    for item in data
+                )
+            return success
         except Exception as e:
             print(f"删除关系方法出错: {e}")
             import traceback
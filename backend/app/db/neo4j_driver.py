@@ -0,0 +1,42 @@
+# 文件: app/db/neo4j_driver.py
+from typing import Optional
+from neo4j import AsyncGraphDatabase, AsyncDriver
+
+from app.core.config import settings
+from app.core.logger import logger
+
+# 进程内共享的Neo4j驱动，驱动本身维护连接池，会话按需从池中借出
+_driver: Optional[AsyncDriver] = None
+
+
+def init_driver() -> AsyncDriver:
+    """创建进程级共享的Neo4j驱动（幂等）"""
+    global _driver
+    if _driver is None:
+        _driver = AsyncGraphDatabase.driver(
+            settings.NEO4J_URI,
+            auth=(settings.NEO4J_USER, settings.NEO4J_PASSWORD),
+            max_connection_pool_size=settings.NEO4J_MAX_CONNECTION_POOL_SIZE,
+            connection_acquisition_timeout=settings.NEO4J_CONNECTION_ACQUISITION_TIMEOUT,
+            max_connection_lifetime=settings.NEO4J_MAX_CONNECTION_LIFETIME,
+            liveness_check_timeout=settings.NEO4J_LIVENESS_CHECK_TIMEOUT,
+        )
+        logger.info(
+            f"Initialized shared Neo4j driver to {settings.NEO4J_URI} "
+            f"(pool size {settings.NEO4J_MAX_CONNECTION_POOL_SIZE})"
+        )
+    return _driver
+
+
+def get_driver() -> AsyncDriver:
+    """获取共享驱动，未初始化时按配置惰性创建"""
+    return _driver if _driver is not None else init_driver()
+
+
+async def close_driver() -> None:
+    """关闭共享驱动并释放连接池"""
+    global _driver
+    if _driver is not None:
+        await _driver.close()
+        _driver = None
+        logger.info("Closed shared Neo4j driver")
@@ -2,6 +2,7 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
+import asyncio
 import logging
 
 from app.api.api_v1.api import api_router
@@ -48,6 +49,13 @@ async def root():
     }
 
 
+@app.get("/metrics/executors")
+async def executor_metrics():
+    """阻塞任务执行器的排队深度与等待时间指标"""
+    from app.core.executors import executor_stats
+    return executor_stats()
+
+
 @app.on_event("startup")
 async def startup_event():
     """应用启动事件处理"""
@@ -57,26 +65,53 @@ async def startup_event():
     from app.db.init_db import init_db
     init_db()
 
-    # 测试Neo4j连接
+    # 创建进程级共享的Neo4j驱动并测试连接
     from app.core.config import settings
     from app.db.neo4j_db import Neo4jDatabase
+    from app.db.neo4j_driver import init_driver
     
-    db = Neo4jDatabase(
-        uri=settings.NEO4J_URI,
-        user=settings.NEO4J_USER,
-        password=settings.NEO4J_PASSWORD,
-        database=settings.NEO4J_DATABASE
-    )
+    db = Neo4jDatabase.from_driver(init_driver(), database=settings.NEO4J_DATABASE)
     
     try:
         connection_result = await db.test_connection()
         if connection_result:
             logger.info("Neo4j连接测试成功")
+            
+            # 建立id查询所需的约束与索引
+            from app.db.sqlite_db import SessionLocal
+            from app.db.models import RelationshipType
+            sqlite_db = SessionLocal()
+            try:
+                relationship_types = [t.type_code for t in sqlite_db.query(RelationshipType).all()]
+            finally:
+                sqlite_db.close()
+            await db.ensure_schema(relationship_types)
+            logger.info("Neo4j索引与约束检查完成")
+            
+            # 为缺少名称检索属性的实体（升级前写入或外部导入）在后台补齐
+            from app.services.entity_name_index import entity_name_index
+            if await entity_name_index.needs_backfill():
+                app.state.entity_name_backfill = asyncio.create_task(entity_name_index.backfill())
+            
+            # 在后台加载层次关系闭包索引，之后随关系写入同步
+            from app.services.hierarchy_index import hierarchy_index
+            app.state.hierarchy_index_load = asyncio.create_task(hierarchy_index.start())
+            
+            # 关系写入时在后台增量维护推理结果
+            if settings.INFERENCE_INCREMENTAL:
+                from app.services.inference_engine import inference_engine
+                await inference_engine.load_rules(settings.INFERENCE_RULES_FILE or None)
+                await inference_engine.ensure_indexes()
+                inference_engine.start_incremental()
         else:
             logger.error("Neo4j连接测试失败!")
     except Exception as e:
         logger.error(f"Neo4j连接测试出错: {e}")
     
+    # 启动后台知识抽取任务队列（恢复上次中断的任务）
+    from app.services.extraction_jobs import extraction_queue
+    await extraction_queue.start()
+    
     logger.info("应用初始化完成")
 
 
@@ -84,7 +119,25 @@ async def startup_event():
 async def shutdown_event():
     """应用关闭事件处理"""
     logger.info("关闭应用...")
-    # 这里可以添加清理代码，如关闭连接等
+    # 停止后台抽取任务，运行中的任务下次启动时重新入队
+    from app.services.extraction_jobs import extraction_queue
+    await extraction_queue.stop()
+    # 停止增量推理与层次索引的同步
+    from app.services.inference_engine import inference_engine
+    await inference_engine.stop_incremental()
+    from app.services.hierarchy_index import hierarchy_index
+    await hierarchy_index.stop()
+    # 关闭文档全文索引与向量索引
+    from app.services.document_index import document_index
+    await document_index.close()
+    from app.services.vector_index import vector_index
+    vector_index.close()
+    # 关闭共享的Neo4j驱动及其连接池
+    from app.db.neo4j_driver import close_driver
+    await close_driver()
+    # 关闭阻塞任务执行器
+    from app.core.executors import shutdown_executors
+    shutdown_executors()
     logger.info("应用已关闭")
 
 
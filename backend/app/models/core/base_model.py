@@ -23,4 +23,5 @@ class SourceMixin(BaseModel):
     source_type: Optional[str] = Field(default=None, description="源数据类型: document, webpage, structured_data")
     source_location: Optional[Dict[str, Any]] = Field(default=None, description="源数据中的位置信息")
     extraction_method: Optional[str] = Field(default=None, description="知识抽取方法")
-    confidence: Optional[float] = Field(default=None, description="抽取置信度")
\ No newline at end of file
+    confidence: Optional[float] = Field(default=None, description="抽取置信度")
+    extraction_job_id: Optional[str] = Field(default=None, description="写入该知识的抽取任务ID")
\ No newline at end of file
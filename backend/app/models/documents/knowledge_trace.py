@@ -16,6 +16,7 @@ class KnowledgeTrace(TimeStampMixin):
     excerpt: Optional[str] = Field(default=None, description="原文摘录")
     anchor_type: str = Field(default="char_offset", description="锚点类型: char_offset, xpath, semantic")
     anchor_data: Dict[str, Any] = Field(..., description="锚点详细数据")
+    extraction_job_id: Optional[str] = Field(default=None, description="写入该记录的抽取任务ID")
     
     class Config:
         schema_extra = {
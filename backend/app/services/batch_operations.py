@@ -8,6 +8,7 @@ from fastapi import HTTPException
 from app.db.neo4j_enhanced import Neo4jEnhanced
 from app.models.entities.entity import Entity
 from app.models.relationships.relationship import Relationship
+from app.db.entity_names import name_keys
 from app.core.logger import logger
 
 class BatchOperations:
@@ -37,6 +38,8 @@ class BatchOperations:
                 for key, value in entity_dict.items():
                     if isinstance(value, dict) or isinstance(value, list):
                         entity_dict[key] = str(value)  # 简化处理，实际应使用JSON序列化
+                # 名称检索属性（小写、拼音）
+                entity_dict.update(name_keys(entity.name))
                 
                 batch_params.append({
                     "id": str(entity.id),
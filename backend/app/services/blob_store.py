@@ -0,0 +1,111 @@
+# app/services/blob_store.py
+
+from typing import Optional, Tuple
+import os
+import shutil
+import threading
+from uuid import uuid4
+
+from app.db.sqlite_db import SessionLocal
+from app.db.models import Blob
+from app.core.config import settings
+
+# 入库与释放需要串行：文件是否存在、引用计数与删除文件必须作为一个整体判断
+_store_lock = threading.Lock()
+
+
+class BlobStore:
+    """内容寻址的文件存储
+
+    文件按 content_hash（sha256:<hex>）存放在 <root>/<hex[:2]>/<hex[2:4]>/<hex>，
+    相同内容只保存一份；引用计数记录在SQLite的 blobs 表中，降为0时删除文件。
+    所有方法均为阻塞调用，异步代码中应通过 run_io 调用。
+    """
+
+    def __init__(self, root: str = settings.BLOBS_DIR):
+        self.root = os.path.abspath(root)
+        self.tmp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def temp_path(self) -> str:
+        """与存储同一文件系统下的临时文件路径，保证入库时可原子重命名"""
+        return os.path.join(self.tmp_dir, f"{uuid4()}.part")
+
+    def path_for(self, content_hash: str) -> str:
+        """content_hash 对应的分片存储路径"""
+        digest = content_hash.split(":", 1)[-1]
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def owns(self, path: Optional[str]) -> bool:
+        """路径是否位于本存储中"""
+        return bool(path) and os.path.abspath(path).startswith(self.root + os.sep)
+
+    def ingest(self, temp_path: str, content_hash: str, size: int) -> Tuple[str, bool]:
+        """将已写完的临时文件存入，并增加引用计数
+
+        Returns:
+            (存储路径, 是否为新内容)；内容已存在时丢弃临时文件
+        """
+        path = self.path_for(content_hash)
+        with _store_lock:
+            db = SessionLocal()
+            try:
+                blob = db.query(Blob).filter(Blob.content_hash == content_hash).first()
+                created = not os.path.exists(path)
+                if created:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(temp_path, path)
+                else:
+                    os.remove(temp_path)
+
+                if blob is None:
+                    blob = Blob(content_hash=content_hash, path=path, size=size, ref_count=0)
+                    db.add(blob)
+                blob.ref_count = (blob.ref_count or 0) + 1
+                db.commit()
+                return path, created
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+
+    def release(self, content_hash: str) -> bool:
+        """减少引用计数，为0时删除文件；返回文件是否被删除"""
+        with _store_lock:
+            db = SessionLocal()
+            try:
+                blob = db.query(Blob).filter(Blob.content_hash == content_hash).first()
+                if blob is None:
+                    return False
+                blob.ref_count = max(0, (blob.ref_count or 0) - 1)
+                removed = False
+                if blob.ref_count == 0:
+                    if os.path.exists(blob.path):
+                        os.remove(blob.path)
+                    db.delete(blob)
+                    removed = True
+                db.commit()
+                return removed
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+
+    @staticmethod
+    def link(source_path: str, target_path: str) -> str:
+        """以硬链接方式创建副本（不占用额外空间），跨文件系统等不支持时退化为复制
+
+        Returns:
+            使用的方式："hardlink" 或 "copy"
+        """
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        if os.path.exists(target_path):
+            os.remove(target_path)
+        try:
+            os.link(source_path, target_path)
+            return "hardlink"
+        except OSError:
+            shutil.copyfile(source_path, target_path)
+            return "copy"
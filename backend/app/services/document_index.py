@@ -1,6 +1,7 @@
 # app/services/document_index.py
 
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
+from bisect import bisect_left
 import aiofiles
 import json
 import os
@@ -8,22 +9,287 @@ import re
 from uuid import UUID
 import asyncio
 import sqlite3
+import zlib
 import aiosqlite
 from pathlib import Path
+from datetime import datetime
+
+from app.core.config import settings
+from app.core.executors import run_cpu, run_io
+from app.db.sqlite_db import SessionLocal
+from app.db.models import Document
+from app.services.document_processor import load_document_text
+
+# 可选的中文分词库
+try:
+    import jieba
+    HAS_JIEBA = True
+except ImportError:
+    HAS_JIEBA = False
+
+# 全文索引分词模式：
+#   unicode61 - 原有的 porter unicode61，连续的中文字符会被当作一个词
+#   trigram   - FTS5内置三元组分词，支持任意子串匹配，无需额外依赖（SQLite >= 3.34）
+#   jieba     - 建索引时用jieba搜索引擎模式分词（同时输出长词中的子词），查询时用精确模式，
+#               以空格连接后交给 unicode61
+TOKENIZER_UNICODE61 = "unicode61"
+TOKENIZER_TRIGRAM = "trigram"
+TOKENIZER_JIEBA = "jieba"
+
+FTS_TOKENIZE_CLAUSES = {
+    TOKENIZER_UNICODE61: "porter unicode61",
+    TOKENIZER_TRIGRAM: "trigram",
+    TOKENIZER_JIEBA: "porter unicode61",
+}
+
+# jieba模式下索引文本的分词方式（index_meta 的 fts_segmentation）：旧版本为精确模式
+JIEBA_PRECISE = "precise"
+JIEBA_SEARCH = "search"
+
+# 中文字符之间的分词空格，还原原文时去掉
+_CJK_SPACE = re.compile(r"(?<=[\u3000-\u9fff\uff00-\uffef]) (?=[\u3000-\u9fff\uff00-\uffef])")
+
+
+def resolve_tokenizer(mode: str) -> str:
+    """校验分词模式，jieba未安装时退回trigram"""
+    mode = (mode or TOKENIZER_TRIGRAM).lower()
+    if mode not in FTS_TOKENIZE_CLAUSES:
+        print(f"WARNING: Unknown document index tokenizer '{mode}', using trigram")
+        return TOKENIZER_TRIGRAM
+    if mode == TOKENIZER_JIEBA and not HAS_JIEBA:
+        print("WARNING: jieba not installed. Falling back to trigram tokenizer.")
+        return TOKENIZER_TRIGRAM
+    return mode
+
+
+def segment_texts(texts: List[str], segmentation: str = JIEBA_SEARCH) -> List[str]:
+    """用jieba分词，词之间以空格连接（需可被pickle，故为模块级函数）
+
+    默认使用搜索引擎模式：长词之外再输出其中的子词（"神经网络" -> 神经 网络 神经网络），
+    查询"网络"也能命中。分词结果只写入全文索引，正文表保存原文；删除时需要重新分词得到相同的词条。
+    """
+    cut = jieba.cut_for_search if segmentation == JIEBA_SEARCH else jieba.cut
+    return [" ".join(w for w in cut(text or "") if w.strip()) for text in texts]
+
+
+def query_terms(query: str) -> List[str]:
+    """jieba模式下查询的分词结果（精确模式，不拆出子词，避免查询条件变宽）"""
+    return [w for w in jieba.cut(query) if w.strip()]
+
+
+def restore_text(text: str, mode: str) -> str:
+    """去掉jieba模式下中文词之间插入的空格（旧版本的正文表保存的是分词后的文本）"""
+    if mode != TOKENIZER_JIEBA or not text:
+        return text
+    return _CJK_SPACE.sub("", text)
+
+
+# 全文索引存储布局：inline 为正文存于FTS表内（旧版本），external 为FTS表只存倒排索引、正文压缩存于 document_text
+FTS_LAYOUT_INLINE = "inline"
+FTS_LAYOUT_EXTERNAL = "external"
+
+# 正文表保存原文（index_meta 的 fts_text）；旧版本在jieba模式下保存的是分词后的文本
+FTS_TEXT_ORIGINAL = "original"
+
+
+def compress_text(text: Optional[str]) -> bytes:
+    """压缩正文"""
+    return zlib.compress((text or "").encode("utf-8"), settings.DOCUMENT_INDEX_COMPRESSION_LEVEL)
+
+
+def decompress_text(data: Optional[bytes]) -> Optional[str]:
+    """解压正文（同时注册为SQL函数 text_decompress）"""
+    if data is None:
+        return None
+    return zlib.decompress(data).decode("utf-8")
+
+
+# 不抽取正文、只索引标题和元数据的文件类型
+NON_TEXT_TYPES = {"jpg", "jpeg", "png", "gif", "bmp", "webp", "svg"}
+
+
+def load_document_batch(after_id: str, limit: int) -> List[Dict[str, Any]]:
+    """按id顺序从SQLite的Document表读取一批文档（键集分页，在IO执行器中运行）"""
+    db = SessionLocal()
+    try:
+        rows = db.query(Document).filter(Document.id > after_id).order_by(Document.id).limit(limit).all()
+        batch = []
+        for row in rows:
+            try:
+                metadata = json.loads(row.doc_metadata) if row.doc_metadata else {}
+            except Exception:
+                metadata = {}
+            batch.append({
+                "id": row.id,
+                "title": row.title or "",
+                "type": row.type or "unknown",
+                "file_path": row.file_path,
+                "url": row.url,
+                "archived_path": row.archived_path,
+                "content_hash": row.content_hash,
+                "metadata": metadata,
+            })
+        return batch
+    finally:
+        db.close()
+
+
+async def load_document_content(doc: Dict[str, Any]) -> str:
+    """读取待索引文档的文本（图片及无本地文件的文档只索引标题和元数据）"""
+    file_path = doc.get("file_path")
+    if not file_path or (doc.get("type") or "").lower() in NON_TEXT_TYPES:
+        return ""
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(file_path)
+    extracted = await load_document_text(file_path, doc["type"], doc.get("content_hash"))
+    return extracted.content
+
+
+# FTS表的列及bm25各列权重（id列不参与打分，标题命中权重最高）
+FTS_COLUMNS = ("id", "title", "content", "metadata")
+BM25_WEIGHTS = {"id": 0.0, "title": 10.0, "content": 1.0, "metadata": 0.5}
+
+# 高亮标记与片段省略符
+HIGHLIGHT_OPEN = "<mark>"
+HIGHLIGHT_CLOSE = "</mark>"
+SNIPPET_ELLIPSIS = "…"
+
+
+def _match_spans(text: str, terms: set) -> List[List[int]]:
+    """用与索引相同的分词在原文中定位命中的词，返回合并重叠后的 [起, 止) 字符区间"""
+    spans = sorted((start, end) for word, start, end in jieba.tokenize(text, mode="search")
+                   if word.lower() in terms)
+    merged: List[List[int]] = []
+    for start, end in spans:
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def _mark_spans(text: str, spans: List[List[int]], offset: int = 0) -> str:
+    """在文本中为命中区间加上高亮标记，offset为text在原文中的起始位置"""
+    parts, pos = [], 0
+    for start, end in spans:
+        start, end = max(start - offset, pos), min(end - offset, len(text))
+        if start >= end:
+            continue
+        parts += [text[pos:start], HIGHLIGHT_OPEN, text[start:end], HIGHLIGHT_CLOSE]
+        pos = end
+    parts.append(text[pos:])
+    return "".join(parts)
+
+
+def _best_window_start(text: str, terms: set, size: int) -> int:
+    """按查询词的出现位置选择片段起点：窗口内出现的不同查询词最多，其次最靠前"""
+    lowered = text.lower()
+    hits = []
+    for term in terms:
+        pos = lowered.find(term)
+        while pos >= 0:
+            hits.append((pos, term))
+            pos = lowered.find(term, pos + 1)
+    if not hits:
+        return 0
+    hits.sort()
+    positions = [pos for pos, _ in hits]
+    best, best_count = positions[0], 0
+    for i, pos in enumerate(positions):
+        # 每个词平均按两个字符估算窗口跨度
+        count = len({term for _, term in hits[i:bisect_left(positions, pos + size * 2)]})
+        if count > best_count:
+            best, best_count = pos, count
+    return best
+
+
+def highlight_texts(rows: List[Tuple[str, str]], terms: List[str], size: int) -> List[Tuple[str, str]]:
+    """按原文生成标题高亮和正文片段（jieba模式，需可被pickle，故为模块级函数）
+
+    全文索引中是分词后的文本，FTS5的highlight()/snippet()只能输出分词文本；这里用同样的分词
+    在原文中定位命中的词，片段取查询词最集中处的size个词，保留原文的空白、换行和标点。
+    只对片段附近的一段原文分词，长文档不必整篇分词。
+    """
+    terms = {term.lower() for term in terms}
+    results = []
+    for title, content in rows:
+        title, content = title or "", content or ""
+        title_highlight = _mark_spans(title, _match_spans(title, terms))
+        
+        snippet = ""
+        if content:
+            anchor = _best_window_start(content, terms, size)
+            region_start = max(0, anchor - size * 2)
+            region = content[region_start:anchor + size * 6]
+            words = [(start, end) for word, start, end in jieba.tokenize(region) if word.strip()]
+            if words:
+                # 命中词前保留约四分之一窗口的上下文
+                first = max(0, bisect_left([start for start, _ in words], anchor - region_start) - size // 4)
+                # 靠近末尾时向前补足窗口
+                first = max(0, min(first, len(words) - size))
+                last = min(len(words), first + size) - 1
+                start, end = words[first][0], words[last][1]
+                snippet = _mark_spans(region[start:end], _match_spans(region, terms), start)
+                if region_start + start > 0:
+                    snippet = SNIPPET_ELLIPSIS + snippet
+                if region_start + end < len(content):
+                    snippet += SNIPPET_ELLIPSIS
+        results.append((title_highlight, snippet))
+    return results
+
+
+def _quote_term(term: str) -> str:
+    """将词作为FTS5短语引用，避免被解析为查询语法"""
+    return '"' + term.replace('"', '""') + '"'
+
 
 class DocumentIndex:
-    """文档索引与检索服务"""
+    """文档索引与检索服务
+    
+    使用长连接访问索引库：一个写连接（写事务串行）和一个读连接，
+    开启WAL后检索不会被写入阻塞。
+    """
     
     def __init__(self, index_db_path: str):
         self.index_db_path = index_db_path
         self.initialized = False
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._reader: Optional[aiosqlite.Connection] = None
+        self._write_lock = asyncio.Lock()
+        self._init_lock = asyncio.Lock()
+        # 配置的分词模式与当前索引表实际使用的分词模式（迁移完成前两者可能不同）
+        self.tokenizer = resolve_tokenizer(settings.DOCUMENT_INDEX_TOKENIZER)
+        self.active_tokenizer = self.tokenizer
+        self.active_layout = FTS_LAYOUT_EXTERNAL
+        # 正文表是否保存原文（否则为旧版本保存的分词文本，需重建）
+        self.active_text_original = True
+        # 当前索引表的jieba分词方式，写入和删除时必须与建索引时一致
+        self.active_segmentation = JIEBA_SEARCH
+        self._rebuild_task: Optional[asyncio.Task] = None
+    
+    async def _connect(self) -> aiosqlite.Connection:
+        """打开连接并设置性能相关的PRAGMA"""
+        db = await aiosqlite.connect(self.index_db_path)
+        await db.execute("PRAGMA journal_mode=WAL")
+        await db.execute("PRAGMA synchronous=NORMAL")
+        await db.execute("PRAGMA temp_store=MEMORY")
+        await db.execute(f"PRAGMA mmap_size={int(settings.DOCUMENT_INDEX_MMAP_SIZE)}")
+        # 负数表示以KB为单位
+        await db.execute(f"PRAGMA cache_size=-{int(settings.DOCUMENT_INDEX_CACHE_SIZE_KB)}")
+        # 全文索引的外部内容视图通过该函数解压正文
+        await db.create_function("text_decompress", 1, decompress_text, deterministic=True)
+        return db
     
     async def initialize(self):
         """初始化索引数据库"""
-        # 确保目录存在
-        os.makedirs(os.path.dirname(self.index_db_path), exist_ok=True)
-        
-        async with aiosqlite.connect(self.index_db_path) as db:
+        async with self._init_lock:
+            if self.initialized:
+                return
+            
+            # 确保目录存在
+            os.makedirs(os.path.dirname(self.index_db_path), exist_ok=True)
+            
+            db = await self._connect()
             # 创建文档表
             await db.execute('''
             CREATE TABLE IF NOT EXISTS documents (
@@ -39,17 +305,38 @@ class DocumentIndex:
             )
             ''')
             
-            # 创建全文索引表
+            # 索引库自身的配置（如全文索引的分词模式与存储布局）
             await db.execute('''
-            CREATE VIRTUAL TABLE IF NOT EXISTS document_fts USING fts5(
-                id,
-                title,
-                content,
-                metadata,
-                tokenize='porter unicode61'
+            CREATE TABLE IF NOT EXISTS index_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
             )
             ''')
             
+            # 创建全文索引表；已存在时读取其分词模式和布局（旧版本未记录，即为unicode61、正文存于FTS表内）
+            cursor = await db.execute("SELECT 1 FROM sqlite_master WHERE name = 'document_fts'")
+            if await cursor.fetchone() is None:
+                await self._create_text_store(db, "document_text")
+                await self._create_content_view(db)
+                await self._create_fts_table(db, "document_fts", self.tokenizer)
+                await self._set_meta(db, "fts_tokenizer", self.tokenizer)
+                await self._set_meta(db, "fts_layout", FTS_LAYOUT_EXTERNAL)
+                await self._set_meta(db, "fts_text", FTS_TEXT_ORIGINAL)
+                await self._set_meta(db, "fts_segmentation", JIEBA_SEARCH)
+                self.active_tokenizer = self.tokenizer
+                self.active_layout = FTS_LAYOUT_EXTERNAL
+                self.active_text_original = True
+                self.active_segmentation = JIEBA_SEARCH
+            else:
+                cursor = await db.execute("SELECT key, value FROM index_meta")
+                meta = {key: value for key, value in await cursor.fetchall()}
+                self.active_tokenizer = meta.get("fts_tokenizer", TOKENIZER_UNICODE61)
+                self.active_layout = meta.get("fts_layout", FTS_LAYOUT_INLINE)
+                # 只有jieba模式会改写索引文本，其他模式下保存的一直是原文
+                self.active_text_original = (meta.get("fts_text") == FTS_TEXT_ORIGINAL
+                                             or self.active_tokenizer != TOKENIZER_JIEBA)
+                self.active_segmentation = meta.get("fts_segmentation", JIEBA_PRECISE)
+            
             # 创建文档元数据表
             await db.execute('''
             CREATE TABLE IF NOT EXISTS document_metadata (
@@ -61,9 +348,246 @@ class DocumentIndex:
             )
             ''')
             
+            # 元数据过滤 EXISTS(key = ? AND value = ? AND document_id = d.id) 走该复合索引
+            await db.execute('''
+            CREATE INDEX IF NOT EXISTS idx_document_metadata_key_value
+            ON document_metadata (key, value, document_id)
+            ''')
+            
             await db.commit()
+            
+            self._writer = db
+            self._reader = await self._connect()
+            self._reader.row_factory = sqlite3.Row
+            self.initialized = True
+            
+            # 分词模式或存储布局变更时在后台重建全文索引，重建期间检索继续使用旧索引
+            if (self.active_tokenizer != self.tokenizer or self.active_layout != FTS_LAYOUT_EXTERNAL
+                    or not self.active_text_original
+                    or (self.tokenizer == TOKENIZER_JIEBA and self.active_segmentation != JIEBA_SEARCH)):
+                self._rebuild_task = asyncio.create_task(self.rebuild_fts(self.tokenizer))
+                self._rebuild_task.add_done_callback(self._on_rebuild_done)
+    
+    def _on_rebuild_done(self, task: asyncio.Task):
+        """后台重建结束时报告失败，检索继续使用旧索引，下次启动时重试"""
+        if task.cancelled():
+            print("Document index rebuild cancelled")
+        elif task.exception() is not None:
+            print(f"Document index rebuild failed, still serving the {self.active_tokenizer} index: {task.exception()}")
+    
+    async def _create_text_store(self, db: aiosqlite.Connection, name: str):
+        """创建压缩正文表，作为全文索引的外部内容（rowid与FTS表一一对应）"""
+        await db.execute(f'''
+        CREATE TABLE IF NOT EXISTS {name} (
+            rowid INTEGER PRIMARY KEY,
+            id TEXT NOT NULL UNIQUE,
+            title TEXT,
+            content BLOB,
+            metadata TEXT
+        )
+        ''')
+    
+    async def _create_content_view(self, db: aiosqlite.Connection):
+        """外部内容视图：按rowid读取并解压正文
         
-        self.initialized = True
+        jieba模式下视图给出的是原文而非写入索引的分词文本，不能使用FTS5的'rebuild'命令
+        和highlight()/snippet()，片段与高亮由 highlight_texts 按原文生成。
+        """
+        await db.execute('''
+        CREATE VIEW IF NOT EXISTS document_text_view AS
+        SELECT rowid, id, title, text_decompress(content) AS content, metadata
+        FROM document_text
+        ''')
+    
+    async def _create_fts_table(self, db: aiosqlite.Connection, name: str, mode: str):
+        """按分词模式创建外部内容全文索引表（FTS表本身只存倒排索引，不存正文）"""
+        await db.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5(
+            id UNINDEXED,
+            title,
+            content,
+            metadata,
+            content='document_text_view',
+            content_rowid='rowid',
+            tokenize='{FTS_TOKENIZE_CLAUSES[mode]}'
+        )
+        ''')
+    
+    async def _set_meta(self, db: aiosqlite.Connection, key: str, value: str):
+        await db.execute(
+            "INSERT INTO index_meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value)
+        )
+    
+    async def _prepare_fts_texts(self, texts: List[str], mode: str,
+                                 segmentation: str = JIEBA_SEARCH) -> List[str]:
+        """按分词模式处理待写入全文索引的文本（jieba模式下预先分词）"""
+        if mode != TOKENIZER_JIEBA:
+            return texts
+        return await run_cpu(segment_texts, texts, segmentation)
+    
+    async def rebuild_fts(self, mode: str) -> int:
+        """以新的分词模式在线重建全文索引（同时迁移到外部内容布局）
+        
+        先按rowid分批把现有索引写入新的正文表和FTS表，最后在一个事务中替换旧表。
+        旧索引中同一id有多行时只保留rowid最大（最后写入）的一行。
+        重建期间持有写锁（新写入排队等待），读连接继续查询旧表；失败时删除未完成的新表。
+        
+        Returns:
+            重建的文档数量
+        """
+        if not self.initialized:
+            await self.initialize()
+        
+        source_mode = self.active_tokenizer
+        source_original = self.active_text_original
+        batch_size = max(1, settings.DOCUMENT_INDEX_REBUILD_BATCH_SIZE)
+        copied = 0
+        print(f"Rebuilding document index: tokenizer {source_mode} -> {mode}, layout {self.active_layout} -> {FTS_LAYOUT_EXTERNAL}")
+        
+        async with self._write_lock:
+            db = self._writer
+            try:
+                await db.execute("DROP TABLE IF EXISTS document_fts_rebuild")
+                await db.execute("DROP TABLE IF EXISTS document_text_rebuild")
+                await self._create_text_store(db, "document_text_rebuild")
+                await self._create_fts_table(db, "document_fts_rebuild", mode)
+                # 每个id要保留的行，正文表的id列唯一
+                await db.execute("DROP TABLE IF EXISTS temp.fts_rebuild_keep")
+                await db.execute("CREATE TEMP TABLE fts_rebuild_keep (rowid INTEGER PRIMARY KEY)")
+                await db.execute(
+                    "INSERT INTO temp.fts_rebuild_keep (rowid) SELECT MAX(rowid) FROM document_fts GROUP BY id"
+                )
+                await db.commit()
+                
+                last_rowid = 0
+                while True:
+                    # 两种布局下都可以从FTS表读出各列原文
+                    cursor = await db.execute(
+                        "SELECT f.rowid, f.id, f.title, f.content, f.metadata "
+                        "FROM temp.fts_rebuild_keep AS k JOIN document_fts AS f ON f.rowid = k.rowid "
+                        "WHERE k.rowid > ? ORDER BY k.rowid LIMIT ?",
+                        (last_rowid, batch_size)
+                    )
+                    rows = await cursor.fetchall()
+                    if not rows:
+                        break
+                    
+                    # 正文表保存原文，只有写入FTS表的文本按新模式分词
+                    titles = [row[2] for row in rows]
+                    contents = [row[3] for row in rows]
+                    if not source_original:
+                        titles, contents = await self._load_original_texts(db, rows, source_mode)
+                    index_titles = await self._prepare_fts_texts(titles, mode)
+                    index_contents = await self._prepare_fts_texts(contents, mode)
+                    
+                    await db.executemany(
+                        "INSERT INTO document_text_rebuild (rowid, id, title, content, metadata) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        [(row[0], row[1], title, compress_text(content), row[4])
+                         for row, title, content in zip(rows, titles, contents)]
+                    )
+                    await db.executemany(
+                        "INSERT INTO document_fts_rebuild (rowid, id, title, content, metadata) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        [(row[0], row[1], title, content, row[4])
+                         for row, title, content in zip(rows, index_titles, index_contents)]
+                    )
+                    await db.commit()
+                    last_rowid = rows[-1][0]
+                    copied += len(rows)
+                
+                # 替换旧表：先删除引用旧表的视图，重命名后再重建视图
+                await db.execute("BEGIN")
+                await db.execute("DROP VIEW IF EXISTS document_text_view")
+                await db.execute("DROP TABLE document_fts")
+                await db.execute("DROP TABLE IF EXISTS document_text")
+                await db.execute("ALTER TABLE document_text_rebuild RENAME TO document_text")
+                await db.execute("ALTER TABLE document_fts_rebuild RENAME TO document_fts")
+                await self._create_content_view(db)
+                await self._set_meta(db, "fts_tokenizer", mode)
+                await self._set_meta(db, "fts_layout", FTS_LAYOUT_EXTERNAL)
+                await self._set_meta(db, "fts_text", FTS_TEXT_ORIGINAL)
+                await self._set_meta(db, "fts_segmentation", JIEBA_SEARCH)
+                await db.commit()
+                await db.execute("DROP TABLE IF EXISTS temp.fts_rebuild_keep")
+                self.active_tokenizer = mode
+                self.active_layout = FTS_LAYOUT_EXTERNAL
+                self.active_text_original = True
+                self.active_segmentation = JIEBA_SEARCH
+                print(f"Document index rebuilt with {mode} tokenizer ({copied} documents)")
+            except Exception as e:
+                await db.rollback()
+                print(f"Error rebuilding document index: {e}")
+                try:
+                    await db.execute("DROP TABLE IF EXISTS document_fts_rebuild")
+                    await db.execute("DROP TABLE IF EXISTS document_text_rebuild")
+                    await db.execute("DROP TABLE IF EXISTS temp.fts_rebuild_keep")
+                    await db.commit()
+                except Exception as cleanup_error:
+                    print(f"Error dropping partial rebuild tables: {cleanup_error}")
+                raise
+        
+        # 重建产生大量小段，合并一次
+        await self.optimize()
+        return copied
+    
+    async def _load_original_texts(self, db: aiosqlite.Connection, rows: List[tuple], source_mode: str):
+        """旧索引保存的是分词文本，去掉空格后仍会丢失换行和标点前的空格：
+        重建时从文档文件重新读取原文（经由文本缓存），读取失败时退回还原后的文本
+        """
+        placeholders = ", ".join("?" for _ in rows)
+        cursor = await db.execute(
+            f"SELECT id, title, type, file_path, content_hash FROM documents WHERE id IN ({placeholders})",
+            [row[1] for row in rows]
+        )
+        documents = {doc[0]: doc for doc in await cursor.fetchall()}
+        titles, contents = [], []
+        for row in rows:
+            title, content = restore_text(row[2], source_mode), restore_text(row[3], source_mode)
+            doc = documents.get(row[1])
+            if doc is not None:
+                title = doc[1]
+                try:
+                    original = await load_document_content(
+                        {"id": doc[0], "type": doc[2], "file_path": doc[3], "content_hash": doc[4]}
+                    )
+                    content = original or content
+                except Exception as e:
+                    print(f"Warning: Could not re-read document {row[1]} for rebuild, using indexed text: {e}")
+            titles.append(title)
+            contents.append(content)
+        return titles, contents
+    
+    async def optimize(self) -> None:
+        """将全文索引的所有段合并为一个（耗时与索引大小成正比，适合低峰期执行）"""
+        if not self.initialized:
+            await self.initialize()
+        async with self._write_lock:
+            await self._writer.execute("INSERT INTO document_fts(document_fts) VALUES('optimize')")
+            await self._writer.commit()
+    
+    async def merge(self, pages: int = 500) -> None:
+        """增量合并全文索引段，每次最多处理约pages个页，可频繁调用"""
+        if not self.initialized:
+            await self.initialize()
+        async with self._write_lock:
+            await self._writer.execute(
+                "INSERT INTO document_fts(document_fts, rank) VALUES('merge', ?)", (pages,)
+            )
+            await self._writer.commit()
+    
+    async def close(self):
+        """关闭索引连接"""
+        if self._rebuild_task is not None and not self._rebuild_task.done():
+            self._rebuild_task.cancel()
+        for db in (self._writer, self._reader):
+            if db is not None:
+                await db.close()
+        self._writer = None
+        self._reader = None
+        self.initialized = False
     
     async def add_document(self, document_id: str, title: str, doc_type: str, 
                           content: str, metadata: Dict[str, Any], 
@@ -72,38 +596,333 @@ class DocumentIndex:
                           archived_path: Optional[str] = None,
                           content_hash: Optional[str] = None) -> bool:
         """添加文档到索引"""
+        return await self.add_documents([{
+            "id": document_id,
+            "title": title,
+            "type": doc_type,
+            "content": content,
+            "metadata": metadata,
+            "file_path": file_path,
+            "url": url,
+            "archived_path": archived_path,
+            "content_hash": content_hash,
+        }]) == 1
+    
+    async def add_documents(self, documents: List[Dict[str, Any]]) -> int:
+        """批量添加文档到索引，所有文档在一个事务中用 executemany 写入
+        
+        Args:
+            documents: 文档字典列表，键与 add_document 的参数相同（id, title, type, content, metadata, ...）
+            
+        Returns:
+            写入的文档数量，失败时为0
+        """
+        if not documents:
+            return 0
         if not self.initialized:
             await self.initialize()
         
-        try:
-            async with aiosqlite.connect(self.index_db_path) as db:
+        document_rows, fts_rows, metadata_rows = self._build_rows(documents)
+        
+        async with self._write_lock:
+            db = self._writer
+            try:
+                index_rows = await self._prepare_fts_rows(fts_rows)
+                
+                await db.execute("BEGIN")
                 # 插入文档基本信息
-                now = datetime.utcnow().isoformat()
-                await db.execute('''
+                await db.executemany('''
                 INSERT INTO documents 
                 (id, title, type, file_path, url, archived_path, content_hash, created_at, updated_at)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (document_id, title, doc_type, file_path, url, archived_path, content_hash, now, now))
+                ''', document_rows)
                 
                 # 插入文档内容到全文索引
-                metadata_json = json.dumps(metadata)
-                await db.execute('''
-                INSERT INTO document_fts (id, title, content, metadata)
-                VALUES (?, ?, ?, ?)
-                ''', (document_id, title, content, metadata_json))
+                await self._insert_fts_rows(db, fts_rows, index_rows)
                 
                 # 插入结构化元数据
-                for key, value in self._flatten_metadata(metadata):
-                    await db.execute('''
-                    INSERT INTO document_metadata (document_id, key, value)
-                    VALUES (?, ?, ?)
-                    ''', (document_id, key, str(value)))
+                await db.executemany('''
+                INSERT INTO document_metadata (document_id, key, value)
+                VALUES (?, ?, ?)
+                ''', metadata_rows)
                 
+                await db.commit()
+                return len(documents)
+            except Exception as e:
+                await db.rollback()
+                print(f"Error indexing documents: {e}")
+                return 0
+    
+    async def upsert_document(self, document_id: str, title: str, doc_type: str, 
+                             content: str, metadata: Dict[str, Any], 
+                             file_path: Optional[str] = None,
+                             url: Optional[str] = None,
+                             archived_path: Optional[str] = None,
+                             content_hash: Optional[str] = None) -> bool:
+        """添加或更新文档索引，content_hash未变化时跳过
+        
+        Returns:
+            是否写入了索引（内容未变化时为False）
+        """
+        stats = await self.upsert_documents([{
+            "id": document_id,
+            "title": title,
+            "type": doc_type,
+            "content": content,
+            "metadata": metadata,
+            "file_path": file_path,
+            "url": url,
+            "archived_path": archived_path,
+            "content_hash": content_hash,
+        }])
+        return stats["added"] + stats["updated"] > 0
+    
+    async def upsert_documents(self, documents: List[Dict[str, Any]]) -> Dict[str, int]:
+        """批量添加或更新文档索引
+        
+        与已索引的content_hash比较：未变化的文档跳过；变化的文档先删除旧的全文索引和元数据，
+        再写入新内容（保留原有created_at）。所有变更在一个事务中完成。
+        
+        Returns:
+            统计：added（新增）、updated（更新）、unchanged（跳过）
+        """
+        stats = {"added": 0, "updated": 0, "unchanged": 0}
+        if not documents:
+            return stats
+        if not self.initialized:
+            await self.initialize()
+        
+        async with self._write_lock:
+            db = self._writer
+            try:
+                existing = await self._fetch_content_hashes(db, [doc["id"] for doc in documents])
+                changed = [doc for doc in documents if self._is_changed(existing, doc["id"], doc.get("content_hash"))]
+                stale_ids = [doc["id"] for doc in changed if doc["id"] in existing]
+                stats["unchanged"] = len(documents) - len(changed)
+                if not changed:
+                    return stats
+                
+                document_rows, fts_rows, metadata_rows = self._build_rows(changed)
+                index_rows = await self._prepare_fts_rows(fts_rows)
+                
+                await db.execute("BEGIN")
+                # 删除旧的全文索引与元数据，文档行原地更新
+                await self._delete_index_rows(db, stale_ids, drop_documents=False)
+                await db.executemany('''
+                INSERT INTO documents 
+                (id, title, type, file_path, url, archived_path, content_hash, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    title = excluded.title,
+                    type = excluded.type,
+                    file_path = excluded.file_path,
+                    url = excluded.url,
+                    archived_path = excluded.archived_path,
+                    content_hash = excluded.content_hash,
+                    updated_at = excluded.updated_at
+                ''', document_rows)
+                await self._insert_fts_rows(db, fts_rows, index_rows)
+                await db.executemany('''
+                INSERT INTO document_metadata (document_id, key, value)
+                VALUES (?, ?, ?)
+                ''', metadata_rows)
+                await db.commit()
+                
+                stats["updated"] = len(stale_ids)
+                stats["added"] = len(changed) - len(stale_ids)
+                return stats
+            except Exception as e:
+                await db.rollback()
+                print(f"Error upserting documents: {e}")
+                raise
+    
+    async def changed_documents(self, content_hashes: Dict[str, Optional[str]]) -> List[str]:
+        """给出 {文档ID: content_hash}，返回需要（重新）索引的文档ID"""
+        if not content_hashes:
+            return []
+        if not self.initialized:
+            await self.initialize()
+        existing = await self._fetch_content_hashes(self._reader, list(content_hashes))
+        return [doc_id for doc_id, content_hash in content_hashes.items()
+                if self._is_changed(existing, doc_id, content_hash)]
+    
+    async def reindex(self, batch_size: Optional[int] = None) -> Dict[str, int]:
+        """按批遍历SQLite中的Document表做增量索引
+        
+        只为新增或content_hash变化的文档读取文本（经由文本缓存）并更新索引，
+        最后删除Document表中已不存在的文档的索引。索引在此期间保持可用。
+        
+        Returns:
+            统计：scanned、added、updated、unchanged、removed、failed
+        """
+        if not self.initialized:
+            await self.initialize()
+        
+        batch_size = batch_size or settings.DOCUMENT_INDEX_REBUILD_BATCH_SIZE
+        stats = {"scanned": 0, "added": 0, "updated": 0, "unchanged": 0, "removed": 0, "failed": 0}
+        seen = set()
+        last_id = ""
+        
+        while True:
+            batch = await run_io(load_document_batch, last_id, batch_size)
+            if not batch:
+                break
+            last_id = batch[-1]["id"]
+            stats["scanned"] += len(batch)
+            seen.update(doc["id"] for doc in batch)
+            
+            changed_ids = set(await self.changed_documents({doc["id"]: doc["content_hash"] for doc in batch}))
+            stats["unchanged"] += len(batch) - len(changed_ids)
+            
+            documents = []
+            for doc in batch:
+                if doc["id"] not in changed_ids:
+                    continue
+                try:
+                    doc["content"] = await load_document_content(doc)
+                    documents.append(doc)
+                except Exception as e:
+                    stats["failed"] += 1
+                    print(f"Warning: Could not read document {doc['id']} for indexing: {e}")
+            
+            if documents:
+                result = await self.upsert_documents(documents)
+                stats["added"] += result["added"]
+                stats["updated"] += result["updated"]
+                stats["unchanged"] += result["unchanged"]
+        
+        # 删除已不存在的文档
+        cursor = await self._reader.execute("SELECT id FROM documents")
+        removed = [row[0] for row in await cursor.fetchall() if row[0] not in seen]
+        for i in range(0, len(removed), batch_size):
+            async with self._write_lock:
+                db = self._writer
+                try:
+                    await db.execute("BEGIN")
+                    await self._delete_index_rows(db, removed[i:i + batch_size])
+                    await db.commit()
+                except Exception:
+                    await db.rollback()
+                    raise
+        stats["removed"] = len(removed)
+        
+        print(f"Document reindex finished: {stats}")
+        return stats
+    
+    @staticmethod
+    def _is_changed(existing: Dict[str, Optional[str]], doc_id: str, content_hash: Optional[str]) -> bool:
+        """未索引、无哈希或哈希不同即视为变化"""
+        return doc_id not in existing or not content_hash or existing[doc_id] != content_hash
+    
+    async def _fetch_content_hashes(self, db: aiosqlite.Connection, document_ids: List[str]) -> Dict[str, Optional[str]]:
+        """查询已索引文档的content_hash"""
+        if not document_ids:
+            return {}
+        placeholders = ", ".join("?" for _ in document_ids)
+        cursor = await db.execute(
+            f"SELECT id, content_hash FROM documents WHERE id IN ({placeholders})", document_ids
+        )
+        return {row[0]: row[1] for row in await cursor.fetchall()}
+    
+    def _build_rows(self, documents: List[Dict[str, Any]]):
+        """将文档字典转换为 documents、全文索引和元数据三张表的行"""
+        now = datetime.utcnow().isoformat()
+        document_rows = []
+        fts_rows = []
+        metadata_rows = []
+        for doc in documents:
+            metadata = doc.get("metadata") or {}
+            document_rows.append((
+                doc["id"], doc["title"], doc["type"], doc.get("file_path"), doc.get("url"),
+                doc.get("archived_path"), doc.get("content_hash"), now, now
+            ))
+            fts_rows.append((doc["id"], doc["title"], doc.get("content") or "", json.dumps(metadata)))
+            metadata_rows.extend(
+                (doc["id"], key, str(value)) for key, value in self._flatten_metadata(metadata)
+            )
+        return document_rows, fts_rows, metadata_rows
+    
+    async def _prepare_fts_rows(self, fts_rows: List[tuple]) -> List[tuple]:
+        """按当前索引表的分词模式处理标题和正文（需持有写锁，重建完成后才会切换模式）"""
+        mode, segmentation = self.active_tokenizer, self.active_segmentation
+        titles = await self._prepare_fts_texts([row[1] for row in fts_rows], mode, segmentation)
+        contents = await self._prepare_fts_texts([row[2] for row in fts_rows], mode, segmentation)
+        return [(row[0], title, content, row[3])
+                for row, title, content in zip(fts_rows, titles, contents)]
+    
+    async def delete_document(self, document_id: str) -> bool:
+        """从索引中删除文档"""
+        if not self.initialized:
+            await self.initialize()
+        
+        async with self._write_lock:
+            db = self._writer
+            try:
+                await db.execute("BEGIN")
+                await self._delete_index_rows(db, [document_id])
                 await db.commit()
                 return True
-        except Exception as e:
-            print(f"Error indexing document: {e}")
-            return False
+            except Exception as e:
+                await db.rollback()
+                print(f"Error deleting document from index: {e}")
+                return False
+    
+    async def _insert_fts_rows(self, db: aiosqlite.Connection, fts_rows: List[tuple], index_rows: List[tuple]):
+        """写入正文表与全文索引（需持有写锁并处于事务中）
+        
+        外部内容布局下先写压缩原文（fts_rows），再以相同rowid把按分词模式处理后的文本（index_rows）
+        写入FTS倒排索引。
+        """
+        if self.active_layout != FTS_LAYOUT_EXTERNAL:
+            await db.executemany(
+                "INSERT INTO document_fts (id, title, content, metadata) VALUES (?, ?, ?, ?)",
+                index_rows
+            )
+            return
+        
+        await db.executemany(
+            "INSERT INTO document_text (id, title, content, metadata) VALUES (?, ?, ?, ?)",
+            [(doc_id, title, compress_text(content), metadata) for doc_id, title, content, metadata in fts_rows]
+        )
+        await db.executemany('''
+        INSERT INTO document_fts (rowid, id, title, content, metadata)
+        VALUES ((SELECT rowid FROM document_text WHERE id = ?), ?, ?, ?, ?)
+        ''', [(row[0],) + tuple(row) for row in index_rows])
+    
+    async def _delete_index_rows(self, db: aiosqlite.Connection, document_ids: List[str],
+                                 drop_documents: bool = True):
+        """删除文档的索引、正文与元数据，drop_documents为False时保留documents表中的行（需持有写锁并处于事务中）
+        
+        外部内容表不会自动同步，需用写入时的列值执行FTS5的'delete'命令移除倒排索引中的词条；
+        正文表保存原文时按当前分词模式重新分词得到这些值（jieba分词结果是确定的，更换词典后应重建索引）。
+        """
+        if not document_ids:
+            return
+        placeholders = ", ".join("?" for _ in document_ids)
+        
+        if self.active_layout == FTS_LAYOUT_EXTERNAL:
+            cursor = await db.execute(
+                f"SELECT rowid, id, title, content, metadata FROM document_text WHERE id IN ({placeholders})",
+                document_ids
+            )
+            rows = await cursor.fetchall()
+            titles = [row[2] for row in rows]
+            contents = [decompress_text(row[3]) for row in rows]
+            if self.active_text_original:
+                titles = await self._prepare_fts_texts(titles, self.active_tokenizer, self.active_segmentation)
+                contents = await self._prepare_fts_texts(contents, self.active_tokenizer, self.active_segmentation)
+            await db.executemany(
+                "INSERT INTO document_fts (document_fts, rowid, id, title, content, metadata) "
+                "VALUES ('delete', ?, ?, ?, ?, ?)",
+                [(row[0], row[1], title, content, row[4]) for row, title, content in zip(rows, titles, contents)]
+            )
+            await db.execute(f"DELETE FROM document_text WHERE id IN ({placeholders})", document_ids)
+        else:
+            await db.execute(f"DELETE FROM document_fts WHERE id IN ({placeholders})", document_ids)
+        
+        await db.execute(f"DELETE FROM document_metadata WHERE document_id IN ({placeholders})", document_ids)
+        if drop_documents:
+            await db.execute(f"DELETE FROM documents WHERE id IN ({placeholders})", document_ids)
     
     async def search(self, query: str, filters: Dict[str, Any] = None, 
                     limit: int = 10, offset: int = 0) -> List[Dict[str, Any]]:
@@ -114,18 +933,59 @@ class DocumentIndex:
         try:
             # 构建基本搜索查询
             search_query = query.strip()
+            mode = self.active_tokenizer
+            match_query, like_terms = self._build_match_query(search_query, mode)
+            # 只返回由FTS5生成的片段和高亮标题，不取全文
+            if match_query and mode == TOKENIZER_JIEBA:
+                # 索引中是分词文本，取原文在Python中生成片段和高亮（只针对当前页的结果）
+                weights = ", ".join(str(BM25_WEIGHTS[column]) for column in FTS_COLUMNS)
+                match_columns = f'''
+                  fts.title AS title_highlight,
+                  fts.content AS snippet,
+                  bm25(document_fts, {weights}) AS score'''
+                params = []
+            elif match_query:
+                weights = ", ".join(str(BM25_WEIGHTS[column]) for column in FTS_COLUMNS)
+                match_columns = f'''
+                  highlight(document_fts, 1, ?, ?) AS title_highlight,
+                  snippet(document_fts, 2, ?, ?, ?, ?) AS snippet,
+                  bm25(document_fts, {weights}) AS score'''
+                params = [HIGHLIGHT_OPEN, HIGHLIGHT_CLOSE,
+                          HIGHLIGHT_OPEN, HIGHLIGHT_CLOSE, SNIPPET_ELLIPSIS, settings.DOCUMENT_INDEX_SNIPPET_TOKENS]
+            else:
+                # 没有MATCH时无法使用辅助函数，截取第一个短词附近的一段文本
+                match_columns = '''
+                  d.title AS title_highlight,
+                  substr(fts.content, max(1, instr(fts.content, ?) - ?), ?) AS snippet,
+                  NULL AS score'''
+                window = settings.DOCUMENT_INDEX_SNIPPET_TOKENS * 2
+                params = [like_terms[0] if like_terms else "", window, window * 3]
+            
+            # 外部内容布局下经由正文表的rowid关联，避免为读取id列而解压每条命中的正文
+            if self.active_layout == FTS_LAYOUT_EXTERNAL:
+                join_clause = '''JOIN document_text AS t ON t.rowid = fts.rowid
+            JOIN documents AS d ON d.id = t.id'''
+            else:
+                join_clause = "JOIN documents AS d ON fts.id = d.id"
             base_query = f'''
             SELECT d.id, d.title, d.type, d.file_path, d.url, d.archived_path, 
-                  d.content_hash, d.created_at, d.updated_at, fts.content
+                  d.content_hash, d.created_at, d.updated_at,{match_columns}
             FROM document_fts AS fts
-            JOIN documents AS d ON fts.id = d.id
-            WHERE document_fts MATCH ?
+            {join_clause}
             '''
             
-            params = [search_query]
-            
             # 添加过滤条件
             filter_conditions = []
+            if match_query:
+                filter_conditions.append("document_fts MATCH ?")
+                params.append(match_query)
+            for term in like_terms:
+                # 不足三个字符的词无法用三元组匹配，退回子串匹配
+                filter_conditions.append("(fts.title LIKE ? OR fts.content LIKE ?)")
+                pattern = f"%{term}%"
+                params.extend([pattern, pattern])
+            if not filter_conditions:
+                return []
             if filters:
                 for key, value in filters.items():
                     if key in ['type', 'title']:
@@ -142,44 +1002,82 @@ class DocumentIndex:
                         params.append(key)
                         params.append(str(value))
             
-            if filter_conditions:
-                base_query += " AND " + " AND ".join(filter_conditions)
+            base_query += " WHERE " + " AND ".join(filter_conditions)
             
             # 添加分页
-            base_query += " ORDER BY fts.rank LIMIT ? OFFSET ?"
+            base_query += " ORDER BY score LIMIT ? OFFSET ?" if match_query else \
+                " ORDER BY d.updated_at DESC LIMIT ? OFFSET ?"
             params.extend([limit, offset])
             
             # 执行查询
-            async with aiosqlite.connect(self.index_db_path) as db:
-                db.row_factory = sqlite3.Row
-                cursor = await db.execute(base_query, params)
-                rows = await cursor.fetchall()
+            db = self._reader
+            cursor = await db.execute(base_query, params)
+            rows = await cursor.fetchall()
+            
+            # 一次查询取回整页结果的元数据
+            metadata_by_id = await self._fetch_metadata(db, [row['id'] for row in rows])
+            
+            highlights = None
+            if match_query and mode == TOKENIZER_JIEBA:
+                texts = [(row['title_highlight'], row['snippet']) for row in rows]
+                if not self.active_text_original:
+                    texts = [(restore_text(title, mode), restore_text(content, mode)) for title, content in texts]
+                highlights = await run_cpu(highlight_texts, texts, query_terms(search_query),
+                                           settings.DOCUMENT_INDEX_SNIPPET_TOKENS)
+            
+            results = []
+            for i, row in enumerate(rows):
+                # 构建结果
+                result = dict(row)
+                result['metadata'] = metadata_by_id.get(row['id'], {})
                 
-                results = []
-                for row in rows:
-                    # 获取文档元数据
-                    meta_cursor = await db.execute('''
-                    SELECT key, value FROM document_metadata WHERE document_id = ?
-                    ''', (row['id'],))
-                    metadata = {k: v for k, v in await meta_cursor.fetchall()}
-                    
-                    # 构建结果
-                    result = dict(row)
-                    result['metadata'] = metadata
-                    
-                    # 提取匹配上下文
-                    content = row['content']
-                    context = self._extract_context(content, search_query, 150)
-                    result['context'] = context
-                    
-                    results.append(result)
+                # 匹配上下文
+                if highlights is not None:
+                    result['title_highlight'], result['snippet'] = highlights[i]
+                result['context'] = [result['snippet']] if result['snippet'] else []
                 
-                return results
+                results.append(result)
+            
+            return results
         
         except Exception as e:
             print(f"Error searching documents: {e}")
             return []
     
+    def _build_match_query(self, query: str, mode: str):
+        """按分词模式把用户输入转换为FTS5查询
+        
+        Returns:
+            (MATCH表达式或None, 需要用LIKE匹配的短词列表)
+        """
+        if mode == TOKENIZER_UNICODE61:
+            return query or None, []
+        
+        if mode == TOKENIZER_JIEBA:
+            terms = query_terms(query)
+            return " ".join(_quote_term(t) for t in terms) or None, []
+        
+        # trigram：每个词至少3个字符才能走索引
+        terms = query.split()
+        long_terms = [t for t in terms if len(t) >= 3]
+        short_terms = [t for t in terms if len(t) < 3]
+        return " ".join(_quote_term(t) for t in long_terms) or None, short_terms
+    
+    async def _fetch_metadata(self, db: aiosqlite.Connection, document_ids: List[str]) -> Dict[str, Dict[str, str]]:
+        """按文档ID批量获取元数据，每个文档聚合为一个JSON对象"""
+        # 去重后再生成占位符，保证参数个数一致
+        document_ids = list(dict.fromkeys(document_ids))
+        if not document_ids:
+            return {}
+        placeholders = ", ".join("?" for _ in document_ids)
+        cursor = await db.execute(f'''
+        SELECT document_id, json_group_object(key, value) AS metadata
+        FROM document_metadata
+        WHERE document_id IN ({placeholders})
+        GROUP BY document_id
+        ''', document_ids)
+        return {row[0]: json.loads(row[1]) for row in await cursor.fetchall()}
+    
     def _flatten_metadata(self, metadata: Dict[str, Any], prefix: str = "") -> List[tuple]:
         """将嵌套的元数据扁平化为键值对"""
         result = []
@@ -198,21 +1096,7 @@ class DocumentIndex:
                 result.append((full_key, value))
         
         return result
-    
-    def _extract_context(self, content: str, query: str, context_chars: int = 150) -> List[str]:
-        """提取搜索词周围的文本上下文"""
-        # 简单实现，实际系统可能需要更复杂的匹配算法
-        words = set(re.findall(r'\w+', query.lower()))
-        matches = []
-        
-        for word in words:
-            pattern = re.compile(r'(.{0,%d})(\b%s\b)(.{0,%d})' % 
-                               (context_chars//2, re.escape(word), context_chars//2), 
-                               re.IGNORECASE)
-            
-            for match in pattern.finditer(content):
-                before, term, after = match.groups()
-                context = f"{before}{term}{after}"
-                matches.append(context.strip())
-        
-        return matches[:5]  # 限制返回的上下文片段数量
\ No newline at end of file
+
+
+# 进程内共享的文档索引
+document_index = DocumentIndex(settings.DOCUMENT_INDEX_PATH)
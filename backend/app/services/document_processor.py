@@ -1,8 +1,9 @@
 # app/services/document_processor.py
 
-from typing import Tuple, Dict, Any, BinaryIO, NamedTuple
+from typing import Tuple, Dict, Any, BinaryIO, NamedTuple, List, Optional
 import os
 import aiofiles
+import io
 import hashlib
 import asyncio
 from datetime import datetime
@@ -10,6 +11,10 @@ from uuid import UUID, uuid4
 from fastapi import UploadFile, File
 
 from app.models.documents.source_document import SourceDocument
+from app.core.executors import run_cpu, run_io, cpu_uses_processes
+from app.services.blob_store import BlobStore
+from app.services.text_cache import ExtractedText, text_cache, paragraph_offsets
+from app.core.config import settings
 
 # Conditional imports to handle missing dependencies gracefully
 try:
@@ -34,26 +39,42 @@ except ImportError:
     print("WARNING: chardet not installed. Text encoding detection will be limited.")
 
 
+# PDF结构信息中保留的排版块数量上限，避免元数据过大
+MAX_PDF_TEXT_BLOCKS = 100
+
+
+class UploadTooLargeError(ValueError):
+    """上传文件超过允许的最大大小"""
+    
+    def __init__(self, max_size: int):
+        super().__init__(f"File exceeds maximum upload size of {max_size} bytes")
+        self.max_size = max_size
+
+
 class ProcessResult(NamedTuple):
     """文档处理结果"""
     document: SourceDocument
     text_content: str
     metadata: Dict[str, Any]
     error: str = None
+    deduplicated: bool = False  # 相同内容此前已上传过
 
 
 class DocumentProcessor:
     """增强版文档处理器，支持多格式文档解析与结构保留"""
     
-    def __init__(self, documents_dir: str = "./data/documents", archives_dir: str = "./data/archives"):
+    def __init__(self, documents_dir: str = "./data/documents", archives_dir: str = "./data/archives",
+                 blob_store: Optional[BlobStore] = None):
         """初始化文档处理器
         
         Args:
             documents_dir: 文档存储目录
             archives_dir: 归档存储目录
+            blob_store: 内容寻址存储，上传的文件按内容哈希存放
         """
         self.documents_dir = documents_dir
         self.archives_dir = archives_dir
+        self.blob_store = blob_store or BlobStore()
         
         # 确保目录存在
         os.makedirs(documents_dir, exist_ok=True)
@@ -69,6 +90,8 @@ class DocumentProcessor:
         Returns:
             包含处理结果的ProcessResult对象
         """
+        # 已存入内容寻址存储的内容哈希，后续步骤失败时用于归还引用
+        ingested_hash = None
         try:
             # 打印日志以进行调试
             print(f"Processing file: {filename}")
@@ -84,74 +107,28 @@ class DocumentProcessor:
                     error=f"Missing file extension in filename: {filename}"
                 )
             
-            # 生成唯一文件名
             unique_id = str(uuid4())
-            safe_filename = f"{unique_id}_{os.path.basename(filename)}"
-            file_path = os.path.join(self.documents_dir, safe_filename)
-            
-            # 确保目录存在
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
             
-            # 保存文件 - 更安全的方法读取文件内容
-            content = None
+            # 流式保存文件：按块读取、增量计算哈希并写入临时文件，完成后按内容哈希入库（原子重命名）
+            temp_path = self.blob_store.temp_path()
             try:
-                # 判断文件对象类型
-                if isinstance(file, bytes):
-                    # 如果已经是字节内容，直接使用
-                    content = file
-                    print("File is already bytes object")
-                elif hasattr(file, "read"):
-                    # 检查read方法是否是协程
-                    try:
-                        if asyncio.iscoroutinefunction(file.read):
-                            # 异步读取
-                            content = await file.read()
-                            print("Used async read method")
-                        else:
-                            # 同步读取
-                            content = file.read()
-                            print("Used sync read method")
-                    except TypeError:
-                        # 处理无法确定是否为协程的情况
-                        try:
-                            # 尝试直接读取
-                            content = file.read()
-                            print("Used direct read after TypeError")
-                        except:
-                            # 如果直接读取失败，尝试作为普通对象使用
-                            content = file
-                            print("Used file object directly after read failures")
-                else:
-                    print(f"Warning: file object doesn't have 'read' method, type: {type(file)}")
-                    # 尝试直接使用文件对象
-                    content = file
-                    
-                if not content:
+                digest, file_size = await self._stream_to_file(file, temp_path)
+                if file_size == 0:
                     raise ValueError("Could not read file content")
-                
-                # 确保内容是字节类型
-                if not isinstance(content, bytes):
-                    if isinstance(content, str):
-                        content = content.encode('utf-8')
-                    else:
-                        raise TypeError(f"Unexpected content type: {type(content)}")
-            except Exception as e:
-                print(f"Error reading file content: {str(e)}")
+                # 文件内容哈希
+                content_hash = f"sha256:{digest}"
+                # 相同内容已存在时只增加引用计数，不再占用磁盘空间
+                file_path, is_new = await run_io(self.blob_store.ingest, temp_path, content_hash, file_size)
+                ingested_hash = content_hash
+                print(f"File stored at {file_path} ({file_size} bytes, {'new' if is_new else 'deduplicated'})")
+            except UploadTooLargeError as e:
+                print(f"Rejected upload {filename}: {e}")
                 return ProcessResult(
                     document=None, 
                     text_content="", 
                     metadata={}, 
-                    error=f"Error reading file: {str(e)}"
+                    error=str(e)
                 )
-                
-            # 计算文件内容哈希
-            content_hash = f"sha256:{hashlib.sha256(content).hexdigest()}"
-            
-            # 写入文件
-            try:
-                async with aiofiles.open(file_path, 'wb') as f:
-                    await f.write(content)
-                print(f"File written to {file_path}")
             except Exception as e:
                 print(f"Error writing file to disk: {str(e)}")
                 return ProcessResult(
@@ -160,6 +137,9 @@ class DocumentProcessor:
                     metadata={}, 
                     error=f"Error writing file to disk: {str(e)}"
                 )
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
             
             # 创建SourceDocument记录
             document = SourceDocument(
@@ -172,20 +152,20 @@ class DocumentProcessor:
                 accessed_at=datetime.now()
             )
             
-            # 提取内容和元数据 - 简化版直接读取为文本
+            # 提取内容和元数据 - 简化版直接读取为文本（只读取抽取所需的前缀，避免整个文件进入内存）
             text_content = ""
             metadata = {
-                'file_size': len(content),
+                'file_size': file_size,
                 'filename': filename,
                 'extension': file_ext
             }
             
             try:
                 # 尝试将内容解码为文本
-                text_content = content.decode('utf-8', errors='replace')
+                text_content = await run_io(_read_text_prefix, file_path, settings.NLP_MAX_TEXT_LENGTH)
             except Exception as e:
                 print(f"Warning: Could not decode file content as text: {e}")
-                text_content = f"[Binary content - {len(content)} bytes]"
+                text_content = f"[Binary content - {file_size} bytes]"
             
             # 更新文档元数据
             document.metadata.update(metadata)
@@ -197,24 +177,25 @@ class DocumentProcessor:
             os.makedirs(os.path.dirname(archive_path), exist_ok=True)
             
             try:
-                # 简单复制文件作为归档
-                async with aiofiles.open(archive_path, 'wb') as f:
-                    await f.write(content)
+                # 归档副本以硬链接指向存储中的内容，不占用额外空间
+                method = await run_io(self.blob_store.link, file_path, archive_path)
                 document.archived_path = archive_path
-                print(f"Created archive copy at {archive_path}")
+                print(f"Created archive {method} at {archive_path}")
             except Exception as e:
                 # 如果创建归档副本失败，不要中断处理
                 print(f"Warning: Could not create archive copy: {e}")
                 # 仍然继续处理
             
             print(f"File processing completed successfully for {filename}")
-            return ProcessResult(document=document, text_content=text_content, metadata=metadata)
+            return ProcessResult(document=document, text_content=text_content, metadata=metadata, deduplicated=not is_new)
             
         except Exception as e:
             # 出错时返回错误信息
             import traceback
             traceback.print_exc() # 这将打印详细的堆栈跟踪到控制台
             print(f"Unhandled error in document processing: {str(e)}")
+            if ingested_hash:
+                await self.release(ingested_hash)
             return ProcessResult(
                 document=None, 
                 text_content="", 
@@ -222,6 +203,42 @@ class DocumentProcessor:
                 error=f"Error processing file: {str(e)}"
             )
     
+    async def release(self, content_hash: str) -> None:
+        """归还 process_file 存入的内容引用（文档未能保存时调用），出错只记录不抛出"""
+        try:
+            await run_io(self.blob_store.release, content_hash)
+        except Exception as e:
+            print(f"Warning: Could not release stored content {content_hash}: {e}")
+    
+    async def _stream_to_file(self, file: Any, target_path: str) -> Tuple[str, int]:
+        """将上传内容按块写入目标文件，返回 (SHA-256十六进制摘要, 字节数)
+        
+        支持字节串、同步文件对象（如UploadFile.file）和异步read方法，超过UPLOAD_MAX_SIZE时抛出UploadTooLargeError。
+        """
+        if isinstance(file, (bytes, bytearray)):
+            file = io.BytesIO(file)
+        if not hasattr(file, "read"):
+            raise TypeError(f"Unexpected file object type: {type(file)}")
+        
+        if not asyncio.iscoroutinefunction(file.read):
+            # 同步文件对象：整个拷贝循环在IO线程中完成
+            return await run_io(_copy_stream, file, target_path,
+                                settings.UPLOAD_MAX_SIZE, settings.UPLOAD_CHUNK_SIZE)
+        
+        sha256 = hashlib.sha256()
+        size = 0
+        async with aiofiles.open(target_path, 'wb') as f:
+            while True:
+                chunk = await file.read(settings.UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > settings.UPLOAD_MAX_SIZE:
+                    raise UploadTooLargeError(settings.UPLOAD_MAX_SIZE)
+                sha256.update(chunk)
+                await f.write(chunk)
+        return sha256.hexdigest(), size
+    
     async def process_url(self, url: str) -> ProcessResult:
         """处理URL
         
@@ -265,13 +282,8 @@ class DocumentProcessor:
     async def _create_archive_copy(self, source_path: str, target_path: str) -> bool:
         """创建文件的归档副本"""
         try:
-            # 简单复制文件作为归档
-            async with aiofiles.open(source_path, 'rb') as src_file:
-                content = await src_file.read()
-                
-            async with aiofiles.open(target_path, 'wb') as dst_file:
-                await dst_file.write(content)
-                
+            # 优先硬链接，避免重复读写整个文件
+            await run_io(self.blob_store.link, source_path, target_path)
             return True
         except Exception as e:
             print(f"Error creating archive copy: {e}")
@@ -294,130 +306,12 @@ class DocumentProcessor:
     
     async def _process_pdf(self, file_path: str) -> Tuple[str, Dict[str, Any]]:
         """处理PDF文件，提取文本和结构信息"""
-        if not HAS_FITZ:
-            return "", {"error": "PyMuPDF (fitz) library not installed. Unable to process PDF files."}
-        
-        try:
-            doc = fitz.open(file_path)
-            
-            # 提取元数据
-            metadata = {
-                'title': doc.metadata.get('title', ''),
-                'author': doc.metadata.get('author', ''),
-                'subject': doc.metadata.get('subject', ''),
-                'keywords': doc.metadata.get('keywords', ''),
-                'creator': doc.metadata.get('creator', ''),
-                'producer': doc.metadata.get('producer', ''),
-                'creation_date': doc.metadata.get('creationDate', ''),
-                'modification_date': doc.metadata.get('modDate', ''),
-                'page_count': len(doc),
-                'file_size': os.path.getsize(file_path),
-            }
-            
-            # 提取结构化文本
-            text_blocks = []
-            try:
-                toc = doc.get_toc()  # 获取目录结构
-            except Exception:
-                toc = []  # 如果获取目录失败，使用空列表
-            
-            # 处理每一页，保留段落和布局信息
-            full_text = ""
-            for page_num, page in enumerate(doc):
-                try:
-                    page_text = page.get_text()
-                    full_text += page_text + "\n\n"
-                    
-                    # 获取更详细的块信息用于元数据
-                    try:
-                        blocks = page.get_text("dict")["blocks"]
-                        for block in blocks:
-                            if block["type"] == 0:  # 文本块
-                                for line in block["lines"]:
-                                    line_text = " ".join(span["text"] for span in line["spans"])
-                                    font_info = line["spans"][0] if line["spans"] else {}
-                                    
-                                    # 记录字体、大小等排版信息，用于判断标题或正文
-                                    text_block_info = {
-                                        "text": line_text,
-                                        "page": page_num + 1,
-                                        "font": font_info.get("font", ""),
-                                        "size": font_info.get("size", 0),
-                                        "position": (block["bbox"][0], block["bbox"][1])
-                                    }
-                                    
-                                    text_blocks.append(text_block_info)
-                    except Exception as e:
-                        print(f"Warning: Error extracting detailed blocks from page {page_num}: {e}")
-                        # 继续处理下一页
-                except Exception as e:
-                    print(f"Warning: Error processing page {page_num}: {e}")
-                    # 继续处理下一页
-            
-            # 将结构信息添加到元数据
-            metadata['structure'] = {
-                'toc': toc,
-                'text_blocks': text_blocks[:100],  # 只保存部分块以避免元数据过大
-            }
-            
-            return full_text, metadata
-        except Exception as e:
-            # 返回错误信息
-            return "", {"error": f"Error processing PDF: {str(e)}"}
+        # PyMuPDF解析为CPU密集型，分派到CPU执行器（长文档按页段并行），避免阻塞事件循环
+        return await extract_pdf(file_path)
     
     async def _process_word(self, file_path: str) -> Tuple[str, Dict[str, Any]]:
         """处理Word文档，提取文本和结构信息"""
-        if not HAS_DOCX:
-            return "", {"error": "python-docx library not installed. Unable to process Word documents."}
-        
-        try:
-            doc = docx.Document(file_path)
-            
-            # 提取元数据
-            core_properties = doc.core_properties
-            metadata = {
-                'title': core_properties.title or '',
-                'author': core_properties.author or '',
-                'subject': core_properties.subject or '',
-                'keywords': core_properties.keywords or '',
-                'created': str(core_properties.created) if core_properties.created else '',
-                'modified': str(core_properties.modified) if core_properties.modified else '',
-                'paragraph_count': len(doc.paragraphs),
-                'file_size': os.path.getsize(file_path),
-            }
-            
-            # 提取结构化文本
-            text_blocks = []
-            full_text = ""
-            
-            for i, para in enumerate(doc.paragraphs):
-                if para.text.strip():
-                    # 获取段落样式信息
-                    style_name = para.style.name if para.style else "Normal"
-                    
-                    # 记录段落信息，包括样式、层级等
-                    text_info = {
-                        "text": para.text,
-                        "index": i,
-                        "style": style_name,
-                        "level": 0 if "Heading" not in style_name else 
-                                int(style_name.replace("Heading ", "")) 
-                                if style_name.replace("Heading ", "").isdigit() else 0,
-                        "char_offset": len(full_text)
-                    }
-                    
-                    text_blocks.append(text_info)
-                    full_text += para.text + "\n"
-            
-            # 将结构信息添加到元数据
-            metadata['structure'] = {
-                'paragraphs': text_blocks,
-            }
-            
-            return full_text, metadata
-        except Exception as e:
-            # 返回错误信息
-            return "", {"error": f"Error processing Word document: {str(e)}"}
+        return await run_io(_extract_word, file_path)
     
     async def _process_text(self, file_path: str) -> Tuple[str, Dict[str, Any]]:
         """处理纯文本文件"""
@@ -426,9 +320,9 @@ class DocumentProcessor:
             async with aiofiles.open(file_path, 'rb') as f:
                 content = await f.read()
             
-            # 检测编码
+            # 检测编码（大文件检测较慢，放到IO执行器中）
             if HAS_CHARDET:
-                encoding_result = chardet.detect(content)
+                encoding_result = await run_io(chardet.detect, content)
                 encoding = encoding_result['encoding'] or 'utf-8'
                 encoding_confidence = encoding_result['confidence']
             else:
@@ -454,4 +348,301 @@ class DocumentProcessor:
             
             return text, metadata
         except Exception as e:
-            return "", {"error": f"Error processing text file: {str(e)}"}
\ No newline at end of file
+            return "", {"error": f"Error processing text file: {str(e)}"}
+
+
+async def extract_pdf(file_path: str) -> Tuple[str, Dict[str, Any]]:
+    """解析PDF文件；页数较多且CPU执行器为进程池时，按页段分派到多个工作进程并行解析"""
+    if not HAS_FITZ:
+        return "", {"error": "PyMuPDF (fitz) library not installed. Unable to process PDF files."}
+
+    try:
+        page_count = await run_io(_pdf_page_count, file_path)
+    except Exception as e:
+        return "", {"error": f"Error processing PDF: {str(e)}"}
+
+    step = max(1, settings.PDF_PAGES_PER_TASK)
+    if not cpu_uses_processes() or page_count < settings.PDF_PARALLEL_MIN_PAGES:
+        return await run_cpu(_extract_pdf, file_path)
+
+    # 每个工作进程独立打开PDF，只解析分配到的页段
+    try:
+        metadata, page_ranges = await asyncio.gather(
+            run_cpu(_extract_pdf_metadata, file_path),
+            asyncio.gather(*(
+                run_cpu(_extract_pdf_pages, file_path, start, min(start + step, page_count))
+                for start in range(0, page_count, step)
+            ))
+        )
+    except Exception as e:
+        return "", {"error": f"Error processing PDF: {str(e)}"}
+
+    full_text, structure = _merge_pdf_pages([page for pages in page_ranges for page in pages])
+    structure['toc'] = metadata.pop('toc', [])
+    metadata['structure'] = structure
+    return full_text, metadata
+
+
+def _pdf_page_count(file_path: str) -> int:
+    """读取PDF页数"""
+    with fitz.open(file_path) as doc:
+        return len(doc)
+
+
+def _extract_pdf_metadata(file_path: str) -> Dict[str, Any]:
+    """提取PDF文档级元数据与目录（在CPU执行器中运行）"""
+    with fitz.open(file_path) as doc:
+        metadata = {
+            'title': doc.metadata.get('title', ''),
+            'author': doc.metadata.get('author', ''),
+            'subject': doc.metadata.get('subject', ''),
+            'keywords': doc.metadata.get('keywords', ''),
+            'creator': doc.metadata.get('creator', ''),
+            'producer': doc.metadata.get('producer', ''),
+            'creation_date': doc.metadata.get('creationDate', ''),
+            'modification_date': doc.metadata.get('modDate', ''),
+            'page_count': len(doc),
+            'file_size': os.path.getsize(file_path),
+        }
+        try:
+            metadata['toc'] = doc.get_toc()  # 获取目录结构
+        except Exception:
+            metadata['toc'] = []  # 如果获取目录失败，使用空列表
+        return metadata
+
+
+def _extract_pdf_pages(file_path: str, start: int, end: int) -> List[Dict[str, Any]]:
+    """解析PDF中 [start, end) 页段的文本和排版块（需可被pickle，故为模块级函数）
+
+    Returns:
+        按页顺序的列表，每项包含 page、text 与 blocks
+    """
+    results = []
+    with fitz.open(file_path) as doc:
+        for page_num in range(start, end):
+            page_text = ""
+            text_blocks = []
+            try:
+                page = doc[page_num]
+                page_text = page.get_text()
+
+                # 获取更详细的块信息用于元数据（全文只保留前100个，每页无需更多）
+                try:
+                    blocks = page.get_text("dict")["blocks"]
+                    for block in blocks:
+                        if block["type"] != 0:  # 只处理文本块
+                            continue
+                        for line in block["lines"]:
+                            if len(text_blocks) >= MAX_PDF_TEXT_BLOCKS:
+                                break
+                            line_text = " ".join(span["text"] for span in line["spans"])
+                            font_info = line["spans"][0] if line["spans"] else {}
+
+                            # 记录字体、大小等排版信息，用于判断标题或正文
+                            text_blocks.append({
+                                "text": line_text,
+                                "page": page_num + 1,
+                                "font": font_info.get("font", ""),
+                                "size": font_info.get("size", 0),
+                                "position": (block["bbox"][0], block["bbox"][1])
+                            })
+                except Exception as e:
+                    print(f"Warning: Error extracting detailed blocks from page {page_num}: {e}")
+                    # 继续处理下一页
+            except Exception as e:
+                print(f"Warning: Error processing page {page_num}: {e}")
+                # 继续处理下一页
+
+            results.append({"page": page_num + 1, "text": page_text, "blocks": text_blocks})
+    return results
+
+
+def _merge_pdf_pages(page_results: List[Dict[str, Any]]) -> Tuple[str, Dict[str, Any]]:
+    """按页顺序拼接全文，并计算每页在全文中的字符偏移"""
+    parts = []
+    pages = []
+    text_blocks = []
+    offset = 0
+    for result in sorted(page_results, key=lambda r: r["page"]):
+        page_text = result["text"]
+        # 记录每页在全文中的字符偏移，供分块抽取和溯源定位使用
+        pages.append({
+            "page": result["page"],
+            "char_offset": offset,
+            "char_length": len(page_text),
+        })
+        parts.append(page_text + "\n\n")
+        offset += len(page_text) + 2
+        if len(text_blocks) < MAX_PDF_TEXT_BLOCKS:
+            text_blocks.extend(result["blocks"][:MAX_PDF_TEXT_BLOCKS - len(text_blocks)])
+
+    return "".join(parts), {
+        'pages': pages,
+        'text_blocks': text_blocks,  # 只保存部分块以避免元数据过大
+    }
+
+
+def _extract_pdf(file_path: str) -> Tuple[str, Dict[str, Any]]:
+    """在单个进程中顺序解析整个PDF，提取文本和结构信息（在CPU执行器中运行）"""
+    if not HAS_FITZ:
+        return "", {"error": "PyMuPDF (fitz) library not installed. Unable to process PDF files."}
+
+    try:
+        metadata = _extract_pdf_metadata(file_path)
+        full_text, structure = _merge_pdf_pages(_extract_pdf_pages(file_path, 0, metadata['page_count']))
+
+        # 将结构信息添加到元数据
+        structure['toc'] = metadata.pop('toc', [])
+        metadata['structure'] = structure
+        return full_text, metadata
+    except Exception as e:
+        # 返回错误信息
+        return "", {"error": f"Error processing PDF: {str(e)}"}
+
+
+def _extract_word(file_path: str) -> Tuple[str, Dict[str, Any]]:
+    """解析Word文档，提取文本和结构信息（在IO执行器中运行）"""
+    if not HAS_DOCX:
+        return "", {"error": "python-docx library not installed. Unable to process Word documents."}
+
+    try:
+        doc = docx.Document(file_path)
+
+        # 提取元数据
+        core_properties = doc.core_properties
+        metadata = {
+            'title': core_properties.title or '',
+            'author': core_properties.author or '',
+            'subject': core_properties.subject or '',
+            'keywords': core_properties.keywords or '',
+            'created': str(core_properties.created) if core_properties.created else '',
+            'modified': str(core_properties.modified) if core_properties.modified else '',
+            'paragraph_count': len(doc.paragraphs),
+            'file_size': os.path.getsize(file_path),
+        }
+
+        # 提取结构化文本
+        text_blocks = []
+        full_text = ""
+
+        for i, para in enumerate(doc.paragraphs):
+            if para.text.strip():
+                # 获取段落样式信息
+                style_name = para.style.name if para.style else "Normal"
+
+                # 记录段落信息，包括样式、层级等
+                text_info = {
+                    "text": para.text,
+                    "index": i,
+                    "style": style_name,
+                    "level": 0 if "Heading" not in style_name else 
+                            int(style_name.replace("Heading ", "")) 
+                            if style_name.replace("Heading ", "").isdigit() else 0,
+                    "char_offset": len(full_text)
+                }
+
+                text_blocks.append(text_info)
+                full_text += para.text + "\n"
+
+        # 将结构信息添加到元数据
+        metadata['structure'] = {
+            'paragraphs': text_blocks,
+        }
+
+        return full_text, metadata
+    except Exception as e:
+        # 返回错误信息
+        return "", {"error": f"Error processing Word document: {str(e)}"}
+
+
+def _copy_stream(source: BinaryIO, target_path: str, max_size: int, chunk_size: int) -> Tuple[str, int]:
+    """按块复制同步文件对象到目标文件，同时增量计算SHA-256"""
+    sha256 = hashlib.sha256()
+    size = 0
+    with open(target_path, 'wb') as f:
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            size += len(chunk)
+            if size > max_size:
+                raise UploadTooLargeError(max_size)
+            sha256.update(chunk)
+            f.write(chunk)
+    return sha256.hexdigest(), size
+
+
+def _read_text_prefix(file_path: str, max_chars: int) -> str:
+    """读取文件前缀并按UTF-8解码（最多读取max_chars个字符所需的字节）"""
+    with open(file_path, 'rb') as f:
+        data = f.read(max_chars * 4)
+    return data.decode('utf-8', errors='replace')[:max_chars]
+
+
+async def load_document_text(file_path: str, file_type: str, content_hash: Optional[str] = None) -> ExtractedText:
+    """读取已存储文档的全文与分页/段落偏移
+
+    提供content_hash时优先读取文本缓存，未命中时解析文件（PDF优先用PyMuPDF按页段并行解析）并写入缓存。
+    """
+    if content_hash:
+        cached = await run_io(text_cache.get, content_hash)
+        if cached is not None:
+            return cached
+
+    pages = None
+    if file_type.lower() == "pdf" and HAS_FITZ:
+        content, metadata = await extract_pdf(file_path)
+        if "error" in metadata:
+            print(f"Warning: {metadata['error']}, falling back to PyPDF2")
+        else:
+            pages = metadata["structure"]["pages"]
+    if pages is None:
+        content, pages = await run_cpu(read_document_text, file_path, file_type)
+
+    if content_hash:
+        return await run_io(text_cache.put, content_hash, content, pages)
+    return ExtractedText(content, pages, paragraph_offsets(content))
+
+
+def read_document_text(file_path: str, file_type: str) -> Tuple[str, List[Dict[str, Any]]]:
+    """读取已存储文档的全文，用于知识抽取（阻塞调用，需在执行器中运行）
+    
+    Returns:
+        (全文, 分页偏移列表)；非PDF文档分页列表为空
+    """
+    file_type = file_type.lower()
+    content = ""
+    pages = []
+    
+    # PDF文件
+    if file_type == "pdf":
+        import PyPDF2
+        with open(file_path, 'rb') as f:
+            pdf_reader = PyPDF2.PdfReader(f)
+            for page_num, page in enumerate(pdf_reader.pages):
+                page_text = page.extract_text()
+                pages.append({
+                    "page": page_num + 1,
+                    "char_offset": len(content),
+                    "char_length": len(page_text),
+                })
+                content += page_text + "\n\n"
+        return content, pages
+    
+    # Word文件
+    if file_type == "docx":
+        if not HAS_DOCX:
+            raise RuntimeError("python-docx library not installed. Unable to process Word documents.")
+        doc = docx.Document(file_path)
+        return "\n\n".join([p.text for p in doc.paragraphs if p.text.strip()]), pages
+    
+    # 文本及其他文件类型，尝试作为文本读取
+    with open(file_path, 'rb') as f:
+        binary_content = f.read()
+    try:
+        content = binary_content.decode('utf-8')
+    except UnicodeDecodeError:
+        content = binary_content.decode('gbk' if file_type in ["txt", "text"] else 'utf-8', errors='replace')
+    return content, pages
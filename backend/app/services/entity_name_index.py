@@ -0,0 +1,172 @@
+# app/services/entity_name_index.py
+
+from typing import Any, Dict, List, Optional
+import re
+
+from app.core.config import settings
+from app.db.entity_names import (
+    ENTITY_NAME_FULLTEXT_INDEX, fulltext_query, has_cjk, name_keys, normalize_name, normalize_pinyin
+)
+from app.db.neo4j_driver import get_driver
+
+# 匹配方式，按排序优先级
+MATCH_TIERS = ["exact", "prefix", "pinyin", "contains", "fuzzy"]
+
+# 只有字母数字的输入才按拼音匹配
+_PINYIN_INPUT = re.compile(r"^[a-z0-9\s'·\-_]+$")
+
+_ENTITY_TYPE = """CASE WHEN n.type IS NOT NULL THEN n.type ELSE (CASE
+           WHEN size([l IN labels(n) WHERE l <> 'Entity']) > 0
+           THEN [l IN labels(n) WHERE l <> 'Entity'][0]
+           ELSE 'Entity' END)
+       END"""
+
+
+class EntityNameIndex:
+    """实体名称检索（自动补全）
+
+    依赖写入实体时维护的 name_lower / name_pinyin / name_initials 属性及其索引：
+    完全匹配与前缀匹配走范围索引，子串匹配走文本索引，拼写容错走全文索引，
+    各路在一次查询中合并，按 完全 > 前缀 > 拼音 > 子串 > 模糊 分级排序，同级内名称越短越靠前。
+    前缀类匹配按索引属性本身排序后截取候选（由范围索引按序读取，不必取出全部匹配的实体），
+    完全匹配的名称在字典序中最靠前，因而总在候选之内。
+    """
+
+    def __init__(self, database: str = settings.NEO4J_DATABASE):
+        self.database = database
+
+    async def search(self, query: str, limit: int = 10, fuzzy: bool = True) -> List[Dict[str, Any]]:
+        """按名称检索实体，返回 id、name、type 及匹配方式"""
+        text = normalize_name(query)
+        if not text:
+            return []
+
+        params: Dict[str, Any] = {"text": text, "limit": limit}
+        branches = [
+            """
+            MATCH (n:Entity) WHERE n.name_lower STARTS WITH $text
+            WITH n ORDER BY n.name_lower LIMIT $limit
+            RETURN n, CASE WHEN n.name_lower = $text THEN 0 ELSE 1 END AS tier, 0.0 AS score
+            """,
+            """
+            MATCH (n:Entity) WHERE n.name_lower CONTAINS $text
+            WITH n LIMIT $limit
+            RETURN n, 3 AS tier, 0.0 AS score
+            """,
+        ]
+        if not has_cjk(text) and _PINYIN_INPUT.match(text):
+            params["pinyin"] = normalize_pinyin(text)
+            branches.extend([
+                """
+                MATCH (n:Entity) WHERE n.name_pinyin STARTS WITH $pinyin
+                WITH n ORDER BY n.name_pinyin LIMIT $limit
+                RETURN n, 2 AS tier, 0.0 AS score
+                """,
+                """
+                MATCH (n:Entity) WHERE n.name_initials STARTS WITH $pinyin
+                WITH n ORDER BY n.name_initials LIMIT $limit
+                RETURN n, 2 AS tier, 0.0 AS score
+                """,
+            ])
+
+        lucene = fulltext_query(text) if fuzzy else ""
+        if lucene:
+            params.update({"fulltext_index": ENTITY_NAME_FULLTEXT_INDEX, "lucene": lucene})
+            try:
+                return await self._run(branches + ["""
+                CALL db.index.fulltext.queryNodes($fulltext_index, $lucene) YIELD node, score
+                WITH node AS n, score LIMIT $limit
+                RETURN n, 4 AS tier, score
+                """], params)
+            except Exception as e:
+                # 全文索引尚未建立（或Neo4j版本不支持）时退回不含模糊匹配的查询
+                print(f"Warning: Fuzzy entity name search unavailable: {e}")
+        return await self._run(branches, params)
+
+    async def _run(self, branches: List[str], params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """合并各路匹配，同一实体取最优的匹配方式"""
+        cypher_query = f"""
+        CALL {{
+            {" UNION ALL ".join(branches)}
+        }}
+        WITH n, min(tier) AS tier, max(score) AS score
+        RETURN n.id AS id, n.name AS name, {_ENTITY_TYPE} AS type, tier, score
+        ORDER BY tier, score DESC, size(n.name)
+        LIMIT $limit
+        """
+        async with get_driver().session(database=self.database) as session:
+            result = await session.run(cypher_query, **params)
+            data = await result.data()
+
+        results = []
+        for item in data:
+            if item.get("id") is None:
+                continue
+            results.append({
+                "id": str(item["id"]),
+                "name": item["name"],
+                "type": item["type"],
+                "match": MATCH_TIERS[item["tier"]],
+                "score": item["score"],
+            })
+        return results
+
+    async def needs_backfill(self) -> bool:
+        """是否存在缺少名称检索属性的实体（如升级前写入或经CSV导入的实体）"""
+        cypher_query = """
+        MATCH (n:Entity) WHERE n.name IS NOT NULL AND n.name_lower IS NULL
+        RETURN n.id AS id LIMIT 1
+        """
+        async with get_driver().session(database=self.database) as session:
+            result = await session.run(cypher_query)
+            return await result.single() is not None
+
+    async def backfill(self, batch_size: Optional[int] = None) -> int:
+        """按id顺序分批重算全部实体的名称检索属性，只写回有变化的实体，返回更新数"""
+        batch_size = batch_size or settings.NEO4J_WRITE_BATCH_SIZE
+        read_query = """
+        MATCH (n:Entity) WHERE n.id > $after
+        RETURN n.id AS id, n.name AS name, n.name_lower AS name_lower,
+               n.name_pinyin AS name_pinyin, n.name_initials AS name_initials
+        ORDER BY n.id
+        LIMIT $limit
+        """
+        write_query = """
+        UNWIND $rows AS row
+        MATCH (n:Entity {id: row.id})
+        SET n.name_lower = row.name_lower,
+            n.name_pinyin = row.name_pinyin,
+            n.name_initials = row.name_initials
+        RETURN count(n) AS updated
+        """
+
+        updated = 0
+        last_id = ""
+        async with get_driver().session(database=self.database) as session:
+            while True:
+                result = await session.run(read_query, after=last_id, limit=batch_size)
+                batch = await result.data()
+                if not batch:
+                    break
+                last_id = batch[-1]["id"]
+
+                rows = []
+                for item in batch:
+                    keys = name_keys(item["name"])
+                    if any(item.get(key) != value for key, value in keys.items()):
+                        rows.append({"id": item["id"], **keys})
+                if rows:
+                    updated += await session.execute_write(self._write_rows, write_query, rows)
+
+        print(f"Entity name keys backfilled for {updated} entities")
+        return updated
+
+    @staticmethod
+    async def _write_rows(tx, query: str, rows: List[Dict[str, Any]]) -> int:
+        result = await tx.run(query, rows=rows)
+        record = await result.single()
+        return record["updated"] if record else 0
+
+
+# 进程内共享的实体名称检索
+entity_name_index = EntityNameIndex()
@@ -0,0 +1,368 @@
+# app/services/extraction_jobs.py
+
+from typing import Dict, Any, List, Optional
+from uuid import UUID, uuid4
+from datetime import datetime, timedelta
+import asyncio
+import json
+
+from app.db.sqlite_db import SessionLocal
+from app.db.models import Document, ExtractionJob
+from app.db.neo4j_db import Neo4jDatabase
+from app.db.neo4j_driver import get_driver
+from app.models.documents.source_document import SourceDocument
+from app.services.document_processor import load_document_text
+from app.core.executors import run_io
+from app.core.config import settings
+from app.core.logger import logger
+
+# 任务状态
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+# 视为"已有结果或正在处理"的状态，用于按content_hash去重
+ACTIVE_STATUSES = (QUEUED, RUNNING, SUCCEEDED)
+
+
+class JobCancelled(Exception):
+    """任务在执行过程中被取消"""
+    pass
+
+
+class ExtractionJobQueue:
+    """基于SQLite的知识抽取任务队列
+
+    任务持久化在 extraction_jobs 表中，进程重启后未完成的任务会重新入队；
+    由固定数量的工作协程领取执行，失败按指数退避重试，同一content_hash只抽取一次。
+    """
+
+    def __init__(self, workers: int = settings.EXTRACTION_WORKERS):
+        self.workers = workers
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+
+    # ---- 队列操作 ----
+
+    async def enqueue(self, document_id: str, force: bool = False) -> Dict[str, Any]:
+        """为文档创建抽取任务
+
+        相同content_hash已有排队、运行中或成功的任务时直接返回该任务，
+        force=True 时总是新建任务。
+        """
+        job = await run_io(self._enqueue_sync, document_id, force)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    def _enqueue_sync(self, document_id: str, force: bool) -> Dict[str, Any]:
+        db = SessionLocal()
+        try:
+            document = db.query(Document).filter(Document.id == document_id).first()
+            if document is None:
+                raise LookupError(f"Document not found: {document_id}")
+
+            if not force and document.content_hash:
+                existing = db.query(ExtractionJob).filter(
+                    ExtractionJob.content_hash == document.content_hash,
+                    ExtractionJob.status.in_(ACTIVE_STATUSES)
+                ).order_by(ExtractionJob.created_at.desc()).first()
+                if existing:
+                    return existing.to_dict()
+
+            job = ExtractionJob(
+                id=str(uuid4()),
+                document_id=document_id,
+                content_hash=document.content_hash,
+                status=QUEUED,
+                progress=0.0,
+                attempts=0,
+                max_attempts=settings.EXTRACTION_MAX_ATTEMPTS
+            )
+            db.add(job)
+            db.commit()
+            db.refresh(job)
+            return job.to_dict()
+        finally:
+            db.close()
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """获取任务状态"""
+        return await run_io(self._get_sync, job_id)
+
+    def _get_sync(self, job_id: str) -> Optional[Dict[str, Any]]:
+        db = SessionLocal()
+        try:
+            job = db.query(ExtractionJob).filter(ExtractionJob.id == job_id).first()
+            return job.to_dict() if job else None
+        finally:
+            db.close()
+
+    async def list_jobs(self, document_id: Optional[str] = None, status: Optional[str] = None,
+                        skip: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
+        """列出任务"""
+        return await run_io(self._list_sync, document_id, status, skip, limit)
+
+    def _list_sync(self, document_id: Optional[str], status: Optional[str],
+                   skip: int, limit: int) -> List[Dict[str, Any]]:
+        db = SessionLocal()
+        try:
+            query = db.query(ExtractionJob)
+            if document_id:
+                query = query.filter(ExtractionJob.document_id == document_id)
+            if status:
+                query = query.filter(ExtractionJob.status == status)
+            jobs = query.order_by(ExtractionJob.created_at.desc()).offset(skip).limit(limit).all()
+            return [job.to_dict() for job in jobs]
+        finally:
+            db.close()
+
+    async def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """取消排队中或运行中的任务；运行中的任务在下一个阶段边界停止"""
+        return await run_io(self._cancel_sync, job_id)
+
+    def _cancel_sync(self, job_id: str) -> Optional[Dict[str, Any]]:
+        db = SessionLocal()
+        try:
+            job = db.query(ExtractionJob).filter(ExtractionJob.id == job_id).first()
+            if job is None:
+                return None
+            if job.status in (QUEUED, RUNNING):
+                job.status = CANCELLED
+                job.finished_at = datetime.utcnow()
+                db.commit()
+                db.refresh(job)
+            return job.to_dict()
+        finally:
+            db.close()
+
+    # ---- 工作协程 ----
+
+    async def start(self) -> None:
+        """恢复中断的任务并启动工作协程"""
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        recovered = await run_io(self._recover_sync)
+        if recovered:
+            logger.info(f"Re-queued {recovered} interrupted extraction job(s)")
+
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(i)))
+        logger.info(f"Started {self.workers} extraction worker(s)")
+
+    async def stop(self) -> None:
+        """停止工作协程，运行中的任务会在下次启动时重新入队"""
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _recover_sync(self) -> int:
+        """将上次进程退出时仍在运行的任务重新置为排队"""
+        db = SessionLocal()
+        try:
+            count = db.query(ExtractionJob).filter(ExtractionJob.status == RUNNING).update(
+                {"status": QUEUED, "stage": None}, synchronize_session=False
+            )
+            db.commit()
+            return count
+        finally:
+            db.close()
+
+    async def _worker(self, index: int) -> None:
+        """工作协程：循环领取并执行任务"""
+        # 每个工作协程持有独立的抽取器，模型只加载一次
+        extractor = None
+        while not self._stopping:
+            try:
+                job = await run_io(self._claim_sync)
+                if job is None:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=settings.EXTRACTION_POLL_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                if extractor is None:
+                    from app.services.knowledge_extractor import SpacyNERExtractor
+                    db = Neo4jDatabase.from_driver(get_driver(), database=settings.NEO4J_DATABASE)
+                    extractor = await run_io(SpacyNERExtractor, db, settings.SPACY_MODEL)
+
+                await self._run_job(job, extractor)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Extraction worker {index} error: {e}")
+                await asyncio.sleep(settings.EXTRACTION_POLL_INTERVAL)
+
+    def _claim_sync(self) -> Optional[Dict[str, Any]]:
+        """领取一个可执行的排队任务（条件更新保证不会被重复领取）"""
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            candidate = db.query(ExtractionJob).filter(
+                ExtractionJob.status == QUEUED,
+                (ExtractionJob.run_after == None) | (ExtractionJob.run_after <= now)  # noqa: E711
+            ).order_by(ExtractionJob.created_at).first()
+            if candidate is None:
+                return None
+
+            claimed = db.query(ExtractionJob).filter(
+                ExtractionJob.id == candidate.id,
+                ExtractionJob.status == QUEUED
+            ).update({
+                "status": RUNNING,
+                "attempts": ExtractionJob.attempts + 1,
+                "started_at": now,
+                "stage": "reading",
+                "progress": 0.0,
+                "error": None
+            }, synchronize_session=False)
+            db.commit()
+            if not claimed:
+                return None
+
+            job = db.query(ExtractionJob).filter(ExtractionJob.id == candidate.id).first()
+            return job.to_dict()
+        finally:
+            db.close()
+
+    def _update_sync(self, job_id: str, **fields) -> Optional[str]:
+        """更新运行中的任务，返回更新前的状态（用于发现取消）"""
+        db = SessionLocal()
+        try:
+            job = db.query(ExtractionJob).filter(ExtractionJob.id == job_id).first()
+            if job is None:
+                return None
+            status = job.status
+            if status == RUNNING:
+                for key, value in fields.items():
+                    setattr(job, key, value)
+                db.commit()
+            return status
+        finally:
+            db.close()
+
+    async def _progress(self, job_id: str, stage: str, progress: float) -> None:
+        """记录阶段进度，任务已被取消时中止执行"""
+        status = await run_io(self._update_sync, job_id, stage=stage, progress=progress)
+        if status != RUNNING:
+            raise JobCancelled(job_id)
+
+    async def _clear_job_results(self, job_id: str, extractor, reason: str) -> None:
+        """删除本任务此前写入的实体（连同关系）及溯源记录，不影响该文档其他任务的结果"""
+        try:
+            entities = await extractor.db.delete_by_extraction_job(job_id)
+            traces = await extractor.provenance.delete_job_traces(job_id)
+        except Exception as e:
+            logger.error(f"Extraction job {job_id} {reason}: could not remove partial results: {e}")
+            raise
+        if entities or traces:
+            logger.info(f"Extraction job {job_id} {reason}: removed {entities} entities and {traces} traces")
+
+    async def _run_job(self, job: Dict[str, Any], extractor) -> None:
+        """执行一次抽取任务"""
+        job_id = job["id"]
+        try:
+            document = await run_io(self._load_document_sync, job["document_id"])
+            if document is None:
+                raise LookupError(f"Document not found: {job['document_id']}")
+            source_document, file_path = document
+
+            extracted = await load_document_text(file_path, source_document.type, source_document.content_hash)
+            content = extracted.content
+            # 分页/段落偏移用于长文档的分块抽取
+            structure = source_document.metadata.setdefault("structure", {})
+            if extracted.pages:
+                structure["pages"] = extracted.pages
+            elif extracted.paragraphs:
+                structure["paragraphs"] = extracted.paragraphs
+
+            if job.get("attempts", 1) > 1:
+                # 重试前清理本任务上次失败前已写入的实体、关系和溯源记录，避免重复
+                await self._progress(job_id, "cleanup", 0.1)
+                await self._clear_job_results(job_id, extractor, "retry")
+
+            # 写入的实体、关系和溯源记录都带有任务ID
+            await self._progress(job_id, "entities", 0.2)
+            entities = await extractor.extract_entities(source_document, content, job_id=job_id)
+
+            await self._progress(job_id, "relationships", 0.6)
+            relationships = []
+            if len(entities) >= 2:
+                relationships = await extractor.extract_relationships(source_document, entities, content,
+                                                                      job_id=job_id)
+
+            await self._progress(job_id, "traces", 0.9)
+            traces = []
+            if entities or relationships:
+                traces = await extractor.create_knowledge_traces(source_document, entities, relationships, content,
+                                                                 job_id=job_id)
+
+            result = {
+                "extracted_entities": len(entities),
+                "extracted_relationships": len(relationships),
+                "knowledge_traces": len(traces or []),
+            }
+            await run_io(self._update_sync, job_id, status=SUCCEEDED, stage="done", progress=1.0,
+                         result=json.dumps(result), finished_at=datetime.utcnow())
+            logger.info(f"Extraction job {job_id} succeeded: {result}")
+        except JobCancelled:
+            logger.info(f"Extraction job {job_id} cancelled")
+            # 取消的任务不会再执行，清理已写入的部分结果
+            await self._clear_job_results(job_id, extractor, "cancelled")
+        except Exception as e:
+            status = await run_io(self._fail_sync, job_id, str(e))
+            if status == FAILED:
+                await self._clear_job_results(job_id, extractor, "failed")
+
+    def _fail_sync(self, job_id: str, error: str) -> Optional[str]:
+        """记录失败；未达最大次数时按指数退避重新排队，返回任务的新状态"""
+        db = SessionLocal()
+        try:
+            job = db.query(ExtractionJob).filter(ExtractionJob.id == job_id).first()
+            if job is None or job.status != RUNNING:
+                return None
+            job.error = error
+            if job.attempts < job.max_attempts:
+                delay = settings.EXTRACTION_RETRY_BACKOFF * (2 ** (job.attempts - 1))
+                job.status = QUEUED
+                job.run_after = datetime.utcnow() + timedelta(seconds=delay)
+                logger.warning(f"Extraction job {job_id} failed (attempt {job.attempts}), retrying in {delay}s: {error}")
+            else:
+                job.status = FAILED
+                job.finished_at = datetime.utcnow()
+                logger.error(f"Extraction job {job_id} failed after {job.attempts} attempt(s): {error}")
+            db.commit()
+            return job.status
+        finally:
+            db.close()
+
+    def _load_document_sync(self, document_id: str):
+        db = SessionLocal()
+        try:
+            document = db.query(Document).filter(Document.id == document_id).first()
+            if document is None:
+                return None
+            source_document = SourceDocument(
+                id=UUID(document.id),
+                title=document.title,
+                type=document.type,
+                content_hash=document.content_hash,
+                file_path=document.file_path,
+                url=document.url,
+                archived_path=document.archived_path,
+                metadata=json.loads(document.doc_metadata) if document.doc_metadata else {}
+            )
+            return source_document, document.file_path
+        finally:
+            db.close()
+
+
+# 进程内共享的任务队列，由应用启动/关闭事件管理工作协程
+extraction_queue = ExtractionJobQueue()
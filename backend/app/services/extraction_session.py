@@ -0,0 +1,230 @@
+# app/services/extraction_session.py
+
+from typing import Dict, List, Optional
+from collections import OrderedDict
+import asyncio
+import threading
+
+import spacy
+from spacy.language import Language
+from spacy.tokens import Doc, DocBin, Span
+
+from app.models.documents.source_document import SourceDocument
+from app.services.text_chunker import chunk_text, page_boundaries
+from app.core.config import settings
+from app.core.executors import run_cpu, cpu_uses_processes
+
+
+def load_spacy_model(model_name: str) -> Language:
+    """加载spaCy模型，失败时依次回退到英文小模型和空白模型"""
+    try:
+        nlp = spacy.load(model_name)
+        print(f"Loaded NLP model: {model_name}")
+        return nlp
+    except Exception as e:
+        print(f"Error loading model {model_name}: {e}")
+    try:
+        # 尝试加载基础模型
+        nlp = spacy.load("en_core_web_sm")
+        print("Loaded fallback model: en_core_web_sm")
+        return nlp
+    except Exception:
+        # 如果仍然失败，使用空白模型
+        print("Using blank model as fallback")
+        return spacy.blank("en")
+
+
+# 工作进程内按模型名缓存已加载的模型
+_worker_models: Dict[str, Language] = {}
+
+
+def parse_texts_to_docbin(model_name: str, texts: List[str]) -> bytes:
+    """在CPU工作进程中解析一批文本，返回序列化的DocBin（需可被pickle，故为模块级函数）"""
+    nlp = _worker_models.get(model_name)
+    if nlp is None:
+        nlp = _worker_models[model_name] = load_spacy_model(model_name)
+
+    doc_bin = DocBin(store_user_data=True)
+    for doc in nlp.pipe(texts, batch_size=settings.NLP_PIPE_BATCH_SIZE):
+        doc_bin.add(doc)
+    return doc_bin.to_bytes()
+
+
+class DocCache:
+    """按文档content_hash缓存spaCy解析结果（序列化为DocBin字节，LRU淘汰）"""
+
+    def __init__(self, max_entries: int = 32):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, nlp: Language) -> Optional[Doc]:
+        """读取缓存的Doc，未命中返回None"""
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                return None
+            self._entries.move_to_end(key)
+
+        docs = list(DocBin().from_bytes(data).get_docs(nlp.vocab))
+        return docs[0] if docs else None
+
+    def put(self, key: str, doc: Doc) -> None:
+        """写入缓存"""
+        if self.max_entries <= 0:
+            return
+
+        doc_bin = DocBin(store_user_data=True)
+        doc_bin.add(doc)
+        data = doc_bin.to_bytes()
+
+        with self._lock:
+            self._entries[key] = data
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+# 进程内共享的解析缓存，抽取器按请求创建也能复用
+doc_cache = DocCache(max_entries=settings.NLP_DOC_CACHE_SIZE)
+
+
+class ExtractionSession:
+    """单个文档的抽取会话：文本只解析一次，实体、句子和溯源摘录共享同一个Doc
+
+    长文本按页/段落切块后批量解析：CPU执行器为进程池时，分块按批分派到各工作进程
+    并行解析；否则在线程中用 nlp.pipe 解析。最后用 Doc.from_docs 拼回一个Doc，
+    由于分块首尾相接，拼接后的字符偏移即为全文偏移。
+    """
+
+    def __init__(self, nlp: Language, document: SourceDocument, text_content: str,
+                 max_length: int = settings.NLP_MAX_TEXT_LENGTH, cache: Optional[DocCache] = doc_cache,
+                 model_name: Optional[str] = None):
+        """初始化抽取会话
+
+        Args:
+            nlp: spaCy语言模型
+            model_name: 模型名，提供时才能在工作进程中重新加载模型做并行解析
+            document: 源文档
+            text_content: 文档文本内容
+            max_length: 参与解析的最大字符数，超出部分截断
+            cache: 解析结果缓存，为None时不缓存
+        """
+        self.nlp = nlp
+        self.document = document
+        self.original_length = len(text_content)
+        self.text = text_content[:max_length]
+        self.cache = cache
+        self.model_name = model_name
+        self._doc: Optional[Doc] = None
+        self._sentences: Optional[List[Span]] = None
+
+    @property
+    def cache_key(self) -> Optional[str]:
+        """缓存键：模型名 + 文档内容哈希 + 截断长度"""
+        content_hash = getattr(self.document, "content_hash", None)
+        if not content_hash:
+            return None
+        model_name = f"{self.nlp.meta.get('lang', '')}_{self.nlp.meta.get('name', '')}"
+        return f"{model_name}:{content_hash}:{len(self.text)}"
+
+    @property
+    def truncated(self) -> bool:
+        """文本是否被截断"""
+        return self.original_length > len(self.text)
+
+    @property
+    def doc(self) -> Doc:
+        """解析后的Doc（首次访问时解析或从缓存恢复）"""
+        if self._doc is None:
+            self._doc = self._load_or_parse()
+        return self._doc
+
+    async def parse(self) -> Doc:
+        """通过CPU执行器完成解析，避免阻塞事件循环"""
+        if self._doc is not None:
+            return self._doc
+
+        doc = self._load_cached()
+        if doc is None:
+            if cpu_uses_processes() and self.model_name:
+                doc = await self._parse_in_workers()
+            else:
+                doc = await run_cpu(self._parse_chunks)
+            self._store_cached(doc)
+
+        self._doc = doc
+        return doc
+
+    def _load_or_parse(self) -> Doc:
+        """优先读取缓存，未命中时在当前线程解析并写入缓存"""
+        doc = self._load_cached()
+        if doc is None:
+            doc = self._parse_chunks()
+            self._store_cached(doc)
+        return doc
+
+    def _load_cached(self) -> Optional[Doc]:
+        key = self.cache_key
+        if self.cache is None or not key:
+            return None
+        doc = self.cache.get(key, self.nlp)
+        return doc if doc is not None and doc.text == self.text else None
+
+    def _store_cached(self, doc: Doc) -> None:
+        key = self.cache_key
+        if self.cache is not None and key:
+            self.cache.put(key, doc)
+
+    def _chunks(self):
+        return chunk_text(
+            self.text,
+            settings.NLP_CHUNK_SIZE,
+            page_boundaries(getattr(self.document, "metadata", None))
+        )
+
+    async def _parse_in_workers(self) -> Doc:
+        """将分块按批分派到CPU工作进程并行解析，再按原顺序合并"""
+        texts = [chunk.text for chunk in self._chunks()]
+        batch = max(1, settings.NLP_PIPE_BATCH_SIZE)
+        payloads = await asyncio.gather(*(
+            run_cpu(parse_texts_to_docbin, self.model_name, texts[i:i + batch])
+            for i in range(0, len(texts), batch)
+        ))
+        docs = [doc for data in payloads for doc in DocBin().from_bytes(data).get_docs(self.nlp.vocab)]
+        if len(docs) == 1:
+            return docs[0]
+        # 分块首尾相接，不额外插入空白即可保持全文字符偏移
+        return Doc.from_docs(docs, ensure_whitespace=False)
+
+    def _parse_chunks(self) -> Doc:
+        """分块批量解析并合并为覆盖全文的单个Doc"""
+        chunks = self._chunks()
+        if len(chunks) == 1:
+            return self.nlp(self.text)
+
+        print(f"Parsing {len(chunks)} chunks with nlp.pipe "
+              f"(n_process={settings.NLP_PIPE_PROCESSES}, batch_size={settings.NLP_PIPE_BATCH_SIZE})")
+        docs = list(self.nlp.pipe(
+            (chunk.text for chunk in chunks),
+            batch_size=settings.NLP_PIPE_BATCH_SIZE,
+            n_process=settings.NLP_PIPE_PROCESSES,
+        ))
+        # 分块首尾相接，不额外插入空白即可保持全文字符偏移
+        return Doc.from_docs(docs, ensure_whitespace=False)
+
+    @property
+    def entities(self) -> List[Span]:
+        """识别出的实体片段"""
+        return list(self.doc.ents)
+
+    @property
+    def sentences(self) -> List[Span]:
+        """句子切分结果"""
+        if self._sentences is None:
+            self._sentences = list(self.doc.sents)
+        return self._sentences
+
+    def excerpt(self, start: int, end: int) -> str:
+        """按字符偏移截取原文摘录"""
+        return self.text[start:end]
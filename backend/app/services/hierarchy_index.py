@@ -0,0 +1,438 @@
+# app/services/hierarchy_index.py
+
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from bisect import bisect_right
+import asyncio
+import time
+
+from app.core.config import settings
+from app.core.logger import logger
+from app.core.executors import run_io
+from app.db.neo4j_driver import get_driver
+from app.db.graph_events import (
+    RelationshipChange, add_relationship_listener, remove_relationship_listener, RELATIONSHIP_DELETED
+)
+
+Interval = Tuple[int, int]
+
+
+def _merge_intervals(spans: List[Interval]) -> List[Interval]:
+    """合并重叠或相邻的闭区间"""
+    spans.sort()
+    merged: List[Interval] = []
+    for low, high in spans:
+        if merged and low <= merged[-1][1] + 1:
+            if high > merged[-1][1]:
+                merged[-1] = (merged[-1][0], high)
+        else:
+            merged.append((low, high))
+    return merged
+
+
+def strongly_connected_components(adjacency: List[List[int]]) -> Tuple[List[int], List[List[int]]]:
+    """迭代版Tarjan算法，返回每个节点的分量号及各分量成员
+
+    分量按"可达者先输出"的顺序编号：沿 adjacency 可达的分量编号更小。
+    """
+    n = len(adjacency)
+    index = [-1] * n
+    low = [0] * n
+    on_stack = [False] * n
+    stack: List[int] = []
+    component = [-1] * n
+    components: List[List[int]] = []
+    counter = 0
+
+    for root in range(n):
+        if index[root] != -1:
+            continue
+        work = [(root, 0)]
+        while work:
+            node, i = work[-1]
+            if i == 0:
+                index[node] = low[node] = counter
+                counter += 1
+                stack.append(node)
+                on_stack[node] = True
+            neighbours = adjacency[node]
+            descended = False
+            while i < len(neighbours):
+                nxt = neighbours[i]
+                i += 1
+                if index[nxt] == -1:
+                    work[-1] = (node, i)
+                    work.append((nxt, 0))
+                    descended = True
+                    break
+                if on_stack[nxt]:
+                    low[node] = min(low[node], index[nxt])
+            if descended:
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+            if low[node] == index[node]:
+                members = []
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = False
+                    component[member] = len(components)
+                    members.append(member)
+                    if member == node:
+                        break
+                components.append(members)
+    return component, components
+
+
+def _interval_labels(adjacency: List[Set[int]]) -> Tuple[List[int], List[int], List[List[Interval]]]:
+    """DAG的区间标号：按生成森林的后序编号，每个节点的区间集合覆盖其全部可达节点（含自身）
+
+    返回 (后序号, 后序号->节点, 区间集合)。树边子树的后序号连续，非树边并入后继的区间。
+    """
+    m = len(adjacency)
+    post = [-1] * m
+    order: List[int] = []
+    intervals: List[List[Interval]] = [[] for _ in range(m)]
+    started = [False] * m
+
+    for root in range(m):
+        if started[root]:
+            continue
+        started[root] = True
+        stack = [(root, iter(adjacency[root]), len(order))]
+        while stack:
+            node, successors, start = stack[-1]
+            descended = False
+            for nxt in successors:
+                if not started[nxt]:
+                    started[nxt] = True
+                    stack.append((nxt, iter(adjacency[nxt]), len(order)))
+                    descended = True
+                    break
+            if descended:
+                continue
+            stack.pop()
+            post[node] = len(order)
+            order.append(node)
+            spans = [(start, post[node])]
+            for nxt in adjacency[node]:
+                spans.extend(intervals[nxt])
+            intervals[node] = _merge_intervals(spans)
+    return post, order, intervals
+
+
+class HierarchyClosure:
+    """单一关系类型层次结构的传递闭包
+
+    边为 (子, 父)。先把环收缩为强连通分量，再分别在向上（祖先）和向下（后代）两个方向上
+    做区间标号：可达判断是一次二分查找，列举祖先/后代是按区间切片，不需要物化闭包边。
+    """
+
+    def __init__(self, edges: Iterable[Tuple[str, str]], version: int = 0):
+        self.version = version
+        self._ids: Dict[str, int] = {}
+        self._names: List[str] = []
+        pairs = [(self._intern(child), self._intern(parent)) for child, parent in edges]
+
+        up: List[List[int]] = [[] for _ in self._names]
+        for child, parent in pairs:
+            up[child].append(parent)
+        self._component, self._members = strongly_connected_components(up)
+
+        m = len(self._members)
+        component_up: List[Set[int]] = [set() for _ in range(m)]
+        component_down: List[Set[int]] = [set() for _ in range(m)]
+        for child, parent in pairs:
+            c, p = self._component[child], self._component[parent]
+            if c != p:
+                component_up[c].add(p)
+                component_down[p].add(c)
+        self._up = _interval_labels(component_up)
+        self._down = _interval_labels(component_down)
+
+    def _intern(self, name: str) -> int:
+        node = self._ids.get(name)
+        if node is None:
+            node = self._ids[name] = len(self._names)
+            self._names.append(name)
+        return node
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def _reachable(self, name: str, labels) -> List[str]:
+        node = self._ids.get(name)
+        if node is None:
+            return []
+        _, order, intervals = labels
+        result = []
+        for low, high in intervals[self._component[node]]:
+            for component in order[low:high + 1]:
+                result.extend(self._names[member] for member in self._members[component] if member != node)
+        return result
+
+    def ancestors(self, name: str) -> List[str]:
+        """沿 子->父 方向可达的全部节点（不含自身；环中的其他节点视为祖先）"""
+        return self._reachable(name, self._up)
+
+    def descendants(self, name: str) -> List[str]:
+        """沿 父->子 方向可达的全部节点（不含自身）"""
+        return self._reachable(name, self._down)
+
+    def is_ancestor(self, name: str, ancestor: str) -> bool:
+        """ancestor 是否为 name 的（传递）祖先"""
+        node, target = self._ids.get(name), self._ids.get(ancestor)
+        if node is None or target is None or node == target:
+            return False
+        post, _, intervals = self._up
+        spans = intervals[self._component[node]]
+        position = post[self._component[target]]
+        i = bisect_right(spans, (position, float("inf"))) - 1
+        return i >= 0 and spans[i][0] <= position <= spans[i][1]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "nodes": len(self._names),
+            "components": len(self._members),
+            "ancestor_intervals": sum(len(spans) for spans in self._up[2]),
+            "descendant_intervals": sum(len(spans) for spans in self._down[2]),
+        }
+
+
+class HierarchyIndexNotReady(RuntimeError):
+    """层次索引尚未完成加载"""
+    pass
+
+
+class HierarchyIndex:
+    """进程内的层次关系闭包索引
+
+    从Neo4j加载 IS_A / PART_OF 等层次关系及 HAS_PROPERTY 属性边（不含推理物化的边），
+    通过关系变更事件同步更新边集合与邻接表。闭包标号在后台重建，两次重建至少间隔
+    HIERARCHY_REBUILD_INTERVAL 秒；标号与当前边集合一致时祖先、后代查询直接查标号，
+    有尚未反映到标号中的变更时改为在内存邻接表上遍历，结果始终与最新的边一致。
+    """
+
+    def __init__(self, rel_types: Optional[List[str]] = None,
+                 property_type: str = settings.HIERARCHY_PROPERTY_TYPE,
+                 database: str = settings.NEO4J_DATABASE):
+        self.rel_types = rel_types or settings.HIERARCHY_RELATIONSHIP_TYPES.split(",")
+        self.property_type = property_type
+        self.database = database
+        # 关系类型 -> {关系id: (起点, 终点)}，以及 (起点, 终点) -> 关系id集合
+        self._edges: Dict[str, Dict[str, Tuple[str, str]]] = {t: {} for t in self.rel_types + [property_type]}
+        self._pairs: Dict[str, Dict[Tuple[str, str], Set[str]]] = {t: {} for t in self._edges}
+        # 关系类型 -> 起点 -> 终点集合（向上）及 终点 -> 起点集合（向下）
+        self._up: Dict[str, Dict[str, Set[str]]] = {t: {} for t in self._edges}
+        self._down: Dict[str, Dict[str, Set[str]]] = {t: {} for t in self._edges}
+        self._versions: Dict[str, int] = {t: 0 for t in self._edges}
+        self._closures: Dict[str, HierarchyClosure] = {}
+        self._rebuilds: Dict[str, asyncio.Task] = {}
+        self._built_at: Dict[str, float] = {}
+        self.rebuild_interval = settings.HIERARCHY_REBUILD_INTERVAL
+        self.loaded = False
+
+    # ---- 加载与同步 ----
+
+    async def start(self) -> None:
+        """订阅关系变更并从Neo4j加载全部层次关系"""
+        add_relationship_listener(self._apply_changes)
+        await self.load()
+
+    async def stop(self) -> None:
+        remove_relationship_listener(self._apply_changes)
+        for task in self._rebuilds.values():
+            task.cancel()
+        self._rebuilds = {}
+
+    async def load(self) -> None:
+        """重新加载全部层次关系与属性边"""
+        async with get_driver().session(database=self.database) as session:
+            for rel_type in self._edges:
+                result = await session.run(f"""
+                MATCH (a:Entity)-[r:`{rel_type}`]->(b:Entity)
+                WHERE coalesce(r.inferred, false) = false
+                RETURN coalesce(r.id, elementId(r)) AS id, a.id AS source_id, b.id AS target_id
+                """)
+                self._edges[rel_type] = {}
+                self._pairs[rel_type] = {}
+                self._up[rel_type] = {}
+                self._down[rel_type] = {}
+                async for record in result:
+                    self._add_edge(rel_type, record["id"], (record["source_id"], record["target_id"]))
+                self._versions[rel_type] += 1
+        self.loaded = True
+        logger.info(
+            "Hierarchy index loaded: " +
+            ", ".join(f"{rel_type}={len(edges)}" for rel_type, edges in self._edges.items())
+        )
+        for rel_type in self.rel_types:
+            self._schedule_rebuild(rel_type)
+
+    def _add_edge(self, rel_type: str, key: str, pair: Tuple[str, str]) -> None:
+        edges = self._edges[rel_type]
+        if key in edges:
+            if edges[key] == pair:
+                return
+            self._remove_edge(rel_type, key)
+        edges[key] = pair
+        keys = self._pairs[rel_type].setdefault(pair, set())
+        keys.add(key)
+        if len(keys) == 1:
+            self._up[rel_type].setdefault(pair[0], set()).add(pair[1])
+            self._down[rel_type].setdefault(pair[1], set()).add(pair[0])
+
+    def _remove_edge(self, rel_type: str, key: str) -> None:
+        pair = self._edges[rel_type].pop(key)
+        keys = self._pairs[rel_type][pair]
+        keys.discard(key)
+        if keys:
+            return
+        del self._pairs[rel_type][pair]
+        for adjacency, node, other in ((self._up[rel_type], pair[0], pair[1]),
+                                       (self._down[rel_type], pair[1], pair[0])):
+            neighbours = adjacency[node]
+            neighbours.discard(other)
+            if not neighbours:
+                del adjacency[node]
+
+    async def _apply_changes(self, changes: List[RelationshipChange]) -> None:
+        """关系变更监听器：同步更新边集合与邻接表，标号在后台重建"""
+        changed = set()
+        for change in changes:
+            edges = self._edges.get(change.rel_type)
+            if edges is None:
+                continue
+            if change.kind == RELATIONSHIP_DELETED:
+                key = change.rel_id if change.rel_id in edges else None
+                if key is None:
+                    keys = self._pairs[change.rel_type].get((change.source_id, change.target_id))
+                    if not keys:
+                        continue
+                    key = next(iter(keys))
+                self._remove_edge(change.rel_type, key)
+            elif change.source_id and change.target_id:
+                self._add_edge(change.rel_type, change.rel_id or f"{change.source_id}->{change.target_id}",
+                               (change.source_id, change.target_id))
+            else:
+                continue
+            self._versions[change.rel_type] += 1
+            changed.add(change.rel_type)
+        for rel_type in changed:
+            if rel_type in self.rel_types:
+                self._schedule_rebuild(rel_type)
+
+    def _schedule_rebuild(self, rel_type: str) -> None:
+        """安排后台重建标号；已有重建任务时由其在完成后检查是否需要再次重建"""
+        task = self._rebuilds.get(rel_type)
+        if task is None or task.done():
+            self._rebuilds[rel_type] = asyncio.create_task(self._rebuild(rel_type))
+
+    async def _rebuild(self, rel_type: str) -> None:
+        """按最小间隔重建标号，直到标号与当前边集合一致"""
+        try:
+            while self._closure_version(rel_type) != self._versions[rel_type]:
+                wait = self._built_at.get(rel_type, 0.0) + self.rebuild_interval - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                version = self._versions[rel_type]
+                # 在事件循环中取快照，构建过程不受之后的变更影响
+                pairs = list(self._pairs[rel_type])
+                self._closures[rel_type] = await run_io(HierarchyClosure, pairs, version)
+                self._built_at[rel_type] = time.monotonic()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Hierarchy index rebuild for {rel_type} failed: {e}")
+
+    def _closure_version(self, rel_type: str) -> int:
+        closure = self._closures.get(rel_type)
+        return closure.version if closure is not None else -1
+
+    def _fresh_closure(self, rel_type: str) -> Optional[HierarchyClosure]:
+        """与当前边集合一致的标号，尚未重建完成时返回 None"""
+        if not self.loaded:
+            raise HierarchyIndexNotReady("Hierarchy index is still loading")
+        if rel_type not in self.rel_types:
+            raise ValueError(f"Relationship type {rel_type} is not indexed as a hierarchy")
+        closure = self._closures.get(rel_type)
+        if closure is not None and closure.version == self._versions[rel_type]:
+            return closure
+        return None
+
+    @staticmethod
+    def _traverse(adjacency: Dict[str, Set[str]], start: str, target: Optional[str] = None) -> List[str]:
+        """在邻接表上遍历可达节点（不含起点）；给定 target 时找到即停止"""
+        seen = {start}
+        result = []
+        stack = [start]
+        while stack:
+            for nxt in adjacency.get(stack.pop(), ()):
+                if nxt not in seen:
+                    seen.add(nxt)
+                    result.append(nxt)
+                    if nxt == target:
+                        return result
+                    stack.append(nxt)
+        return result
+
+    # ---- 查询 ----
+
+    async def ancestors(self, entity_id: str, rel_type: str = "IS_A") -> List[str]:
+        """实体的全部（传递）上位实体id"""
+        return self._ancestors(str(entity_id), rel_type)
+
+    def _ancestors(self, entity_id: str, rel_type: str) -> List[str]:
+        closure = self._fresh_closure(rel_type)
+        if closure is not None:
+            return closure.ancestors(entity_id)
+        return self._traverse(self._up[rel_type], entity_id)
+
+    async def descendants(self, entity_id: str, rel_type: str = "IS_A") -> List[str]:
+        """实体的全部（传递）下位实体id"""
+        entity_id = str(entity_id)
+        closure = self._fresh_closure(rel_type)
+        if closure is not None:
+            return closure.descendants(entity_id)
+        return self._traverse(self._down[rel_type], entity_id)
+
+    async def is_ancestor(self, entity_id: str, ancestor_id: str, rel_type: str = "IS_A") -> bool:
+        """ancestor_id 是否为 entity_id 的（传递）上位实体"""
+        entity_id, ancestor_id = str(entity_id), str(ancestor_id)
+        closure = self._fresh_closure(rel_type)
+        if closure is not None:
+            return closure.is_ancestor(entity_id, ancestor_id)
+        if entity_id == ancestor_id:
+            return False
+        return ancestor_id in self._traverse(self._up[rel_type], entity_id, ancestor_id)
+
+    async def inherited_properties(self, entity_id: str, rel_type: str = "IS_A") -> List[Dict[str, str]]:
+        """实体自身及经 rel_type 继承的属性，每个属性只取最先出现的来源（自身优先）"""
+        entity_id = str(entity_id)
+        properties = self._up[self.property_type]
+
+        result = []
+        seen = set()
+        for source in [entity_id] + self._ancestors(entity_id, rel_type):
+            for property_id in properties.get(source, ()):
+                if property_id not in seen:
+                    seen.add(property_id)
+                    result.append({"property_id": property_id, "inherited_from": source})
+        return result
+
+    async def stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {"loaded": self.loaded}
+        for rel_type in self.rel_types:
+            closure = self._closures.get(rel_type)
+            stats[rel_type] = {
+                "edges": len(self._edges[rel_type]),
+                "stale": closure is None or closure.version != self._versions[rel_type],
+                **(closure.stats() if closure is not None else {}),
+            }
+        stats[self.property_type] = {"edges": len(self._edges[self.property_type])}
+        return stats
+
+
+# 进程内共享的层次关系闭包索引
+hierarchy_index = HierarchyIndex()
@@ -0,0 +1,297 @@
+# app/services/hybrid_search.py
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import asyncio
+import hashlib
+import threading
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.executors import run_io
+from app.db.neo4j_driver import get_driver
+from app.services.document_index import (
+    DocumentIndex, document_index, load_document_batch, load_document_content
+)
+from app.services.entity_name_index import entity_name_index
+from app.services.text_chunker import chunk_text, page_boundaries
+from app.services.vector_index import VectorIndex, vector_index, KIND_DOCUMENT, KIND_ENTITY
+
+SEARCH_KINDS = (KIND_DOCUMENT, KIND_ENTITY)
+
+# 向量检索结果中只保留的分块文本长度
+SNIPPET_CHARS = 200
+
+# 嵌入模型在进程内只加载一次
+_embedder = None
+_embedder_lock = threading.Lock()
+
+
+def embed_texts(texts: Sequence[str]) -> np.ndarray:
+    """用实体链接组件的roberta模型批量计算文本嵌入（阻塞调用，首次调用时加载模型）
+
+    推理期间torch会释放GIL，因此经 run_io 在线程池中执行，
+    而不是放进进程池让每个工作进程各加载一份模型。
+    """
+    global _embedder
+    with _embedder_lock:
+        if _embedder is None:
+            from app.services.nlp_pipeline import EntityLinkerComponent
+            _embedder = EntityLinkerComponent(None, "custom_entity_linker")
+    if not texts:
+        return np.zeros((0, settings.EMBEDDING_DIM), dtype=np.float32)
+    batch_size = max(1, settings.EMBEDDING_BATCH_SIZE)
+    return np.vstack([
+        _embedder.get_embeddings(list(texts[start:start + batch_size]))
+        for start in range(0, len(texts), batch_size)
+    ])
+
+
+def _entity_text(entity: Dict[str, Any]) -> str:
+    """实体参与嵌入的文本：名称、类型与描述"""
+    text = f"{entity.get('name') or ''}（{entity.get('type') or 'Entity'}）"
+    if entity.get("description"):
+        text += f"：{entity['description']}"
+    return text
+
+
+def _normalize_scores(scores: Dict[Tuple[str, str], float], higher_is_better: bool = True) -> Dict[Tuple[str, str], float]:
+    """按最小-最大值把一路召回的得分缩放到[0, 1]"""
+    if not scores:
+        return {}
+    low, high = min(scores.values()), max(scores.values())
+    if high == low:
+        return {key: 1.0 for key in scores}
+    if higher_is_better:
+        return {key: (value - low) / (high - low) for key, value in scores.items()}
+    return {key: (high - value) / (high - low) for key, value in scores.items()}
+
+
+def _rank_scores(keys: List[Tuple[str, str]]) -> Dict[Tuple[str, str], float]:
+    """没有数值得分的结果按排名给分"""
+    return {key: 1.0 - rank / len(keys) for rank, key in enumerate(keys)}
+
+
+async def _no_results():
+    """权重为0的一路不召回"""
+    return {}, {}
+
+
+class HybridSearchEngine:
+    """混合检索：融合全文索引的BM25得分与向量索引的语义相似度
+
+    文档按页/段落切块后计算嵌入，实体以名称、类型和描述计算嵌入；
+    查询时两路各召回若干候选，各自归一化后按 alpha 加权求和。
+    """
+
+    def __init__(self, index: DocumentIndex = document_index, vectors: VectorIndex = vector_index):
+        self.index = index
+        self.vectors = vectors
+
+    async def search(self, query: str, limit: int = 10, kinds: Optional[Sequence[str]] = None,
+                     alpha: Optional[float] = None) -> List[Dict[str, Any]]:
+        """混合检索文档与实体
+
+        Args:
+            query: 查询文本
+            limit: 返回结果数
+            kinds: 检索的对象类型（document、entity），默认全部
+            alpha: 向量得分权重，0为纯全文检索，1为纯向量检索
+        """
+        alpha = settings.HYBRID_SEARCH_ALPHA if alpha is None else min(1.0, max(0.0, alpha))
+        kinds = [kind for kind in (kinds or SEARCH_KINDS) if kind in SEARCH_KINDS]
+        candidates = max(limit, settings.HYBRID_SEARCH_CANDIDATES)
+
+        # 两路召回并发执行，权重为0的一路跳过
+        (lexical_scores, lexical_items), (vector_scores, vector_items) = await asyncio.gather(
+            self._lexical_search(query, kinds, candidates) if alpha < 1 else _no_results(),
+            self._vector_search(query, kinds, candidates) if alpha > 0 else _no_results()
+        )
+        vector_norm = _normalize_scores(vector_scores)
+
+        results = []
+        for key in set(lexical_items) | set(vector_items):
+            item = dict(vector_items.get(key) or {})
+            # 全文检索的片段带有高亮，优先使用
+            item.update(lexical_items.get(key) or {})
+            item["lexical_score"] = lexical_scores.get(key, 0.0)
+            item["vector_score"] = vector_norm.get(key, 0.0)
+            item["similarity"] = vector_scores.get(key)
+            item["score"] = alpha * item["vector_score"] + (1 - alpha) * item["lexical_score"]
+            results.append(item)
+
+        results.sort(key=lambda item: item["score"], reverse=True)
+        return results[:limit]
+
+    async def _lexical_search(self, query: str, kinds: Sequence[str], candidates: int):
+        """全文召回：文档走FTS5（bm25），实体走名称匹配；返回已归一化的得分"""
+        scores: Dict[Tuple[str, str], float] = {}
+        items: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+        if KIND_DOCUMENT in kinds:
+            documents = await self.index.search(query, limit=candidates) or []
+            keys = [(KIND_DOCUMENT, doc["id"]) for doc in documents]
+            bm25 = {key: doc["score"] for key, doc in zip(keys, documents) if doc.get("score") is not None}
+            # bm25()越小越相关；没有MATCH的短词查询没有得分，按排名给分
+            scores.update(_normalize_scores(bm25, higher_is_better=False) if len(bm25) == len(keys)
+                          else _rank_scores(keys))
+            for key, doc in zip(keys, documents):
+                items[key] = {
+                    "kind": KIND_DOCUMENT,
+                    "id": doc["id"],
+                    "title": doc["title"],
+                    "type": doc["type"],
+                    "title_highlight": doc.get("title_highlight"),
+                    "snippet": doc.get("snippet"),
+                }
+
+        if KIND_ENTITY in kinds:
+            entities = await self._match_entities(query, candidates)
+            keys = [(KIND_ENTITY, entity["id"]) for entity in entities]
+            scores.update(_rank_scores(keys))
+            for key, entity in zip(keys, entities):
+                items[key] = {"kind": KIND_ENTITY, "id": entity["id"], "title": entity["name"], "type": entity["type"]}
+
+        return scores, items
+
+    async def _match_entities(self, query: str, limit: int) -> List[Dict[str, Any]]:
+        """按名称匹配实体（前缀、拼音、子串、模糊），结果已按匹配程度排序"""
+        try:
+            return await entity_name_index.search(query, limit=limit)
+        except Exception as e:
+            print(f"Error matching entities for hybrid search: {e}")
+            return []
+
+    async def _vector_search(self, query: str, kinds: Sequence[str], candidates: int):
+        """向量召回：同一对象的多个分块取最相似的一块"""
+        query_vector = await run_io(embed_texts, [query])
+        # 多取一些分块，聚合到对象后仍有足够的候选
+        hits = await run_io(self.vectors.search, query_vector[0], candidates * 3, kinds)
+
+        scores: Dict[Tuple[str, str], float] = {}
+        items: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for hit in hits:
+            key = (hit["kind"], hit["ref_id"])
+            if key in scores:
+                continue
+            scores[key] = hit["score"]
+            items[key] = {
+                "kind": hit["kind"],
+                "id": hit["ref_id"],
+                "title": hit["title"],
+                "type": hit["ref_type"],
+                "snippet": (hit["text"] or "")[:SNIPPET_CHARS],
+                "chunk_offset": hit["chunk_offset"],
+            }
+            if len(scores) >= candidates:
+                break
+        return scores, items
+
+    # ---- 向量索引维护 ----
+
+    async def reindex(self, batch_size: Optional[int] = None) -> Dict[str, Dict[str, int]]:
+        """增量更新文档和实体的向量"""
+        return {
+            KIND_DOCUMENT: await self.index_documents(batch_size),
+            KIND_ENTITY: await self.index_entities(batch_size),
+        }
+
+    async def index_documents(self, batch_size: Optional[int] = None) -> Dict[str, int]:
+        """按批遍历SQLite中的Document表，为新增或内容变化的文档切块并计算嵌入"""
+        batch_size = batch_size or settings.DOCUMENT_INDEX_REBUILD_BATCH_SIZE
+        stats = {"scanned": 0, "indexed": 0, "unchanged": 0, "removed": 0, "failed": 0, "chunks": 0}
+        seen = set()
+        last_id = ""
+
+        while True:
+            batch = await run_io(load_document_batch, last_id, batch_size)
+            if not batch:
+                break
+            last_id = batch[-1]["id"]
+            stats["scanned"] += len(batch)
+            seen.update(doc["id"] for doc in batch)
+            existing = await run_io(self.vectors.content_hashes, KIND_DOCUMENT, [doc["id"] for doc in batch])
+
+            for doc in batch:
+                if doc["content_hash"] and existing.get(doc["id"]) == doc["content_hash"]:
+                    stats["unchanged"] += 1
+                    continue
+                try:
+                    content = await load_document_content(doc)
+                    chunks = [
+                        (chunk.offset, chunk.text)
+                        for chunk in chunk_text(content, settings.EMBEDDING_CHUNK_CHARS, page_boundaries(doc["metadata"]))
+                        if chunk.text.strip()
+                    ] if content else []
+                    # 没有正文的文档（图片、网页链接等）只用标题
+                    chunks = chunks or [(0, doc["title"])]
+                    vectors = await run_io(embed_texts, [text for _, text in chunks])
+                    stats["chunks"] += await run_io(
+                        self.vectors.replace, KIND_DOCUMENT, doc["id"], doc["content_hash"],
+                        doc["title"], doc["type"], chunks, vectors
+                    )
+                    stats["indexed"] += 1
+                except Exception as e:
+                    stats["failed"] += 1
+                    print(f"Warning: Could not embed document {doc['id']}: {e}")
+
+        stats["removed"] = await run_io(self.vectors.retain, KIND_DOCUMENT, seen)
+        print(f"Document vector reindex finished: {stats}")
+        return stats
+
+    async def index_entities(self, batch_size: Optional[int] = None) -> Dict[str, int]:
+        """按id顺序分批读取Neo4j中的实体，为新增或名称/描述变化的实体计算嵌入"""
+        batch_size = batch_size or settings.DOCUMENT_INDEX_REBUILD_BATCH_SIZE
+        stats = {"scanned": 0, "indexed": 0, "unchanged": 0, "removed": 0, "failed": 0}
+        seen = set()
+        last_id = ""
+        cypher_query = """
+        MATCH (n:Entity)
+        WHERE n.id > $after
+        RETURN n.id AS id, n.name AS name, n.type AS type, n.description AS description
+        ORDER BY n.id
+        LIMIT $limit
+        """
+
+        while True:
+            async with get_driver().session(database=settings.NEO4J_DATABASE) as session:
+                result = await session.run(cypher_query, after=last_id, limit=batch_size)
+                batch = await result.data()
+            if not batch:
+                break
+            last_id = batch[-1]["id"]
+            stats["scanned"] += len(batch)
+
+            entities = []
+            for entity in batch:
+                entity["id"] = str(entity["id"])
+                entity["text"] = _entity_text(entity)
+                entity["content_hash"] = "sha256:" + hashlib.sha256(entity["text"].encode("utf-8")).hexdigest()
+                seen.add(entity["id"])
+                entities.append(entity)
+
+            existing = await run_io(self.vectors.content_hashes, KIND_ENTITY, [entity["id"] for entity in entities])
+            changed = [entity for entity in entities if existing.get(entity["id"]) != entity["content_hash"]]
+            stats["unchanged"] += len(entities) - len(changed)
+            if not changed:
+                continue
+
+            try:
+                vectors = await run_io(embed_texts, [entity["text"] for entity in changed])
+                for entity, vector in zip(changed, vectors):
+                    await run_io(
+                        self.vectors.replace, KIND_ENTITY, entity["id"], entity["content_hash"],
+                        entity["name"], entity["type"], [(0, entity["text"])], vector[None, :]
+                    )
+                stats["indexed"] += len(changed)
+            except Exception as e:
+                stats["failed"] += len(changed)
+                print(f"Warning: Could not embed entities: {e}")
+
+        stats["removed"] = await run_io(self.vectors.retain, KIND_ENTITY, seen)
+        print(f"Entity vector reindex finished: {stats}")
+        return stats
+
+
+# 进程内共享的混合检索引擎
+hybrid_search = HybridSearchEngine()
@@ -1,20 +1,104 @@
 # app/services/inference_engine.py
 
-from typing import Dict, Any, List, Optional, Union, Tuple
+from typing import Dict, Any, Awaitable, Callable, List, Optional, Set, Union, Tuple
+from uuid import uuid4
+import asyncio
 import json
-from fastapi import HTTPException
+import re
 
-from app.db.neo4j_enhanced import Neo4jEnhanced
+from app.core.config import settings
 from app.core.logger import logger
+from app.db.neo4j_driver import get_driver
+from app.services.hierarchy_index import strongly_connected_components
+from app.db.graph_events import (
+    RelationshipChange, add_relationship_listener, remove_relationship_listener,
+    RELATIONSHIP_CREATED, RELATIONSHIP_DELETED
+)
+
+# 关系类型名：普通标识符或反引号括起的任意名称（可含空格）
+_TYPE_NAME = r"`[^`]+`|\w+"
+# 推理结论中写入的关系类型，如 CREATE (a)-[:IS_A {...}]->(c) 或 MERGE (a)-[r:IS_A]->(c)
+_WRITTEN_TYPE = re.compile(
+    rf"(?:CREATE|MERGE)\s*\([^)]*\)\s*<?-\s*\[\s*\w*\s*:\s*({_TYPE_NAME})", re.IGNORECASE
+)
+# 模式中的关系：-[...]-、<-[...]-、-[...]-> 取方括号内容；--、-->、<-- 为未指定类型的关系
+_RELATIONSHIP = re.compile(r"-\s*\[((?:`[^`]*`|[^\]`])*)\]\s*-|\)\s*<?-->?\s*\(")
+# 方括号内的类型表达式，如 [:IS_A]、[r1:RELATED_TO]、[:A|B*1..]、[:`is a`]；其后只能是变长范围、属性或WHERE
+_RELATIONSHIP_TYPES = re.compile(
+    rf"\s*\w*\s*:\s*((?:{_TYPE_NAME})(?:\s*\|\s*:?\s*(?:{_TYPE_NAME}))*)\s*(?=\*|\{{|WHERE\b|$)",
+    re.IGNORECASE
+)
+
+
+def _type_names(expression: str) -> List[str]:
+    """拆分类型表达式中的各个类型名（去掉反引号）"""
+    return [name.strip("`") for name in re.findall(_TYPE_NAME, expression)]
+
+
+def relationship_types(pattern: str) -> List[Optional[List[str]]]:
+    """模式中每个关系引用的类型列表；未指定类型或无法解析的关系为 None"""
+    result = []
+    for match in _RELATIONSHIP.finditer(pattern):
+        body = match.group(1)
+        types = _RELATIONSHIP_TYPES.match(body) if body is not None else None
+        result.append(_type_names(types.group(1)) if types else None)
+    return result
+
+# 物化层次闭包的默认规则；可改由内存中的层次索引（hierarchy_index）回答
+HIERARCHY_RULES = {"transitive_is_a", "transitive_part_of", "property_inheritance"}
+
 
 class Rule:
-    """推理规则定义"""
+    """推理规则定义
+    
+    delta_patterns 为半朴素求值使用的增量模式：每个模式把规则体中的一条边限定为
+    上一轮新推出的边（r.inference_stamp = $delta_stamp），各模式合起来覆盖规则体的每条边。
+    推理结论通过 $stamp 参数给新边打上本轮的迭代标记，未提供增量模式的规则每轮完整求值，
+    也不参与按关系变更的增量推理（只在 run_to_fixpoint 中执行）。
+    
+    self_excluding 表示模式的否定条件会排除已推出的结论（写入后不再匹配），只有这样的规则
+    才能分批求值；未指定时提供了增量模式的规则视为满足，其他规则在单个事务中求值。
+    """
     
-    def __init__(self, name: str, pattern: str, inference: str, confidence: float = 1.0):
+    def __init__(self, name: str, pattern: str, inference: str, confidence: float = 1.0,
+                 delta_patterns: Optional[List[str]] = None, self_excluding: Optional[bool] = None):
         self.name = name
         self.pattern = pattern  # Cypher模式匹配
         self.inference = inference  # 推理结果
         self.confidence = confidence  # 规则置信度
+        self.delta_patterns = delta_patterns or []  # 半朴素求值的增量模式
+        self.self_excluding = bool(self.delta_patterns) if self_excluding is None else self_excluding
+    
+    @property
+    def stamps_inferences(self) -> bool:
+        """推理结论是否为新边写入迭代标记（只有这样下一轮才能按增量求值）"""
+        return "$stamp" in self.inference
+    
+    @property
+    def incremental(self) -> bool:
+        """能否以变更处为起点增量求值：需要增量模式，且结论带迭代标记"""
+        return bool(self.delta_patterns) and self.stamps_inferences
+    
+    @property
+    def read_types(self) -> List[str]:
+        """规则体（模式）中引用的关系类型"""
+        types = [t for rel in relationship_types(self.pattern) if rel for t in rel]
+        return list(dict.fromkeys(types))
+    
+    @property
+    def reads_all_types(self) -> bool:
+        """规则体中有未指定类型（或无法解析类型）的关系，视为读取全部关系类型"""
+        return any(rel is None for rel in relationship_types(self.pattern))
+    
+    def reads(self, rel_types) -> bool:
+        """规则是否读取给定关系类型中的任意一种"""
+        rel_types = set(rel_types)
+        return bool(rel_types) and (self.reads_all_types or bool(rel_types.intersection(self.read_types)))
+    
+    @property
+    def written_types(self) -> List[str]:
+        """推理结论写入的关系类型"""
+        return list(dict.fromkeys(name.strip("`") for name in _WRITTEN_TYPE.findall(self.inference)))
     
     def to_dict(self) -> Dict[str, Any]:
         """转换为字典表示"""
@@ -22,7 +106,9 @@ class Rule:
             "name": self.name,
             "pattern": self.pattern,
             "inference": self.inference,
-            "confidence": self.confidence
+            "confidence": self.confidence,
+            "delta_patterns": self.delta_patterns,
+            "self_excluding": self.self_excluding
         }
     
     @classmethod
@@ -32,16 +118,70 @@ class Rule:
             name=data.get("name", ""),
             pattern=data.get("pattern", ""),
             inference=data.get("inference", ""),
-            confidence=data.get("confidence", 1.0)
+            confidence=data.get("confidence", 1.0),
+            delta_patterns=data.get("delta_patterns"),
+            self_excluding=data.get("self_excluding")
         )
 
 
+def plan_rule_strata(rules: List[Rule]) -> List[List[List[Rule]]]:
+    """按读写的关系类型分析规则依赖，返回分层执行计划
+
+    规则B读取规则A写入的关系类型时B依赖A；B的模式中有未指定类型的关系时依赖所有写入关系的规则，
+    因而排在它们之后。相互依赖（递归）的规则收缩为一个分量，
+    分量按依赖深度分层：层与层之间顺序执行；同一层内的分量互不依赖，可以并发，
+    但写入相同关系类型的分量合并为一组顺序执行，避免并发MERGE产生重复边。
+    返回 [层][组][规则]，组内规则保持原有顺序。
+    """
+    n = len(rules)
+    reads = [set(rule.read_types) for rule in rules]
+    reads_all = [rule.reads_all_types for rule in rules]
+    writes = [set(rule.written_types) for rule in rules]
+    dependents = [[j for j in range(n) if writes[i] & reads[j] or (writes[i] and reads_all[j])] for i in range(n)]
+    component, members = strongly_connected_components(dependents)
+
+    # 可达（依赖方）的分量编号更小，按编号从大到小即先处理被依赖的分量
+    level = [0] * len(members)
+    for c in range(len(members) - 1, -1, -1):
+        for i in members[c]:
+            for j in dependents[i]:
+                if component[j] != c:
+                    level[component[j]] = max(level[component[j]], level[c] + 1)
+
+    strata: List[List[List[Rule]]] = []
+    for depth in range(max(level, default=-1) + 1):
+        groups: List[Tuple[Set[str], List[int]]] = []
+        for c in range(len(members)):
+            if level[c] != depth:
+                continue
+            written = set().union(*(writes[i] for i in members[c]))
+            indices = list(members[c])
+            # 与已有组写入相同类型时合并
+            for group in [g for g in groups if g[0] & written]:
+                groups.remove(group)
+                written |= group[0]
+                indices.extend(group[1])
+            groups.append((written, indices))
+        strata.append([[rules[i] for i in sorted(indices)] for _, indices in groups])
+    return strata
+
+
 class InferenceEngine:
-    """推理引擎，基于规则执行知识推理"""
+    """推理引擎，基于规则执行知识推理
     
-    def __init__(self, db: Neo4jEnhanced):
-        self.db = db
+    规则在共享驱动的会话上执行；能排除自身结论的规则每个写事务最多处理
+    INFERENCE_WRITE_BATCH_SIZE 个匹配行，同一模式分多个事务写完，避免大图上单个事务过大。
+    """
+    
+    def __init__(self, database: str = settings.NEO4J_DATABASE):
+        self.database = database
         self.rules = []  # 规则集
+        # 增量推理：待处理的关系变更及后台处理协程
+        self._pending: List[RelationshipChange] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._idle: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self.incremental_stats = {"batches": 0, "changes": 0, "inferences_created": 0, "inferences_retracted": 0}
     
     async def load_rules(self, rules_file: str = None) -> None:
         """从文件加载规则"""
@@ -49,7 +189,7 @@ class InferenceEngine:
             try:
                 with open(rules_file, 'r', encoding='utf-8') as f:
                     rules_data = json.load(f)
-                    
+                
                 self.rules = [Rule.from_dict(rule) for rule in rules_data]
                 logger.info(f"Loaded {len(self.rules)} rules from {rules_file}")
             except Exception as e:
@@ -67,14 +207,42 @@ class InferenceEngine:
             Rule(
                 name="transitive_is_a",
                 pattern="MATCH (a)-[:IS_A]->(b)-[:IS_A]->(c) WHERE NOT (a)-[:IS_A]->(c)",
-                inference="CREATE (a)-[:IS_A {inferred: true, rule: 'transitive_is_a'}]->(c)"
+                inference="""
+                MERGE (a)-[rel:IS_A]->(c)
+                ON CREATE SET rel.inferred = true, rel.rule = 'transitive_is_a',
+                              rel.inference_stamp = $stamp
+                """,
+                delta_patterns=[
+                    """
+                    MATCH (a)-[r1:IS_A]->(b) WHERE r1.inference_stamp = $delta_stamp
+                    MATCH (b)-[:IS_A]->(c) WHERE NOT (a)-[:IS_A]->(c)
+                    """,
+                    """
+                    MATCH (b)-[r2:IS_A]->(c) WHERE r2.inference_stamp = $delta_stamp
+                    MATCH (a)-[:IS_A]->(b) WHERE NOT (a)-[:IS_A]->(c)
+                    """
+                ]
             ),
             
             # 部分-整体规则：如果A是B的一部分，B是C的一部分，则A是C的一部分
             Rule(
                 name="transitive_part_of",
                 pattern="MATCH (a)-[:PART_OF]->(b)-[:PART_OF]->(c) WHERE NOT (a)-[:PART_OF]->(c)",
-                inference="CREATE (a)-[:PART_OF {inferred: true, rule: 'transitive_part_of'}]->(c)"
+                inference="""
+                MERGE (a)-[rel:PART_OF]->(c)
+                ON CREATE SET rel.inferred = true, rel.rule = 'transitive_part_of',
+                              rel.inference_stamp = $stamp
+                """,
+                delta_patterns=[
+                    """
+                    MATCH (a)-[r1:PART_OF]->(b) WHERE r1.inference_stamp = $delta_stamp
+                    MATCH (b)-[:PART_OF]->(c) WHERE NOT (a)-[:PART_OF]->(c)
+                    """,
+                    """
+                    MATCH (b)-[r2:PART_OF]->(c) WHERE r2.inference_stamp = $delta_stamp
+                    MATCH (a)-[:PART_OF]->(b) WHERE NOT (a)-[:PART_OF]->(c)
+                    """
+                ]
             ),
             
             # 属性继承规则：如果A是B的一种，B有属性P，则A有属性P
@@ -87,29 +255,70 @@ class InferenceEngine:
                     MATCH (a)-[:HAS_PROPERTY]->(p)
                 }
                 """,
-                inference="CREATE (a)-[:HAS_PROPERTY {inferred: true, rule: 'property_inheritance'}]->(p)"
+                inference="""
+                MERGE (a)-[rel:HAS_PROPERTY]->(p)
+                ON CREATE SET rel.inferred = true, rel.rule = 'property_inheritance',
+                              rel.inference_stamp = $stamp
+                """,
+                delta_patterns=[
+                    """
+                    MATCH (a)-[r1:IS_A]->(b) WHERE r1.inference_stamp = $delta_stamp
+                    MATCH (b)-[:HAS_PROPERTY]->(p)
+                    WHERE NOT EXISTS {
+                        MATCH (a)-[:HAS_PROPERTY]->(p)
+                    }
+                    """,
+                    """
+                    MATCH (b)-[r2:HAS_PROPERTY]->(p) WHERE r2.inference_stamp = $delta_stamp
+                    MATCH (a)-[:IS_A]->(b)
+                    WHERE NOT EXISTS {
+                        MATCH (a)-[:HAS_PROPERTY]->(p)
+                    }
+                    """
+                ]
             ),
             
             # 关系转移规则：如果A与B有关系R，B与C有关系R，且R是可传递的，则A与C有关系R
             Rule(
                 name="relationship_transfer",
                 pattern="""
-                MATCH (a)-[r1:RELATED_TO]->(b)-[r2:RELATED_TO]->(c) 
+                MATCH (a)-[r1:RELATED_TO]->(b)-[r2:RELATED_TO]->(c)
                 WHERE r1.type = r2.type AND r1.transitive = true
                 AND NOT EXISTS {
                     MATCH (a)-[r:RELATED_TO]->(c) WHERE r.type = r1.type
                 }
                 """,
+                # 推出的边同样可传递，才能在下一轮继续参与推理
                 inference="""
-                CREATE (a)-[:RELATED_TO {
-                    type: r1.type, 
-                    inferred: true, 
-                    rule: 'relationship_transfer'
-                }]->(c)
-                """
+                MERGE (a)-[rel:RELATED_TO {type: r1.type}]->(c)
+                ON CREATE SET rel.transitive = true, rel.inferred = true,
+                              rel.rule = 'relationship_transfer',
+                              rel.inference_stamp = $stamp
+                """,
+                delta_patterns=[
+                    """
+                    MATCH (a)-[r1:RELATED_TO]->(b) WHERE r1.inference_stamp = $delta_stamp
+                    MATCH (b)-[r2:RELATED_TO]->(c)
+                    WHERE r1.type = r2.type AND r1.transitive = true
+                    AND NOT EXISTS {
+                        MATCH (a)-[r:RELATED_TO]->(c) WHERE r.type = r1.type
+                    }
+                    """,
+                    """
+                    MATCH (b)-[r2:RELATED_TO]->(c) WHERE r2.inference_stamp = $delta_stamp
+                    MATCH (a)-[r1:RELATED_TO]->(b)
+                    WHERE r1.type = r2.type AND r1.transitive = true
+                    AND NOT EXISTS {
+                        MATCH (a)-[r:RELATED_TO]->(c) WHERE r.type = r1.type
+                    }
+                    """
+                ]
             )
         ]
         
+        if not settings.INFERENCE_MATERIALIZE_HIERARCHY:
+            self.rules = [rule for rule in self.rules if rule.name not in HIERARCHY_RULES]
+        
         logger.info(f"Loaded {len(self.rules)} default rules")
     
     async def add_rule(self, rule: Rule) -> None:
@@ -122,27 +331,75 @@ class InferenceEngine:
         self.rules = [r for r in self.rules if r.name != rule_name]
         return len(self.rules) < initial_count
     
-    async def apply_rule(self, rule: Rule) -> Dict[str, Any]:
-        """应用单个规则进行推理"""
+    async def ensure_indexes(self) -> None:
+        """为规则写入的关系类型建立 inference_stamp 索引，使增量模式能直接定位上一轮的新边"""
+        rel_types = list(dict.fromkeys(t for rule in self.rules for t in rule.written_types))
+        async with get_driver().session(database=self.database) as session:
+            for rel_type in rel_types:
+                # 反引号类型名可含空格等字符，索引名只保留单词字符
+                index_name = "inference_stamp_" + re.sub(r"\W", "_", rel_type.lower())
+                try:
+                    await session.run(
+                        f"CREATE INDEX {index_name} IF NOT EXISTS "
+                        f"FOR ()-[r:`{rel_type}`]-() ON (r.inference_stamp)"
+                    )
+                except Exception as e:
+                    logger.warning(f"Could not create inference stamp index for {rel_type}: {e}")
+    
+    async def _evaluate(self, rule: Rule, patterns: List[str], params: Dict[str, Any],
+                        batch_size: int) -> int:
+        """执行规则的若干模式，返回新建的关系数
+        
+        self_excluding 的规则分批执行：每批在独立事务中最多处理 batch_size 个匹配行，
+        否定条件会排除已推出的结论，因此重复执行同一查询即可推进，直到匹配行不足一批为止，
+        批数不超过 INFERENCE_MAX_BATCHES。其他规则重复执行会反复匹配相同的行，
+        每个模式在单个事务中完整求值一次。
+        """
+        created = 0
+        params = {**params, "batch_size": batch_size}
+        async with get_driver().session(database=self.database) as session:
+            for pattern in patterns:
+                if not rule.self_excluding:
+                    query = f"{pattern}\n{rule.inference}\nRETURN count(*) AS rows"
+                    _, written = await session.execute_write(self._run_batch, query, params)
+                    created += written
+                    continue
+                
+                query = f"{pattern}\nWITH * LIMIT $batch_size\n{rule.inference}\nRETURN count(*) AS rows"
+                for _ in range(max(1, settings.INFERENCE_MAX_BATCHES)):
+                    rows, written = await session.execute_write(self._run_batch, query, params)
+                    created += written
+                    if rows < batch_size:
+                        break
+                    if written == 0:
+                        # 匹配行没有被消耗，规则实际上不能排除已有结论，继续执行不会收敛
+                        logger.warning(f"Rule {rule.name} matched a full batch without creating anything, stopping")
+                        break
+                else:
+                    logger.warning(f"Rule {rule.name} still matched after {settings.INFERENCE_MAX_BATCHES} batches, stopping")
+        return created
+    
+    @staticmethod
+    async def _run_batch(tx, query: str, params: Dict[str, Any]) -> Tuple[int, int]:
+        result = await tx.run(query, **params)
+        record = await result.single()
+        summary = await result.consume()
+        return (record["rows"] if record else 0), summary.counters.relationships_created
+    
+    async def apply_rule(self, rule: Rule, patterns: Optional[List[str]] = None,
+                         stamp: Optional[str] = None, delta_stamp: Optional[str] = None,
+                         batch_size: Optional[int] = None) -> Dict[str, Any]:
+        """应用单个规则进行推理（默认对整张图完整求值一次）"""
         try:
-            # 构建完整查询
-            full_query = f"{rule.pattern}\n{rule.inference}\nRETURN count(*) as inferences"
-            
-            # 执行推理
-            result = await self.db.execute_write_query(full_query)
-            
-            # 处理结果
-            if result and result[0]:
-                inferences_count = result[0]
-                return {
-                    "rule_name": rule.name,
-                    "inferences_created": inferences_count,
-                    "status": "success"
-                }
-            
+            inferences_count = await self._evaluate(
+                rule,
+                patterns or [rule.pattern],
+                {"stamp": stamp or f"{uuid4().hex[:12]}:1", "delta_stamp": delta_stamp},
+                batch_size or settings.INFERENCE_WRITE_BATCH_SIZE
+            )
             return {
                 "rule_name": rule.name,
-                "inferences_created": 0,
+                "inferences_created": inferences_count,
                 "status": "success"
             }
         except Exception as e:
@@ -153,13 +410,31 @@ class InferenceEngine:
                 "error": str(e)
             }
     
+    def schedule(self) -> List[List[List[str]]]:
+        """当前规则集的分层执行计划（规则名）"""
+        return [[[rule.name for rule in group] for group in stratum] for stratum in plan_rule_strata(self.rules)]
+    
+    async def _run_scheduled(self, rules: List[Rule],
+                             run: Callable[[Rule], Awaitable[Dict[str, Any]]]) -> List[Tuple[Rule, Dict[str, Any]]]:
+        """按分层计划执行规则：层间顺序执行，层内各组并发（受 INFERENCE_MAX_CONCURRENCY 限制）"""
+        semaphore = asyncio.Semaphore(max(1, settings.INFERENCE_MAX_CONCURRENCY))
+        results: Dict[int, Dict[str, Any]] = {}
+        
+        async def run_group(group: List[Rule]) -> None:
+            for rule in group:
+                async with semaphore:
+                    results[id(rule)] = await run(rule)
+        
+        for stratum in plan_rule_strata(rules):
+            await asyncio.gather(*(run_group(group) for group in stratum))
+        return [(rule, results[id(rule)]) for rule in rules if id(rule) in results]
+    
     async def apply_all_rules(self) -> Dict[str, Any]:
-        """应用所有规则进行推理"""
+        """应用所有规则进行推理（按依赖分层，互不依赖的规则并发执行）"""
         results = []
         total_inferences = 0
         
-        for rule in self.rules:
-            result = await self.apply_rule(rule)
+        for rule, result in await self._run_scheduled(self.rules, self.apply_rule):
             results.append(result)
             
             if result["status"] == "success":
@@ -168,19 +443,319 @@ class InferenceEngine:
         return {
             "total_rules_applied": len(self.rules),
             "total_inferences_created": total_inferences,
+            "strata": self.schedule(),
             "rule_results": results
         }
     
+    async def run_to_fixpoint(self, max_iterations: Optional[int] = None,
+                              batch_size: Optional[int] = None) -> Dict[str, Any]:
+        """反复应用全部规则直到不再产生新关系（半朴素求值）
+        
+        第一轮对整张图完整求值；之后每轮只用增量模式把规则体与上一轮新推出的边连接，
+        每条新边带有 "<运行ID>:<轮次>" 形式的 inference_stamp。若上一轮有规则写入了
+        不带迭代标记的边（或规则没有增量模式），相应规则退回完整求值以保证结果完整。
+        """
+        await self.ensure_indexes()
+        return await self._fixpoint(uuid4().hex[:12], None, None, max_iterations, batch_size)
+    
+    async def _fixpoint(self, run_id: str, delta_stamp: Optional[str], changed_types: Optional[Set[str]],
+                        max_iterations: Optional[int] = None, batch_size: Optional[int] = None,
+                        rules: Optional[List[Rule]] = None) -> Dict[str, Any]:
+        """不动点迭代
+        
+        delta_stamp 为首轮的增量标记（None 表示首轮完整求值）；changed_types 为首轮发生变化的
+        关系类型（None 表示全部），每轮只执行读取了上一轮变化类型的规则；rules 限定参与的规则
+        （None 表示全部）。
+        """
+        rules = self.rules if rules is None else rules
+        max_iterations = max_iterations or settings.INFERENCE_MAX_ITERATIONS
+        batch_size = batch_size or settings.INFERENCE_WRITE_BATCH_SIZE
+        rounds = []
+        total_inferences = 0
+        converged = False
+        
+        for iteration in range(1, max_iterations + 1):
+            stamp = f"{run_id}:{iteration}"
+            rule_results = []
+            round_inferences = 0
+            untracked = False
+            written_types = set()
+            
+            async def run(rule: Rule) -> Dict[str, Any]:
+                semi_naive = delta_stamp is not None and bool(rule.delta_patterns)
+                result = await self.apply_rule(
+                    rule,
+                    patterns=rule.delta_patterns if semi_naive else [rule.pattern],
+                    stamp=stamp,
+                    delta_stamp=delta_stamp,
+                    batch_size=batch_size
+                )
+                result["mode"] = "semi_naive" if semi_naive else "full"
+                return result
+            
+            selected = [
+                rule for rule in rules
+                if changed_types is None or rule.reads(changed_types)
+            ]
+            for rule, result in await self._run_scheduled(selected, run):
+                rule_results.append(result)
+                
+                created = result.get("inferences_created", 0)
+                round_inferences += created
+                if created:
+                    written_types.update(rule.written_types)
+                    if not rule.stamps_inferences:
+                        untracked = True
+            
+            rounds.append({
+                "iteration": iteration,
+                "inferences_created": round_inferences,
+                "rule_results": rule_results
+            })
+            total_inferences += round_inferences
+            logger.info(f"Inference iteration {iteration}: {round_inferences} new relationships")
+            
+            if round_inferences == 0:
+                converged = True
+                break
+            # 新边无法按标记定位时，下一轮全部完整求值
+            delta_stamp = None if untracked else stamp
+            changed_types = written_types
+        
+        if not converged:
+            logger.warning(f"Inference did not reach a fixpoint within {max_iterations} iterations")
+        
+        return {
+            "run_id": run_id,
+            "iterations": len(rounds),
+            "converged": converged,
+            "total_inferences_created": total_inferences,
+            "rounds": rounds
+        }
+    
+    # ---- 增量推理 ----
+    
+    def affected_rules(self, rel_types: Set[str]) -> List[Rule]:
+        """读取了给定关系类型的可增量规则，以及（传递地）读取这些规则结论的可增量规则
+        
+        没有增量模式的规则只能对整张图求值，不参与增量推理。
+        """
+        types = set(rel_types)
+        affected = set()
+        changed = True
+        while changed:
+            changed = False
+            for rule in self.rules:
+                if rule.name not in affected and rule.incremental and rule.reads(types):
+                    affected.add(rule.name)
+                    types.update(rule.written_types)
+                    changed = True
+        return [rule for rule in self.rules if rule.name in affected]
+    
+    async def apply_changes(self, changes: List[RelationshipChange],
+                            batch_size: Optional[int] = None) -> Dict[str, Any]:
+        """按一批关系变更增量维护推理结果
+        
+        只执行读取了变更关系类型、且提供了增量模式的规则，并以变更处为起点：新增/更新的关系
+        打上触发标记，作为半朴素求值首轮的增量。删除/更新的关系先按"过度删除再重推"回收推理边：
+        删除起点可沿规则关系类型到达被删关系起点的推理边（按 rule 溯源限定在受影响的规则内），
+        再把这些推理边两端的关系一并作为首轮增量，仍有其他支撑的结论会被重新推出。
+        """
+        batch_size = batch_size or settings.INFERENCE_WRITE_BATCH_SIZE
+        touched = {change.rel_type for change in changes if change.rel_type}
+        affected = self.affected_rules(touched)
+        if not affected:
+            return {"inferences_created": 0, "inferences_retracted": 0, "rules": []}
+        
+        run_id = uuid4().hex[:12]
+        trigger = f"{run_id}:0"
+        rule_types = {t for rule in affected for t in rule.read_types + rule.written_types}
+        # 有规则读取全部关系类型时，端点上的任意关系都可能参与推理
+        anchor_types = None if any(rule.reads_all_types for rule in affected) else sorted(rule_types)
+        stamped_types: Set[str] = set()
+        stamped: List[str] = []  # 打上触发标记的原始关系（elementId）
+        removals = [change for change in changes if change.kind != RELATIONSHIP_CREATED]
+        changed_ids: Dict[str, List[str]] = {}
+        for change in changes:
+            if change.kind != RELATIONSHIP_DELETED and change.rel_id:
+                changed_ids.setdefault(change.rel_type, []).append(change.rel_id)
+        
+        async with get_driver().session(database=self.database) as session:
+            retracted, anchors = 0, []
+            if removals:
+                retracted, anchors = await self._retract(session, removals, affected, batch_size)
+            try:
+                for rel_type, ids in changed_ids.items():
+                    rows = await session.execute_write(self._run_write, f"""
+                    MATCH ()-[r:`{rel_type}`]->() WHERE r.id IN $ids
+                    SET r.inference_stamp = $trigger
+                    RETURN elementId(r) AS rel_id
+                    """, {"ids": ids, "trigger": trigger})
+                    stamped.extend(row["rel_id"] for row in rows)
+                for i in range(0, len(anchors), batch_size):
+                    rows = await session.execute_write(self._run_write, """
+                    UNWIND $anchors AS anchor
+                    MATCH (n)-[r]-() WHERE elementId(n) = anchor AND ($types IS NULL OR type(r) IN $types)
+                    SET r.inference_stamp = $trigger
+                    RETURN DISTINCT type(r) AS rel_type, elementId(r) AS rel_id
+                    """, {"anchors": anchors[i:i + batch_size], "types": anchor_types, "trigger": trigger})
+                    stamped_types.update(row["rel_type"] for row in rows)
+                    stamped.extend(row["rel_id"] for row in rows)
+                
+                result = await self._fixpoint(
+                    run_id, trigger, (rule_types | stamped_types) if anchors else touched,
+                    batch_size=batch_size, rules=affected
+                )
+            finally:
+                # 触发标记只用于本次求值，按 elementId 清除原始关系上的标记（读取的类型未必有标记索引）
+                stamped = list(dict.fromkeys(stamped))
+                for i in range(0, len(stamped), batch_size):
+                    await session.execute_write(self._run_write, """
+                    UNWIND $ids AS rel_id
+                    MATCH ()-[r]->() WHERE elementId(r) = rel_id
+                      AND r.inference_stamp = $trigger AND coalesce(r.inferred, false) = false
+                    REMOVE r.inference_stamp
+                    """, {"ids": stamped[i:i + batch_size], "trigger": trigger})
+        
+        created = result["total_inferences_created"]
+        self.incremental_stats["batches"] += 1
+        self.incremental_stats["changes"] += len(changes)
+        self.incremental_stats["inferences_created"] += created
+        self.incremental_stats["inferences_retracted"] += retracted
+        logger.info(
+            f"Incremental inference for {len(changes)} change(s): "
+            f"{created} created, {retracted} retracted"
+        )
+        return {
+            "inferences_created": created,
+            "inferences_retracted": retracted,
+            "rules": [rule.name for rule in affected],
+            "iterations": result["iterations"]
+        }
+    
+    async def _retract(self, session, removals: List[RelationshipChange], affected: List[Rule],
+                       batch_size: int) -> Tuple[int, List[str]]:
+        """过度删除可能失去支撑的推理边，返回删除数及其端点（elementId）"""
+        traverse_types = None if any(rule.reads_all_types for rule in affected) else \
+            sorted({t for rule in affected for t in rule.read_types})
+        source_ids = list({change.source_id for change in removals if change.source_id})
+        result = await session.run(
+            "MATCH (n:Entity) WHERE n.id IN $ids RETURN elementId(n) AS node", ids=source_ids
+        )
+        frontier = [record["node"] for record in await result.data()]
+        
+        # 沿规则读取的关系类型反向扩展，得到可能经由被删关系推出结论的起点集合
+        region = set(frontier)
+        while frontier:
+            result = await session.run("""
+            UNWIND $frontier AS node_id
+            MATCH (m)-[r]->(n) WHERE elementId(n) = node_id AND ($types IS NULL OR type(r) IN $types)
+            RETURN DISTINCT elementId(m) AS node
+            """, frontier=frontier, types=traverse_types)
+            frontier = [record["node"] for record in await result.data() if record["node"] not in region]
+            region.update(frontier)
+        
+        retracted = 0
+        anchors = set()
+        region = list(region)
+        rule_names = [rule.name for rule in affected]
+        query = """
+        UNWIND $region AS node_id
+        MATCH (a)-[r]->(c) WHERE elementId(a) = node_id AND r.inferred = true AND r.rule IN $rules
+        WITH r, a, c LIMIT $batch_size
+        DELETE r
+        RETURN elementId(a) AS a, elementId(c) AS c
+        """
+        for i in range(0, len(region), batch_size):
+            params = {"region": region[i:i + batch_size], "rules": rule_names, "batch_size": batch_size}
+            while True:
+                rows = await session.execute_write(self._run_write, query, params)
+                retracted += len(rows)
+                for row in rows:
+                    anchors.update((row["a"], row["c"]))
+                if len(rows) < batch_size:
+                    break
+        return retracted, list(anchors)
+    
+    @staticmethod
+    async def _run_write(tx, query: str, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        result = await tx.run(query, **params)
+        return await result.data()
+    
+    def start_incremental(self) -> None:
+        """订阅关系变更事件，在后台按批增量推理（需在事件循环中调用）"""
+        if self._worker is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        add_relationship_listener(self._enqueue_changes)
+        self._worker = asyncio.create_task(self._incremental_worker())
+        skipped = [rule.name for rule in self.rules if not rule.incremental]
+        if skipped:
+            logger.warning(
+                f"Rules without delta_patterns (or $stamp) are excluded from incremental inference "
+                f"and only run in full inference: {', '.join(skipped)}"
+            )
+        logger.info("Incremental inference started")
+    
+    async def stop_incremental(self) -> None:
+        """停止增量推理，未处理的变更被丢弃"""
+        remove_relationship_listener(self._enqueue_changes)
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+    
+    async def _enqueue_changes(self, changes: List[RelationshipChange]) -> None:
+        """关系变更监听器：只登记，由后台协程合并处理"""
+        self._pending.extend(changes)
+        self._idle.clear()
+        self._wakeup.set()
+    
+    async def _incremental_worker(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._pending:
+                changes, self._pending = self._pending, []
+                try:
+                    await self.apply_changes(changes)
+                except Exception as e:
+                    logger.error(f"Incremental inference failed for {len(changes)} change(s): {e}")
+            if not self._pending:
+                self._idle.set()
+    
+    async def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """等待已登记的变更处理完毕，超时返回False"""
+        if self._idle is None:
+            return True
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+    
     async def apply_rules_to_query(self, cypher_query: str, params: Dict[str, Any] = None) -> Dict[str, Any]:
-        """在查询执行前应用推理规则增强结果"""
-        # 首先执行推理
-        inference_result = await self.apply_all_rules()
+        """执行查询；推理结果由写入时的增量推理维护，查询前只等待尚未处理完的变更"""
+        created_before = self.incremental_stats["inferences_created"]
+        await self.wait_idle()
+        inference_count = self.incremental_stats["inferences_created"] - created_before
         
         # 执行原始查询
-        query_result = await self.db.execute_read_query(cypher_query, params)
+        async with get_driver().session(database=self.database) as session:
+            result = await session.run(cypher_query, **(params or {}))
+            query_result = await result.data()
         
         return {
-            "inference_applied": inference_result["total_inferences_created"] > 0,
-            "inference_count": inference_result["total_inferences_created"],
+            "inference_applied": inference_count > 0,
+            "inference_count": inference_count,
             "query_result": query_result
-        }
\ No newline at end of file
+        }
+
+
+# 进程内共享的推理引擎
+inference_engine = InferenceEngine()
@@ -13,17 +13,20 @@ class KnowledgeExtractorInterface(ABC):
     """知识抽取接口基类，定义统一的知识抽取行为"""
     
     @abstractmethod
-    async def extract_entities(self, document: SourceDocument, text_content: str) -> List[Entity]:
+    async def extract_entities(self, document: SourceDocument, text_content: str,
+                               job_id: Optional[str] = None) -> List[Entity]:
         """从文本中抽取实体"""
         pass
     
     @abstractmethod
-    async def extract_relationships(self, document: SourceDocument, entities: List[Entity], text_content: str) -> List[Relationship]:
+    async def extract_relationships(self, document: SourceDocument, entities: List[Entity], text_content: str,
+                                    job_id: Optional[str] = None) -> List[Relationship]:
         """从文本中抽取实体间的关系"""
         pass
     
     @abstractmethod
-    async def create_knowledge_traces(self, document: SourceDocument, entities: List[Entity], relationships: List[Relationship], text_content: str) -> bool:
+    async def create_knowledge_traces(self, document: SourceDocument, entities: List[Entity], relationships: List[Relationship], text_content: str,
+                                      job_id: Optional[str] = None) -> bool:
         """创建知识溯源记录"""
         pass
     
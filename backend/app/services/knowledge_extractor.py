@@ -11,54 +11,64 @@ from app.models.relationships.relationship import Relationship
 from app.models.documents.source_document import SourceDocument
 from app.models.documents.knowledge_trace import KnowledgeTrace
 from app.db.neo4j_db import Neo4jDatabase
+from app.services.extraction_session import ExtractionSession, load_spacy_model
+from app.services.provenance_service import ProvenanceService
+from app.core.config import settings
 
 
 class SpacyNERExtractor:
     """知识抽取器，负责从文档中提取实体和关系"""
     
+    # 单个文档参与抽取的最大字符数，超出部分截断
+    max_length = settings.NLP_MAX_TEXT_LENGTH
+    
     def __init__(self, db: Neo4jDatabase, model_name: str = "zh_core_web_sm"):
         self.db = db
+        self.provenance = ProvenanceService()
         self.model_name = model_name
+        # 当前文档的抽取会话，实体/关系/溯源抽取共享同一次解析
+        self._session: Optional[ExtractionSession] = None
         
         # 尝试加载模型，如果失败则使用回退模型
-        try:
-            self.nlp = spacy.load(model_name)
-            print(f"Loaded NLP model: {model_name}")
-        except Exception as e:
-            print(f"Error loading model {model_name}: {e}")
-            try:
-                # 尝试加载基础模型
-                self.nlp = spacy.load("en_core_web_sm")
-                print("Loaded fallback model: en_core_web_sm")
-            except:
-                # 如果仍然失败，使用空白模型
-                print("Using blank model as fallback")
-                self.nlp = spacy.blank("en")
+        self.nlp = load_spacy_model(model_name)
+    
+    def session(self, document: SourceDocument, text_content: str) -> ExtractionSession:
+        """获取文档的抽取会话，同一文档的多个抽取步骤复用同一个会话"""
+        current = self._session
+        if (current is None
+                or current.document.id != document.id
+                or current.document.content_hash != document.content_hash
+                or current.original_length != len(text_content)):
+            self._session = ExtractionSession(
+                self.nlp, document, text_content,
+                max_length=self.max_length, model_name=self.model_name
+            )
+        return self._session
     
-    async def extract_entities(self, document: SourceDocument, text_content: str) -> List[Entity]:
+    async def extract_entities(self, document: SourceDocument, text_content: str,
+                               job_id: Optional[str] = None) -> List[Entity]:
         """从文本中提取实体
         
         Args:
             document: 源文档
             text_content: 文档文本内容
+            job_id: 所属抽取任务ID，写入实体以便重试或取消时清理
             
         Returns:
             提取的实体列表
         """
         print(f"Extracting entities from document: {document.title}")
         
-        # 限制文本长度以避免处理过大的文档
-        max_length = 100000  # 限制为10万个字符
-        if len(text_content) > max_length:
-            text_content = text_content[:max_length]
-            print(f"Text truncated to {max_length} characters")
-        
-        # 使用spaCy进行实体识别
-        doc = self.nlp(text_content)
+        # 限制文本长度以避免处理过大的文档，解析结果由会话缓存
+        session = self.session(document, text_content)
+        if session.truncated:
+            print(f"Text truncated to {self.max_length} characters")
+        text_content = session.text
+        await session.parse()
         entities = []
         
         # 提取实体
-        for ent in doc.ents:
+        for ent in session.entities:
             # 映射spaCy实体类型到系统类型
             entity_type = self._map_entity_type(ent.label_)
             
@@ -76,22 +86,23 @@ class SpacyNERExtractor:
                 },
                 extraction_method="spacy_nlp",
                 confidence=0.85,  # 简化，实际应基于置信度计算
+                extraction_job_id=job_id,
             )
             
             # 添加到结果
             entities.append(entity)
-            
-            # 保存到数据库
-            try:
-                await self.db.create(entity)
-                print(f"Created entity: {entity.name} ({entity.type})")
-            except Exception as e:
-                print(f"Error saving entity {entity.name}: {e}")
+        
+        # 批量保存到数据库
+        try:
+            await self.db.create_many_entities(entities)
+        except Exception as e:
+            print(f"Error saving entities: {e}")
         
         print(f"Extracted {len(entities)} entities")
         return entities
     
-    async def extract_relationships(self, document: SourceDocument, entities: List[Entity], text_content: str) -> List[Relationship]:
+    async def extract_relationships(self, document: SourceDocument, entities: List[Entity], text_content: str,
+                                    job_id: Optional[str] = None) -> List[Relationship]:
         """从文本中提取实体间的关系"""
         print(f"Extracting relationships from document: {document.title}")
         
@@ -102,9 +113,10 @@ class SpacyNERExtractor:
         # 使用实体共现方法提取潜在关系
         relationships = []
         
-        # 构建句子分割
-        doc = self.nlp(text_content)
-        sentences = list(doc.sents)
+        # 构建句子分割（复用实体抽取时的解析结果）
+        session = self.session(document, text_content)
+        await session.parse()
+        sentences = session.sentences
         
         # 基于句子共现建立关系
         for sent in sentences:
@@ -148,7 +160,8 @@ class SpacyNERExtractor:
                                 },
                                 bidirectional=False,
                                 certainty=0.7,  # 共现关系的确定性较低
-                                confidence=0.7
+                                confidence=0.7,
+                                extraction_job_id=job_id
                             )
                             
                             # 修复: 添加创建和更新时间
@@ -159,18 +172,18 @@ class SpacyNERExtractor:
                             
                             # 添加到结果
                             relationships.append(relationship)
-                            
-                            # 保存到数据库
-                            try:
-                                await self.db.create(relationship)
-                                print(f"Created relationship: {sent_entities[i].name} --[{relation_type}]--> {sent_entities[j].name}")
-                            except Exception as e:
-                                print(f"Error saving relationship: {e}")
+        
+        # 批量保存到数据库
+        try:
+            await self.db.create_many_relationships(relationships)
+        except Exception as e:
+            print(f"Error saving relationships: {e}")
         
         print(f"Extracted {len(relationships)} relationships")
         return relationships
     
-    async def create_knowledge_traces(self, document: SourceDocument, entities: List[Entity], relationships: List[Relationship], text_content: str) -> List[KnowledgeTrace]:
+    async def create_knowledge_traces(self, document: SourceDocument, entities: List[Entity], relationships: List[Relationship], text_content: str,
+                                      job_id: Optional[str] = None) -> List[KnowledgeTrace]:
         """创建知识溯源记录
         
         Args:
@@ -178,6 +191,7 @@ class SpacyNERExtractor:
             entities: 提取的实体
             relationships: 提取的关系
             text_content: 文档文本内容
+            job_id: 所属抽取任务ID，写入记录以便重试或取消时清理
             
         Returns:
             创建的溯源记录列表
@@ -185,6 +199,8 @@ class SpacyNERExtractor:
         print(f"Creating knowledge traces for document: {document.title}")
         
         traces = []
+        session = self.session(document, text_content)
+        text_content = session.text
         
         # 为每个实体创建溯源记录
         for entity in entities:
@@ -196,7 +212,7 @@ class SpacyNERExtractor:
                 # 提取上下文
                 context_start = max(0, char_offset - 100)
                 context_end = min(len(text_content), char_offset + char_length + 100)
-                excerpt = text_content[char_offset:char_offset + char_length]
+                excerpt = session.excerpt(char_offset, char_offset + char_length)
                 
                 # 创建溯源记录
                 trace = KnowledgeTrace(
@@ -214,18 +230,18 @@ class SpacyNERExtractor:
                         "end_offset": char_offset + char_length,
                         "content_hash": self._generate_fingerprint(excerpt),
                     },
+                    extraction_job_id=job_id,
                 )
                 
                 # 添加到结果
                 traces.append(trace)
-                
-                # 这里应该保存到数据库，但目前我们只返回结果
-                print(f"Created trace for entity: {entity.name}")
         
         # 为关系创建溯源记录
         # 简化实现，实际系统中可能会更复杂
         
-        print(f"Created {len(traces)} knowledge traces")
+        # 批量保存到溯源存储
+        saved = await self.provenance.save_traces(traces)
+        print(f"Created {saved} knowledge traces")
         return traces
     
     def _map_entity_type(self, spacy_type: str) -> str:
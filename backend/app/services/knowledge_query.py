@@ -8,6 +8,12 @@ from app.models.documents.source_document import SourceDocument
 from app.models.documents.knowledge_trace import KnowledgeTrace
 from app.services.interfaces.query_interface import QueryInterface
 from app.db.neo4j_db import Neo4jDatabase
+from app.services.provenance_service import ProvenanceService
+from app.services.hierarchy_index import hierarchy_index
+
+# 自然语言查询中每个关键词最多匹配的实体数、每个实体最多展开的关系数
+NL_QUERY_ENTITY_LIMIT = 100
+NL_QUERY_CONTEXT_LIMIT = 100
 
 
 class KnowledgeQueryService(QueryInterface):
@@ -15,6 +21,7 @@ class KnowledgeQueryService(QueryInterface):
     
     def __init__(self, db: Neo4jDatabase):
         self.db = db
+        self.provenance = ProvenanceService()
     
     async def find_entities(self, query: Dict[str, Any]) -> List[Entity]:
         """根据条件查找实体"""
@@ -91,10 +98,9 @@ class KnowledgeQueryService(QueryInterface):
     
     async def get_entity_context(self, entity_id: UUID) -> List[Dict[str, Any]]:
         """获取实体的上下文信息：相关实体和关系"""
-        # 修改查询语句，使用相同的ID匹配方式
+        # 通过Entity标签锚定，走 :Entity(id) 索引
         cypher_query = """
-        MATCH (e)
-        WHERE toString(e.id) = $entity_id
+        MATCH (e:Entity {id: $entity_id})
         MATCH (e)-[r]-(related)
         RETURN r, related
         LIMIT 100
@@ -115,67 +121,47 @@ class KnowledgeQueryService(QueryInterface):
         
         return context
     
+    async def get_entity_hierarchy(self, entity_id: UUID, rel_type: str = "IS_A") -> Dict[str, Any]:
+        """获取实体在层次关系中的全部上位、下位实体及继承的属性（闭包由内存索引计算）"""
+        entity_id = str(entity_id)
+        ancestors = await hierarchy_index.ancestors(entity_id, rel_type)
+        descendants = await hierarchy_index.descendants(entity_id, rel_type)
+        properties = await hierarchy_index.inherited_properties(entity_id, rel_type)
+        
+        # 一次查询取回涉及实体的名称和类型
+        ids = list(dict.fromkeys(ancestors + descendants + [p["property_id"] for p in properties]))
+        names = {}
+        if ids:
+            cypher_query = """
+            UNWIND $ids AS id
+            MATCH (e:Entity {id: id})
+            RETURN e.id AS id, e.name AS name, e.type AS type
+            """
+            async with self.db.driver.session(database=self.db.database) as session:
+                result = await session.run(cypher_query, ids=ids)
+                async for record in result:
+                    names[record["id"]] = {"id": record["id"], "name": record["name"], "type": record["type"]}
+        
+        def describe(node_id: str) -> Dict[str, Any]:
+            return names.get(node_id, {"id": node_id, "name": None, "type": None})
+        
+        return {
+            "entity_id": entity_id,
+            "relationship_type": rel_type,
+            "ancestors": [describe(node_id) for node_id in ancestors],
+            "descendants": [describe(node_id) for node_id in descendants],
+            "inherited_properties": [
+                {**describe(p["property_id"]), "inherited_from": p["inherited_from"]} for p in properties
+            ]
+        }
+    
     async def trace_knowledge(self, entity_id: Optional[UUID] = None, relationship_id: Optional[UUID] = None) -> List[KnowledgeTrace]:
         """追溯知识来源，获取知识溯源记录"""
-        # 根据实体ID或关系ID查询溯源记录
+        # 根据实体ID或关系ID查询溯源记录（走溯源存储的索引）
         if entity_id:
-            # 查询与实体关联的溯源记录
-            # 这里假设有一个存储溯源记录的数据库表或集合
-            traces = [
-                # 示例溯源记录
-                KnowledgeTrace(
-                    id=UUID("a1b2c3d4-e5f6-4a5b-9c3d-2e1f0a9b8c7d"),
-                    entity_id=entity_id,
-                    document_id=UUID("e37f0136-7dc8-4dc9-92d7-b40b98e1a63d"),
-                    location_data={
-                        "page": 5,
-                        "paragraph": 2,
-                        "char_offset": 120,
-                        "char_length": 45
-                    },
-                    context_range={
-                        "before_chars": 100,
-                        "after_chars": 100
-                    },
-                    excerpt="知识图谱是一种表示知识的图结构，由节点和边组成，节点表示实体，边表示实体间的关系。",
-                    anchor_type="char_offset",
-                    anchor_data={
-                        "start_offset": 120,
-                        "end_offset": 165,
-                        "content_fingerprint": "哈希值用于确认内容匹配"
-                    }
-                )
-            ]
-            return traces
-        
+            return await self.provenance.find_traces(entity_id=entity_id)
         elif relationship_id:
-            # 查询与关系关联的溯源记录
-            traces = [
-                # 示例溯源记录
-                KnowledgeTrace(
-                    id=UUID("b2c3d4e5-f6a7-5b6c-8d9e-3f1g0a2b3c4d"),
-                    relationship_id=relationship_id,
-                    document_id=UUID("e37f0136-7dc8-4dc9-92d7-b40b98e1a63d"),
-                    location_data={
-                        "page": 7,
-                        "paragraph": 3,
-                        "char_offset": 210,
-                        "char_length": 30
-                    },
-                    context_range={
-                        "before_chars": 100,
-                        "after_chars": 100
-                    },
-                    excerpt="知识图谱是知识表示和知识库的一种形式。",
-                    anchor_type="char_offset",
-                    anchor_data={
-                        "start_offset": 210,
-                        "end_offset": 240,
-                        "content_fingerprint": "哈希值用于确认内容匹配"
-                    }
-                )
-            ]
-            return traces
+            return await self.provenance.find_traces(relationship_id=relationship_id)
         
         # 如果都没有提供，返回空列表
         return []
@@ -185,22 +171,53 @@ class KnowledgeQueryService(QueryInterface):
         # 这是一个复杂功能的简化实现
         # 实际实现可能需要NLP技术将自然语言转换为图查询
         
-        # 简单的关键词提取
-        keywords = query.lower().split()
-        
-        # 根据关键词查找相关实体
-        entities = []
-        for keyword in keywords:
-            if len(keyword) > 2:  # 忽略太短的关键词
-                found_entities = await self.find_entities({"name": keyword})
-                entities.extend(found_entities)
+        # 简单的关键词提取（忽略太短的关键词，去重并保持顺序）
+        keywords = list(dict.fromkeys(k for k in query.lower().split() if len(k) > 2))
         
-        # 如果找到实体，获取相关关系
-        relationships = []
-        for entity in entities:
-            context = await self.get_entity_context(entity.id)
-            for item in context:
-                relationships.append(item["relationship"])
+        entities: List[Entity] = []
+        relationships: List[Relationship] = []
+        if keywords:
+            # 一次查询完成全部关键词的实体匹配与每个实体的上下文展开
+            cypher_query = """
+            UNWIND $keywords AS keyword
+            CALL {
+                WITH keyword
+                MATCH (e:Entity) WHERE e.name_lower CONTAINS keyword
+                RETURN e LIMIT $entity_limit
+            }
+            WITH DISTINCT e
+            CALL {
+                WITH e
+                MATCH (e)-[r]-()
+                WITH r LIMIT $context_limit
+                RETURN collect({rel: r, source: startNode(r), target: endNode(r)}) AS context
+            }
+            RETURN e, context
+            """
+            
+            seen_entities = set()
+            seen_relationships = set()
+            async with self.db.driver.session(database=self.db.database) as session:
+                result = await session.run(
+                    cypher_query,
+                    keywords=keywords,
+                    entity_limit=NL_QUERY_ENTITY_LIMIT,
+                    context_limit=NL_QUERY_CONTEXT_LIMIT
+                )
+                async for record in result:
+                    node = record["e"]
+                    if node.get("id") not in seen_entities:
+                        seen_entities.add(node.get("id"))
+                        entities.append(self._node_to_entity(node))
+                    
+                    # 两个匹配实体之间的关系只保留一次
+                    for item in record["context"]:
+                        rel = item["rel"]
+                        rel_key = rel.get("id") or rel.element_id
+                        if rel_key in seen_relationships:
+                            continue
+                        seen_relationships.add(rel_key)
+                        relationships.append(self._rel_to_relationship(rel, item["source"], item["target"]))
         
         return {
             "query": query,
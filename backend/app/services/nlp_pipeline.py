@@ -46,6 +46,15 @@ class EntityLinkerComponent:
         # 使用[CLS]令牌的表示作为整个文本的嵌入
         embedding = outputs.last_hidden_state[:, 0, :].numpy()
         return embedding
+    
+    def get_embeddings(self, texts: List[str], max_length: int = 512) -> np.ndarray:
+        """批量计算文本的语义嵌入，返回 (len(texts), hidden_size) 的float32矩阵"""
+        inputs = self.tokenizer(texts, return_tensors="pt", padding=True, truncation=True, max_length=max_length)
+        with torch.no_grad():
+            outputs = self.model(**inputs)
+        
+        # 与 _get_embedding 相同，取[CLS]令牌的表示
+        return outputs.last_hidden_state[:, 0, :].numpy().astype(np.float32)
 
 
 class NLPPipeline:
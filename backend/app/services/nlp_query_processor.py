@@ -4,10 +4,13 @@ from typing import Dict, Any, List, Optional, Tuple
 import re
 import spacy
 from fastapi import HTTPException
+from spacy.tokens import DocBin
 from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
 import torch
 
 from app.core.logger import logger
+from app.core.executors import run_cpu, cpu_uses_processes
+from app.services.extraction_session import parse_texts_to_docbin
 
 class NLPQueryProcessor:
     """自然语言查询处理器，将自然语言转换为结构化查询"""
@@ -21,9 +24,11 @@ class NLPQueryProcessor:
         # 加载spaCy模型用于基础NLP任务
         try:
             self.nlp = spacy.load("zh_core_web_trf")
+            self.model_name = "zh_core_web_trf"
         except:
             # 回退到较小的模型
             self.nlp = spacy.load("zh_core_web_sm")
+            self.model_name = "zh_core_web_sm"
         
         # 加载Transformer模型用于复杂查询转换
         try:
@@ -36,8 +41,8 @@ class NLPQueryProcessor:
     
     async def process_query(self, query_text: str) -> Dict[str, Any]:
         """处理自然语言查询，返回结构化表示"""
-        # 基础NLP处理
-        doc = self.nlp(query_text)
+        # 基础NLP处理，在CPU执行器中解析以免阻塞事件循环
+        doc = await self._parse(query_text)
         
         # 尝试识别查询意图
         intent = self._identify_intent(doc)
@@ -62,6 +67,13 @@ class NLPQueryProcessor:
             ]
         }
     
+    async def _parse(self, query_text: str):
+        """通过CPU执行器解析查询；进程池模式下由工作进程按模型名加载模型，结果以DocBin传回"""
+        if cpu_uses_processes():
+            data = await run_cpu(parse_texts_to_docbin, self.model_name, [query_text])
+            return next(DocBin().from_bytes(data).get_docs(self.nlp.vocab))
+        return await run_cpu(self.nlp, query_text)
+    
     def _identify_intent(self, doc) -> Dict[str, Any]:
         """识别查询意图"""
         query_text = doc.text.lower()
@@ -0,0 +1,298 @@
+# app/services/provenance_service.py
+
+from typing import Dict, Any, List, Optional
+from uuid import UUID
+from datetime import datetime
+import json
+
+from sqlalchemy import func
+
+from app.db.sqlite_db import SessionLocal
+from app.db.models import Document, KnowledgeTraceRecord
+from app.models.documents.knowledge_trace import KnowledgeTrace
+from app.services.interfaces.provenance_interface import ProvenanceInterface
+from app.services.document_processor import load_document_text
+from app.core.executors import run_io
+
+# 批量写入时每个事务的行数
+TRACE_WRITE_BATCH_SIZE = 1000
+# IN 查询每次携带的ID数量（SQLite变量数有上限）
+TRACE_LOOKUP_BATCH_SIZE = 500
+# 获取原始上下文时默认的前后字符数
+DEFAULT_CONTEXT_CHARS = 100
+
+# 可更新的字段，JSON字段需序列化
+_UPDATABLE_FIELDS = {"location_data", "context_range", "excerpt", "anchor_type", "anchor_data"}
+_JSON_FIELDS = {"location_data", "context_range", "anchor_data"}
+
+
+def _to_row(trace: KnowledgeTrace) -> Dict[str, Any]:
+    """KnowledgeTrace 转换为数据库行"""
+    now = datetime.utcnow()
+    return {
+        "id": str(trace.id),
+        "entity_id": str(trace.entity_id) if trace.entity_id else None,
+        "relationship_id": str(trace.relationship_id) if trace.relationship_id else None,
+        "document_id": str(trace.document_id),
+        "location_data": json.dumps(trace.location_data or {}, ensure_ascii=False),
+        "context_range": json.dumps(trace.context_range or {}, ensure_ascii=False),
+        "excerpt": trace.excerpt,
+        "anchor_type": trace.anchor_type,
+        "anchor_data": json.dumps(trace.anchor_data or {}, ensure_ascii=False),
+        "extraction_job_id": trace.extraction_job_id,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+def _to_trace(record: KnowledgeTraceRecord) -> KnowledgeTrace:
+    """数据库行转换为 KnowledgeTrace"""
+    return KnowledgeTrace(
+        id=UUID(record.id),
+        entity_id=UUID(record.entity_id) if record.entity_id else None,
+        relationship_id=UUID(record.relationship_id) if record.relationship_id else None,
+        document_id=UUID(record.document_id),
+        location_data=json.loads(record.location_data or "{}"),
+        context_range=json.loads(record.context_range or "{}"),
+        excerpt=record.excerpt,
+        anchor_type=record.anchor_type or "char_offset",
+        anchor_data=json.loads(record.anchor_data or "{}"),
+        extraction_job_id=record.extraction_job_id,
+        created_at=record.created_at,
+        updated_at=record.updated_at,
+    )
+
+
+class ProvenanceService(ProvenanceInterface):
+    """知识溯源服务
+
+    溯源记录保存在SQLite的 knowledge_traces 表中，entity_id、relationship_id、document_id
+    各有索引，按任一维度查找都是一次索引查询；抽取结果批量写入。
+    所有数据库操作经 run_io 在线程池中执行。
+    """
+
+    # ---- 写入 ----
+
+    async def create_trace(self, entity_id: Optional[UUID], relationship_id: Optional[UUID],
+                          document_id: UUID, location_data: Dict[str, Any],
+                          excerpt: str) -> KnowledgeTrace:
+        """创建溯源记录"""
+        char_offset = location_data.get("char_offset", 0)
+        char_length = location_data.get("char_length", len(excerpt or ""))
+        trace = KnowledgeTrace(
+            entity_id=entity_id,
+            relationship_id=relationship_id,
+            document_id=document_id,
+            location_data=location_data,
+            excerpt=excerpt,
+            anchor_type="char_offset",
+            anchor_data={"start_offset": char_offset, "end_offset": char_offset + char_length},
+        )
+        await self.save_traces([trace])
+        return trace
+
+    async def save_traces(self, traces: List[KnowledgeTrace]) -> int:
+        """批量保存溯源记录，返回写入的数量"""
+        if not traces:
+            return 0
+        return await run_io(self._save_sync, [_to_row(trace) for trace in traces])
+
+    def _save_sync(self, rows: List[Dict[str, Any]]) -> int:
+        db = SessionLocal()
+        try:
+            table = KnowledgeTraceRecord.__table__
+            for i in range(0, len(rows), TRACE_WRITE_BATCH_SIZE):
+                db.execute(table.insert(), rows[i:i + TRACE_WRITE_BATCH_SIZE])
+            db.commit()
+            return len(rows)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def update_trace(self, trace_id: UUID, data: Dict[str, Any]) -> Optional[KnowledgeTrace]:
+        """更新溯源记录，记录不存在时返回None"""
+        return await run_io(self._update_sync, str(trace_id), data)
+
+    def _update_sync(self, trace_id: str, data: Dict[str, Any]) -> Optional[KnowledgeTrace]:
+        db = SessionLocal()
+        try:
+            record = db.query(KnowledgeTraceRecord).filter(KnowledgeTraceRecord.id == trace_id).first()
+            if record is None:
+                return None
+            for key, value in data.items():
+                if key not in _UPDATABLE_FIELDS:
+                    continue
+                setattr(record, key, json.dumps(value, ensure_ascii=False) if key in _JSON_FIELDS else value)
+            db.commit()
+            db.refresh(record)
+            return _to_trace(record)
+        finally:
+            db.close()
+
+    async def delete_trace(self, trace_id: UUID) -> bool:
+        """删除溯源记录"""
+        return await run_io(self._delete_sync, KnowledgeTraceRecord.id, str(trace_id)) > 0
+
+    async def delete_document_traces(self, document_id: UUID) -> int:
+        """删除来自某个文档的全部溯源记录，返回删除数"""
+        return await run_io(self._delete_sync, KnowledgeTraceRecord.document_id, str(document_id))
+
+    async def delete_job_traces(self, job_id: str) -> int:
+        """删除某个抽取任务写入的溯源记录，返回删除数"""
+        return await run_io(self._delete_sync, KnowledgeTraceRecord.extraction_job_id, job_id)
+
+    def _delete_sync(self, column, value: str) -> int:
+        db = SessionLocal()
+        try:
+            deleted = db.query(KnowledgeTraceRecord).filter(column == value).delete(synchronize_session=False)
+            db.commit()
+            return deleted
+        finally:
+            db.close()
+
+    # ---- 查询 ----
+
+    async def find_traces(self, entity_id: Optional[UUID] = None,
+                         relationship_id: Optional[UUID] = None,
+                         document_id: Optional[UUID] = None,
+                         limit: Optional[int] = None, offset: int = 0) -> List[KnowledgeTrace]:
+        """查找溯源记录（至少提供一个条件）"""
+        filters = {
+            "entity_id": entity_id,
+            "relationship_id": relationship_id,
+            "document_id": document_id,
+        }
+        filters = {key: str(value) for key, value in filters.items() if value is not None}
+        if not filters:
+            return []
+        return await run_io(self._find_sync, filters, limit, offset)
+
+    def _find_sync(self, filters: Dict[str, str], limit: Optional[int], offset: int) -> List[KnowledgeTrace]:
+        db = SessionLocal()
+        try:
+            query = db.query(KnowledgeTraceRecord)
+            for key, value in filters.items():
+                query = query.filter(getattr(KnowledgeTraceRecord, key) == value)
+            query = query.order_by(KnowledgeTraceRecord.created_at).offset(offset)
+            if limit:
+                query = query.limit(limit)
+            return [_to_trace(record) for record in query.all()]
+        finally:
+            db.close()
+
+    async def find_traces_for_entities(self, entity_ids: List[UUID],
+                                       limit_per_entity: Optional[int] = None) -> Dict[str, List[KnowledgeTrace]]:
+        """批量查找多个实体的溯源记录，返回 {实体ID: 溯源记录列表}"""
+        ids = list(dict.fromkeys(str(entity_id) for entity_id in entity_ids))
+        if not ids:
+            return {}
+        return await run_io(self._find_for_entities_sync, ids, limit_per_entity)
+
+    def _find_for_entities_sync(self, ids: List[str], limit_per_entity: Optional[int]) -> Dict[str, List[KnowledgeTrace]]:
+        db = SessionLocal()
+        try:
+            traces: Dict[str, List[KnowledgeTrace]] = {entity_id: [] for entity_id in ids}
+            for i in range(0, len(ids), TRACE_LOOKUP_BATCH_SIZE):
+                batch = ids[i:i + TRACE_LOOKUP_BATCH_SIZE]
+                query = db.query(KnowledgeTraceRecord).filter(KnowledgeTraceRecord.entity_id.in_(batch))
+                if limit_per_entity:
+                    # 每个实体只取最早的若干条，避免热门实体拖慢整批查询
+                    ranked = db.query(
+                        KnowledgeTraceRecord.id,
+                        func.row_number().over(
+                            partition_by=KnowledgeTraceRecord.entity_id,
+                            order_by=KnowledgeTraceRecord.created_at
+                        ).label("rank")
+                    ).filter(KnowledgeTraceRecord.entity_id.in_(batch)).subquery()
+                    query = db.query(KnowledgeTraceRecord).join(
+                        ranked, ranked.c.id == KnowledgeTraceRecord.id
+                    ).filter(ranked.c.rank <= limit_per_entity)
+                for record in query.order_by(KnowledgeTraceRecord.created_at).all():
+                    traces[record.entity_id].append(_to_trace(record))
+            return traces
+        finally:
+            db.close()
+
+    async def find_entity_trace_views(self, entity_id: UUID, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """实体的溯源记录及其来源文档的标题和类型（一次关联查询）"""
+        return await run_io(self._entity_views_sync, str(entity_id), limit)
+
+    def _entity_views_sync(self, entity_id: str, limit: Optional[int]) -> List[Dict[str, Any]]:
+        db = SessionLocal()
+        try:
+            query = db.query(KnowledgeTraceRecord, Document.title, Document.type).outerjoin(
+                Document, Document.id == KnowledgeTraceRecord.document_id
+            ).filter(
+                KnowledgeTraceRecord.entity_id == entity_id
+            ).order_by(KnowledgeTraceRecord.created_at)
+            if limit:
+                query = query.limit(limit)
+
+            views = []
+            for record, title, doc_type in query.all():
+                views.append({
+                    "id": record.id,
+                    "entity_id": entity_id,
+                    "document_id": record.document_id,
+                    "document_title": title or "Unknown Document",
+                    "document_type": doc_type or "unknown",
+                    "location_data": json.loads(record.location_data or "{}"),
+                    "excerpt": record.excerpt or ""
+                })
+            return views
+        finally:
+            db.close()
+
+    async def get_original_context(self, trace_id: UUID, context_chars: Optional[int] = None) -> Dict[str, Any]:
+        """获取溯源记录在原文中的上下文（经文本缓存读取文档全文）"""
+        found = await run_io(self._trace_with_document_sync, str(trace_id))
+        if found is None:
+            return {}
+        trace, document = found
+
+        context = {"trace": trace, "document": None, "before": "", "text": trace.excerpt or "", "after": ""}
+        if document is None:
+            return context
+        context["document"] = {"id": document["id"], "title": document["title"], "type": document["type"]}
+        if not document["file_path"]:
+            return context
+
+        try:
+            extracted = await load_document_text(document["file_path"], document["type"], document["content_hash"])
+        except Exception as e:
+            print(f"Warning: Could not load document text for trace {trace_id}: {e}")
+            return context
+
+        content = extracted.content
+        start = trace.anchor_data.get("start_offset", trace.location_data.get("char_offset", 0))
+        end = trace.anchor_data.get("end_offset", start + trace.location_data.get("char_length", 0))
+        before = context_chars if context_chars is not None else trace.context_range.get("before_chars", DEFAULT_CONTEXT_CHARS)
+        after = context_chars if context_chars is not None else trace.context_range.get("after_chars", DEFAULT_CONTEXT_CHARS)
+        context.update({
+            "before": content[max(0, start - before):start],
+            "text": content[start:end],
+            "after": content[end:end + after],
+        })
+        return context
+
+    def _trace_with_document_sync(self, trace_id: str):
+        db = SessionLocal()
+        try:
+            record = db.query(KnowledgeTraceRecord).filter(KnowledgeTraceRecord.id == trace_id).first()
+            if record is None:
+                return None
+            document = db.query(Document).filter(Document.id == record.document_id).first()
+            document_info = None
+            if document is not None:
+                document_info = {
+                    "id": document.id,
+                    "title": document.title,
+                    "type": document.type,
+                    "file_path": document.file_path,
+                    "content_hash": document.content_hash,
+                }
+            return _to_trace(record), document_info
+        finally:
+            db.close()
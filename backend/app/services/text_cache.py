@@ -0,0 +1,152 @@
+# app/services/text_cache.py
+
+from typing import Any, Dict, List, NamedTuple, Optional
+from collections import OrderedDict
+import gzip
+import json
+import os
+import re
+import threading
+from uuid import uuid4
+
+from app.core.config import settings
+
+
+class ExtractedText(NamedTuple):
+    """文档抽取出的全文及其分页/段落偏移"""
+    content: str
+    pages: List[Dict[str, Any]]
+    paragraphs: List[Dict[str, Any]]
+
+
+def paragraph_offsets(content: str) -> List[Dict[str, Any]]:
+    """按空行切分段落，记录每个段落在全文中的字符偏移"""
+    paragraphs = []
+    start = 0
+    for match in re.finditer(r"\n\s*\n", content):
+        if content[start:match.start()].strip():
+            paragraphs.append({
+                "paragraph": len(paragraphs) + 1,
+                "char_offset": start,
+                "char_length": match.start() - start,
+            })
+        start = match.end()
+    if content[start:].strip():
+        paragraphs.append({
+            "paragraph": len(paragraphs) + 1,
+            "char_offset": start,
+            "char_length": len(content) - start,
+        })
+    return paragraphs
+
+
+class TextCache:
+    """按content_hash持久化缓存抽取出的文本（gzip压缩的JSON文件）
+
+    预览、知识抽取和索引都从这里读取文本，避免重复解析PDF/Word；
+    磁盘占用超过预算时按最近访问时间（文件mtime）淘汰。所有方法均为阻塞调用。
+    """
+
+    def __init__(self, root: str = settings.TEXT_CACHE_DIR, max_bytes: int = settings.TEXT_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # content_hash -> 文件大小，按访问先后排序（最近访问的在末尾）
+        self._entries: Optional["OrderedDict[str, int]"] = None
+        self._total_bytes = 0
+
+    def path_for(self, content_hash: str) -> str:
+        """content_hash 对应的缓存文件路径"""
+        digest = content_hash.split(":", 1)[-1]
+        return os.path.join(self.root, digest[:2], f"{digest}.json.gz")
+
+    def get(self, content_hash: str) -> Optional[ExtractedText]:
+        """读取缓存，未命中返回None"""
+        if not content_hash:
+            return None
+        path = self.path_for(content_hash)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Warning: Discarding unreadable text cache entry {path}: {e}")
+            self.invalidate(content_hash)
+            return None
+
+        with self._lock:
+            self._load_index()
+            if content_hash in self._entries:
+                self._entries.move_to_end(content_hash)
+        try:
+            # 更新mtime作为最近访问时间，重启后仍能按LRU淘汰
+            os.utime(path)
+        except OSError:
+            pass
+
+        return ExtractedText(data["content"], data.get("pages", []), data.get("paragraphs", []))
+
+    def put(self, content_hash: str, content: str, pages: Optional[List[Dict[str, Any]]] = None) -> ExtractedText:
+        """写入缓存（先写临时文件再原子重命名），必要时淘汰最久未访问的条目"""
+        entry = ExtractedText(content, pages or [], paragraph_offsets(content))
+        if not content_hash or self.max_bytes <= 0:
+            return entry
+
+        path = self.path_for(content_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{uuid4().hex}.tmp"
+        try:
+            with gzip.open(temp_path, "wt", encoding="utf-8") as f:
+                json.dump(entry._asdict(), f, ensure_ascii=False)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        size = os.path.getsize(path)
+        with self._lock:
+            self._load_index()
+            self._total_bytes += size - self._entries.pop(content_hash, 0)
+            self._entries[content_hash] = size
+            self._evict()
+        return entry
+
+    def invalidate(self, content_hash: str) -> None:
+        """删除缓存条目"""
+        path = self.path_for(content_hash)
+        with self._lock:
+            self._load_index()
+            self._total_bytes -= self._entries.pop(content_hash, 0)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _load_index(self) -> None:
+        """首次使用时扫描缓存目录，按mtime恢复访问顺序（需持有锁）"""
+        if self._entries is not None:
+            return
+        found = []
+        if os.path.isdir(self.root):
+            for dirpath, _, filenames in os.walk(self.root):
+                for filename in filenames:
+                    if not filename.endswith(".json.gz"):
+                        continue
+                    stat = os.stat(os.path.join(dirpath, filename))
+                    found.append((stat.st_mtime, f"sha256:{filename[:-len('.json.gz')]}", stat.st_size))
+        found.sort()
+        self._entries = OrderedDict((content_hash, size) for _, content_hash, size in found)
+        self._total_bytes = sum(self._entries.values())
+
+    def _evict(self) -> None:
+        """超过磁盘预算时淘汰最久未访问的条目（需持有锁，保留最新写入的一条）"""
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            content_hash, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(self.path_for(content_hash))
+            except FileNotFoundError:
+                pass
+
+
+# 进程内共享的文本缓存
+text_cache = TextCache()
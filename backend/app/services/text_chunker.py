@@ -0,0 +1,75 @@
+# app/services/text_chunker.py
+
+from typing import List, NamedTuple, Optional, Iterable
+import bisect
+
+# 句末标点，作为无段落边界时的次选切分点
+SENTENCE_TERMINATORS = "。！？!?.；;"
+
+
+class TextChunk(NamedTuple):
+    """文本分块，offset为该块在全文中的起始字符偏移"""
+    offset: int
+    text: str
+
+
+def page_boundaries(metadata: Optional[dict]) -> List[int]:
+    """从文档元数据的结构信息中取出分页（或段落）的起始偏移"""
+    structure = (metadata or {}).get("structure") or {}
+    items = structure.get("pages") or structure.get("paragraphs") or []
+    return [item["char_offset"] for item in items if isinstance(item, dict) and "char_offset" in item]
+
+
+def chunk_text(text: str, max_chars: int, boundaries: Optional[Iterable[int]] = None) -> List[TextChunk]:
+    """将长文本切分为首尾相接的分块，各块拼接后与原文完全一致
+
+    切分点优先级：给定的页/段落边界 > 换行 > 句末标点 > 硬切分。
+    每块尽量装入多个完整的页或段落，但不超过max_chars个字符。
+
+    Args:
+        text: 全文
+        max_chars: 每块最大字符数
+        boundaries: 首选切分点（如每页的起始偏移）
+
+    Returns:
+        按顺序排列的分块列表
+    """
+    length = len(text)
+    if length <= max_chars:
+        return [TextChunk(0, text)]
+
+    preferred = sorted({b for b in (boundaries or []) if 0 < b < length})
+    line_breaks = [i + 1 for i, c in enumerate(text) if c == "\n" and i + 1 < length]
+
+    chunks = []
+    start = 0
+    while start < length:
+        limit = start + max_chars
+        if limit >= length:
+            end = length
+        else:
+            # 页边界离起点太近时改用换行切分，避免产生过小的分块
+            end = (_last_between(preferred, start + max_chars // 2, limit)
+                   or _last_between(line_breaks, start, limit)
+                   or _last_terminator(text, start, limit)
+                   or limit)
+        chunks.append(TextChunk(start, text[start:end]))
+        start = end
+
+    return chunks
+
+
+def _last_between(points: List[int], start: int, limit: int) -> Optional[int]:
+    """返回有序列表中落在(start, limit]内的最大值"""
+    index = bisect.bisect_right(points, limit) - 1
+    if index >= 0 and points[index] > start:
+        return points[index]
+    return None
+
+
+def _last_terminator(text: str, start: int, limit: int) -> Optional[int]:
+    """返回(start, limit]内最后一个句末标点之后的位置"""
+    for i in range(limit - 1, start, -1):
+        if text[i] in SENTENCE_TERMINATORS:
+            return i + 1
+    return None
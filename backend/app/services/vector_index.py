@@ -0,0 +1,412 @@
+# app/services/vector_index.py
+
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+import math
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+from app.core.config import settings
+
+# 向量所属对象的类型
+KIND_DOCUMENT = "document"
+KIND_ENTITY = "entity"
+KIND_CODES = {KIND_DOCUMENT: 0, KIND_ENTITY: 1}
+
+# 分块计算相似度时每次处理的向量行数，限制临时内存
+SCAN_BLOCK_ROWS = 65536
+# 训练聚类中心时每个中心抽样的向量数
+TRAIN_SAMPLES_PER_LIST = 64
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """按行L2归一化，使内积等于余弦相似度"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _nearest(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """分块求每个向量最近（内积最大）的聚类中心"""
+    labels = np.empty(len(vectors), dtype=np.int32)
+    block = max(1, SCAN_BLOCK_ROWS // 8)
+    for start in range(0, len(vectors), block):
+        chunk = np.asarray(vectors[start:start + block], dtype=np.float32)
+        labels[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return labels
+
+
+def _top_k(rows: np.ndarray, scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """取得分最高的k个，按得分降序"""
+    if len(scores) > k:
+        keep = np.argpartition(-scores, k - 1)[:k]
+        rows, scores = rows[keep], scores[keep]
+    order = np.argsort(-scores)
+    return rows[order], scores[order]
+
+
+class VectorIndex:
+    """基于NumPy内存映射的IVF（倒排文件）向量索引
+
+    向量归一化后以float32追加写入 vectors.f32，查询时经 np.memmap 读取而不整体载入内存；
+    每行所属的倒排列表写入 lists.i32，聚类中心保存在 centroids.npy。向量数达到
+    VECTOR_INDEX_TRAIN_MIN 之前使用暴力检索，之后训练聚类中心，查询只扫描最近的 nprobe 个列表。
+    分块的来源（类型、ID、偏移、文本）记录在同目录的SQLite中，更新时旧行只做删除标记。
+    所有方法均为阻塞调用，异步代码中应通过 run_io 调用。
+    """
+
+    def __init__(self, root: str = settings.VECTOR_INDEX_DIR, dim: int = settings.EMBEDDING_DIM):
+        self.root = root
+        self.dim = dim
+        self.vectors_path = os.path.join(root, "vectors.f32")
+        self.lists_path = os.path.join(root, "lists.i32")
+        self.centroids_path = os.path.join(root, "centroids.npy")
+        self._lock = threading.RLock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._count = 0
+        self._vectors: Optional[np.memmap] = None
+        # 每行的存活标记、对象类型与所属倒排列表（-1为未分配）
+        self._alive = np.zeros(0, dtype=bool)
+        self._kinds = np.zeros(0, dtype=np.int8)
+        self._assign = np.zeros(0, dtype=np.int32)
+        self._centroids: Optional[np.ndarray] = None
+        self._lists: List[np.ndarray] = []
+
+    # ---- 打开与持久化 ----
+
+    def _open(self) -> None:
+        """首次使用时打开元数据库并载入各行状态（需持有锁）"""
+        if self._db is not None:
+            return
+        os.makedirs(self.root, exist_ok=True)
+        db = sqlite3.connect(os.path.join(self.root, "chunks.db"), check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute('''
+        CREATE TABLE IF NOT EXISTS chunks (
+            row INTEGER PRIMARY KEY,
+            kind TEXT NOT NULL,
+            ref_id TEXT NOT NULL,
+            content_hash TEXT,
+            title TEXT,
+            ref_type TEXT,
+            chunk_offset INTEGER,
+            text TEXT,
+            deleted INTEGER NOT NULL DEFAULT 0
+        )
+        ''')
+        db.execute("CREATE INDEX IF NOT EXISTS idx_chunks_ref ON chunks(kind, ref_id)")
+        db.commit()
+        self._db = db
+
+        # 向量文件与元数据库以两者共有的行数为准（进程在两次写入之间退出时丢弃多出的部分）
+        row_bytes = self.dim * 4
+        file_rows = os.path.getsize(self.vectors_path) // row_bytes if os.path.exists(self.vectors_path) else 0
+        db_rows = db.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM chunks").fetchone()[0]
+        count = min(file_rows, db_rows)
+        if db_rows > count:
+            db.execute("DELETE FROM chunks WHERE row >= ?", (count,))
+            db.commit()
+        self._truncate(self.vectors_path, count * row_bytes)
+
+        alive = np.zeros(count, dtype=bool)
+        kinds = np.zeros(count, dtype=np.int8)
+        for row, kind, deleted in db.execute("SELECT row, kind, deleted FROM chunks"):
+            alive[row] = not deleted
+            kinds[row] = KIND_CODES.get(kind, -1)
+
+        assign = np.full(count, -1, dtype=np.int32)
+        if os.path.exists(self.centroids_path):
+            self._centroids = np.load(self.centroids_path)
+            if os.path.exists(self.lists_path):
+                stored = np.fromfile(self.lists_path, dtype=np.int32)[:count]
+                assign[:len(stored)] = stored
+            # 列表文件落后于向量文件时补齐分配
+            missing = np.nonzero(assign < 0)[0]
+            if len(missing) and count:
+                vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(count, self.dim))
+                assign[missing] = _nearest(vectors[missing], self._centroids)
+            assign.tofile(self.lists_path)
+
+        self._count = count
+        self._alive = alive
+        self._kinds = kinds
+        self._assign = assign
+        self._remap()
+        self._build_lists()
+
+    @staticmethod
+    def _truncate(path: str, size: int) -> None:
+        if os.path.exists(path) and os.path.getsize(path) > size:
+            with open(path, "r+b") as f:
+                f.truncate(size)
+
+    def _remap(self) -> None:
+        """行数变化后重新映射向量文件"""
+        self._vectors = None
+        if self._count:
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r",
+                                      shape=(self._count, self.dim))
+
+    def _build_lists(self) -> None:
+        """由每行的分配重建倒排列表（行号升序，利于顺序读取内存映射）"""
+        if self._centroids is None:
+            self._lists = []
+            return
+        nlist = len(self._centroids)
+        order = np.argsort(self._assign, kind="stable")
+        assigned = order[self._assign[order] >= 0]
+        counts = np.bincount(self._assign[assigned], minlength=nlist)
+        self._lists = np.split(assigned.astype(np.int64), np.cumsum(counts)[:-1])
+
+    # ---- 写入 ----
+
+    def replace(self, kind: str, ref_id: str, content_hash: Optional[str], title: str,
+                ref_type: Optional[str], chunks: Sequence[Tuple[int, str]], vectors: np.ndarray) -> int:
+        """用新的分块和向量替换对象原有的向量，返回写入的行数"""
+        vectors = normalize(vectors) if len(chunks) else np.zeros((0, self.dim), dtype=np.float32)
+        if vectors.shape != (len(chunks), self.dim):
+            raise ValueError(f"Expected {len(chunks)} vectors of dim {self.dim}, got {vectors.shape}")
+
+        with self._lock:
+            self._open()
+            self._mark_deleted(kind, [ref_id])
+            if not len(chunks):
+                self._db.commit()
+                return 0
+
+            start = self._count
+            rows = np.arange(start, start + len(chunks), dtype=np.int64)
+            assign = (_nearest(vectors, self._centroids) if self._centroids is not None
+                      else np.full(len(chunks), -1, dtype=np.int32))
+
+            # 先写向量再提交元数据，重启时以两者共有的行数为准
+            with open(self.vectors_path, "ab") as f:
+                f.write(vectors.tobytes())
+            if self._centroids is not None:
+                with open(self.lists_path, "ab") as f:
+                    f.write(assign.tobytes())
+            self._db.executemany(
+                "INSERT INTO chunks (row, kind, ref_id, content_hash, title, ref_type, chunk_offset, text) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(int(row), kind, ref_id, content_hash, title, ref_type, offset, text)
+                 for row, (offset, text) in zip(rows, chunks)]
+            )
+            self._db.commit()
+
+            self._count += len(chunks)
+            self._alive = np.concatenate([self._alive, np.ones(len(chunks), dtype=bool)])
+            self._kinds = np.concatenate([self._kinds, np.full(len(chunks), KIND_CODES[kind], dtype=np.int8)])
+            self._assign = np.concatenate([self._assign, assign])
+            if self._centroids is not None:
+                lists = list(self._lists)
+                for label in np.unique(assign):
+                    lists[label] = np.concatenate([lists[label], rows[assign == label]])
+                self._lists = lists
+            self._remap()
+
+            if self._centroids is None and int(self._alive.sum()) >= settings.VECTOR_INDEX_TRAIN_MIN:
+                self.train()
+            return len(chunks)
+
+    def remove(self, kind: str, ref_ids: Iterable[str]) -> int:
+        """删除对象的全部向量，返回删除的行数"""
+        with self._lock:
+            self._open()
+            removed = self._mark_deleted(kind, list(ref_ids))
+            self._db.commit()
+            return removed
+
+    def retain(self, kind: str, keep_ids: Set[str]) -> int:
+        """删除不在keep_ids中的该类型对象，返回删除的对象数"""
+        with self._lock:
+            self._open()
+            existing = [row[0] for row in self._db.execute(
+                "SELECT DISTINCT ref_id FROM chunks WHERE kind = ? AND deleted = 0", (kind,)
+            )]
+            stale = [ref_id for ref_id in existing if ref_id not in keep_ids]
+            self._mark_deleted(kind, stale)
+            self._db.commit()
+            return len(stale)
+
+    def _mark_deleted(self, kind: str, ref_ids: List[str]) -> int:
+        """将对象的现有行标记为删除（需持有锁，由调用方提交）"""
+        removed = 0
+        for start in range(0, len(ref_ids), 500):
+            batch = ref_ids[start:start + 500]
+            placeholders = ", ".join("?" for _ in batch)
+            rows = [row[0] for row in self._db.execute(
+                f"SELECT row FROM chunks WHERE kind = ? AND deleted = 0 AND ref_id IN ({placeholders})",
+                [kind, *batch]
+            )]
+            if rows:
+                self._db.execute(
+                    f"UPDATE chunks SET deleted = 1 WHERE kind = ? AND ref_id IN ({placeholders})", [kind, *batch]
+                )
+                alive = self._alive.copy()
+                alive[rows] = False
+                self._alive = alive
+                removed += len(rows)
+        return removed
+
+    def content_hashes(self, kind: str, ref_ids: List[str]) -> Dict[str, Optional[str]]:
+        """已索引对象的content_hash，用于跳过内容未变化的对象"""
+        with self._lock:
+            self._open()
+            hashes = {}
+            for start in range(0, len(ref_ids), 500):
+                batch = ref_ids[start:start + 500]
+                placeholders = ", ".join("?" for _ in batch)
+                for ref_id, content_hash in self._db.execute(
+                    f"SELECT ref_id, content_hash FROM chunks "
+                    f"WHERE kind = ? AND deleted = 0 AND ref_id IN ({placeholders})",
+                    [kind, *batch]
+                ):
+                    hashes[ref_id] = content_hash
+            return hashes
+
+    # ---- 训练 ----
+
+    def train(self, nlist: Optional[int] = None) -> int:
+        """在存活向量的样本上训练球面k-means聚类中心，并重新分配全部行，返回列表数"""
+        with self._lock:
+            self._open()
+            live_rows = np.nonzero(self._alive)[0]
+            if not len(live_rows):
+                return 0
+            nlist = nlist or settings.VECTOR_INDEX_NLIST or int(math.sqrt(len(live_rows)))
+            nlist = max(1, min(nlist, len(live_rows)))
+
+            rng = np.random.default_rng(0)
+            sample_size = min(len(live_rows), nlist * TRAIN_SAMPLES_PER_LIST)
+            sample_rows = np.sort(rng.choice(live_rows, sample_size, replace=False))
+            sample = np.asarray(self._vectors[sample_rows], dtype=np.float32)
+
+            centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+            for _ in range(max(1, settings.VECTOR_INDEX_TRAIN_ITERATIONS)):
+                labels = _nearest(sample, centroids)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, labels, sample)
+                counts = np.bincount(labels, minlength=nlist)
+                # 空簇用随机样本重新播种
+                empty = np.nonzero(counts == 0)[0]
+                if len(empty):
+                    sums[empty] = sample[rng.choice(sample_size, len(empty), replace=False)]
+                centroids = normalize(sums)
+
+            assign = _nearest(self._vectors, centroids)
+            temp_path = f"{self.centroids_path}.tmp.npy"
+            np.save(temp_path, centroids)
+            assign.tofile(self.lists_path)
+            os.replace(temp_path, self.centroids_path)
+
+            self._centroids = centroids
+            self._assign = assign
+            self._build_lists()
+            print(f"Trained vector index with {nlist} lists over {len(live_rows)} vectors")
+            return nlist
+
+    # ---- 查询 ----
+
+    def search(self, query_vector: np.ndarray, k: int = 10, kinds: Optional[Sequence[str]] = None,
+               nprobe: Optional[int] = None) -> List[Dict[str, Any]]:
+        """检索与查询向量最相似的k个分块（余弦相似度降序）"""
+        query = normalize(query_vector)[0]
+        with self._lock:
+            self._open()
+            # 只在锁内取快照，写入时各数组整体替换而非原地修改
+            vectors, alive, kind_codes = self._vectors, self._alive, self._kinds
+            centroids, lists, count = self._centroids, self._lists, self._count
+        if not count or k <= 0:
+            return []
+
+        wanted = None
+        if kinds:
+            wanted = np.array([KIND_CODES[kind] for kind in kinds if kind in KIND_CODES], dtype=np.int8)
+
+        if centroids is None:
+            # 尚未训练：分块暴力检索
+            best_rows, best_scores = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+            for start in range(0, count, SCAN_BLOCK_ROWS):
+                end = min(count, start + SCAN_BLOCK_ROWS)
+                rows = np.arange(start, end, dtype=np.int64)
+                mask = alive[start:end]
+                if wanted is not None:
+                    mask = mask & np.isin(kind_codes[start:end], wanted)
+                rows = rows[mask]
+                if not len(rows):
+                    continue
+                scores = np.asarray(vectors[start:end][mask], dtype=np.float32) @ query
+                best_rows, best_scores = _top_k(np.concatenate([best_rows, rows]),
+                                                np.concatenate([best_scores, scores]), k)
+        else:
+            nprobe = max(1, min(nprobe or settings.VECTOR_INDEX_NPROBE, len(centroids)))
+            probe = np.argpartition(-(centroids @ query), nprobe - 1)[:nprobe]
+            rows = np.sort(np.concatenate([lists[label] for label in probe]))
+            mask = alive[rows]
+            if wanted is not None:
+                mask &= np.isin(kind_codes[rows], wanted)
+            rows = rows[mask]
+            if not len(rows):
+                return []
+            scores = np.asarray(vectors[rows], dtype=np.float32) @ query
+            best_rows, best_scores = _top_k(rows, scores, k)
+
+        if not len(best_rows):
+            return []
+        return self._describe(best_rows, best_scores)
+
+    def _describe(self, rows: np.ndarray, scores: np.ndarray) -> List[Dict[str, Any]]:
+        """补充命中行的来源信息，保持得分顺序"""
+        placeholders = ", ".join("?" for _ in rows)
+        with self._lock:
+            found = {
+                row[0]: row for row in self._db.execute(
+                    f"SELECT row, kind, ref_id, title, ref_type, chunk_offset, text "
+                    f"FROM chunks WHERE row IN ({placeholders})",
+                    [int(row) for row in rows]
+                )
+            }
+        results = []
+        for row, score in zip(rows, scores):
+            item = found.get(int(row))
+            if item is None:
+                continue
+            results.append({
+                "kind": item[1],
+                "ref_id": item[2],
+                "title": item[3],
+                "ref_type": item[4],
+                "chunk_offset": item[5],
+                "text": item[6],
+                "score": float(score),
+            })
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        """索引规模与训练状态"""
+        with self._lock:
+            self._open()
+            return {
+                "rows": self._count,
+                "live_rows": int(self._alive.sum()),
+                "trained": self._centroids is not None,
+                "lists": len(self._centroids) if self._centroids is not None else 0,
+            }
+
+    def close(self) -> None:
+        """关闭元数据库"""
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+            self._vectors = None
+
+
+# 进程内共享的向量索引
+vector_index = VectorIndex()